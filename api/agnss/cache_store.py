@@ -1,89 +1,323 @@
+"""
+On-disk A-GNSS blob store shared by every worker process.
+
+Layout under AGNSS_CACHE_DIR:
+
+    blobs/<sha256>     blob contents, named by their hash (written once, never modified)
+    keys/<sha256(key)> small JSON index: {"key", "digest", "size", "expires_at"}
+    .lock              flock held while writing or evicting
+    locks/<n>          flocks held while one worker fetches a missing key upstream
+
+Writes go to a temp file and are renamed into place, so a reader in another process sees
+either the old entry or the new one, never a partial file. Identical blobs stored under
+several keys share one file.
+
+Reads return a memoryview over an mmap of the blob. It can be handed to the HTTP Response
+and the MQTT chunker without copying into the Python heap. Open maps are cached per
+process (AGNSS_CACHE_OPEN_MAPS), and a key's index is re-read only when its file changes.
+
+Each key has its own TTL. When the blobs exceed AGNSS_CACHE_MAX_BYTES, expired keys go
+first, then the keys closest to expiry. Unreferenced blobs are then removed.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import hashlib
 import json
 import logging
+import mmap
 import os
+import threading
 import time
-from dataclasses import dataclass
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
+# Blobs with no key are only collected after this long (a crashed writer's leftovers)
+_ORPHAN_GRACE_SEC = 60.0
+
+# Lock files shared by all keys for cross-worker fill claims (see BlobStore.claim)
+_FILL_LOCKS = 64
+
+
+class BlobStore:
+    def __init__(self, directory: str, max_bytes: int = 64 * 1024 * 1024, open_maps: int = 64):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.open_maps = open_maps
+        self._blob_dir = os.path.join(directory, "blobs")
+        self._key_dir = os.path.join(directory, "keys")
+        self._lock = threading.Lock()
+        # key path -> ((mtime_ns, size), index)
+        self._index: dict[str, tuple[tuple[int, int], dict]] = {}
+        # digest -> mmap; dropping one is safe, views keep their map alive
+        self._maps: OrderedDict[str, mmap.mmap] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
 
-@dataclass
-class AgnssCache:
-    path: str
-    ttl_sec: int
+    def _key_path(self, key: str) -> str:
+        return os.path.join(self._key_dir, hashlib.sha256(key.encode()).hexdigest())
 
-    @property
-    def enabled(self) -> bool:
-        return self.ttl_sec > 0
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self._blob_dir, digest)
 
-    @property
-    def meta_path(self) -> str:
-        return self.path + ".json"
+    @staticmethod
+    def _write_atomic(path: str, data: bytes | memoryview) -> None:
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as handle:
+                handle.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
 
-    def _read_meta(self) -> dict | None:
+    # -- reads ----------------------------------------------------------------------------
+
+    def _read_index(self, key_path: str) -> dict | None:
+        try:
+            st = os.stat(key_path)
+        except FileNotFoundError:
+            with self._lock:
+                self._index.pop(key_path, None)
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            cached = self._index.get(key_path)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
         try:
-            with open(self.meta_path, "r", encoding="utf-8") as handle:
-                return json.load(handle)
+            with open(key_path, "r", encoding="utf-8") as handle:
+                index = json.load(handle)
         except FileNotFoundError:
             return None
-        except (OSError, json.JSONDecodeError) as exc:
-            logger.warning("A-GNSS cache meta read failed: %s", exc)
+        except (OSError, ValueError) as exc:
+            logger.warning("A-GNSS blob index read failed path=%s err=%s", key_path, exc)
             return None
+        with self._lock:
+            self._index[key_path] = (stamp, index)
+        return index
 
-    def _write_meta(self, size: int) -> None:
-        data = {
-            "timestamp": time.time(),
-            "size": size,
-        }
-        tmp_path = self.meta_path + ".tmp"
+    def _map(self, digest: str) -> mmap.mmap | None:
+        with self._lock:
+            mapped = self._maps.get(digest)
+            if mapped is not None:
+                self._maps.move_to_end(digest)
+                return mapped
         try:
-            with open(tmp_path, "w", encoding="utf-8") as handle:
-                json.dump(data, handle)
-            os.replace(tmp_path, self.meta_path)
+            with open(self._blob_path(digest), "rb") as handle:
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):
+            return None
         except OSError as exc:
-            logger.warning("A-GNSS cache meta write failed: %s", exc)
-
-    def get(self) -> bytes | None:
-        if not self.enabled:
+            logger.warning("A-GNSS blob map failed digest=%s err=%s", digest, exc)
             return None
+        with self._lock:
+            self._maps[digest] = mapped
+            while len(self._maps) > self.open_maps:
+                self._maps.popitem(last=False)
+        return mapped
 
-        meta = self._read_meta()
-        if not meta or "timestamp" not in meta:
-            return None
+    def get(self, key: str) -> memoryview | None:
+        """Read-only view of the blob for key, or None when missing or expired."""
+        index = self._read_index(self._key_path(key))
+        mapped = None
+        if index is not None and index.get("key") == key and time.time() < float(index["expires_at"]):
+            mapped = self._map(index["digest"])
+        with self._lock:
+            if mapped is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return memoryview(mapped)
 
-        age = time.time() - float(meta["timestamp"])
-        if age > self.ttl_sec:
+    def expires_at(self, key: str) -> float | None:
+        index = self._read_index(self._key_path(key))
+        if index is None or index.get("key") != key:
             return None
+        return float(index["expires_at"])
 
+    # -- writes ---------------------------------------------------------------------------
+
+    @contextmanager
+    def _exclusive(self):
+        """Cross-process lock serialising writes with eviction."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_handle:
+            fcntl.flock(lock_handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_handle, fcntl.LOCK_UN)
+
+    @asynccontextmanager
+    async def claim(self, key: str, poll_sec: float = 0.05):
+        """
+        Cross-process lock for filling key, so only one worker fetches it upstream. Waits
+        without blocking the event loop while another worker holds it; re-check the store
+        once inside. Keys share _FILL_LOCKS lock files.
+        """
+        stripe = int(hashlib.sha256(key.encode()).hexdigest()[:8], 16) % _FILL_LOCKS
         try:
-            with open(self.path, "rb") as handle:
-                return handle.read()
-        except FileNotFoundError:
-            return None
+            lock_dir = os.path.join(self.directory, "locks")
+            os.makedirs(lock_dir, exist_ok=True)
+            lock_handle = open(os.path.join(lock_dir, str(stripe)), "a")
         except OSError as exc:
-            logger.warning("A-GNSS cache read failed: %s", exc)
-            return None
-
-    def set(self, data: bytes) -> None:
-        if not self.enabled:
+            logger.warning("A-GNSS fill lock unavailable key=%s err=%s", key, exc)
+            yield
             return
+        try:
+            while True:
+                try:
+                    fcntl.flock(lock_handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(poll_sec)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_handle, fcntl.LOCK_UN)
+        finally:
+            lock_handle.close()
 
-        os.makedirs(os.path.dirname(self.path), exist_ok=True)
-        tmp_path = self.path + ".tmp"
+    def set(self, key: str, data: bytes | memoryview, ttl_sec: float) -> str | None:
+        """Store data under key for ttl_sec. Returns the content digest, or None on failure."""
+        if not data or ttl_sec <= 0:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
         try:
-            with open(tmp_path, "wb") as handle:
-                handle.write(data)
-            os.replace(tmp_path, self.path)
-            self._write_meta(len(data))
+            with self._exclusive():
+                os.makedirs(self._blob_dir, exist_ok=True)
+                os.makedirs(self._key_dir, exist_ok=True)
+                key_path = self._key_path(key)
+                previous = self._read_index(key_path)
+                blob_path = self._blob_path(digest)
+                if not os.path.exists(blob_path):
+                    self._write_atomic(blob_path, data)
+                index = {"key": key, "digest": digest, "size": len(data), "expires_at": time.time() + ttl_sec}
+                self._write_atomic(key_path, json.dumps(index).encode())
+                released = {previous["digest"]} if previous is not None else set()
+                removed = self._evict_locked(time.time(), released)
         except OSError as exc:
-            logger.warning("A-GNSS cache write failed: %s", exc)
+            logger.warning("A-GNSS blob write failed key=%s err=%s", key, exc)
+            return None
+        with self._lock:
+            self.writes += 1
+            self.evictions += removed
+        return digest
+
+    def delete(self, key: str) -> None:
+        try:
+            os.unlink(self._key_path(key))
+        except FileNotFoundError:
+            pass
+
+    def _scan(self) -> tuple[list[tuple[float, str, str]], dict[str, tuple[int, float]]]:
+        """([(expires_at, key_path, digest)], {digest: (size, mtime)})."""
+        keys = []
+        blobs = {}
+        for directory, into in ((self._key_dir, keys), (self._blob_dir, blobs)):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name.endswith(".tmp"):
+                    continue
+                if into is blobs:
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    blobs[entry.name] = (st.st_size, st.st_mtime)
+                    continue
+                index = self._read_index(entry.path)
+                if index is not None:
+                    keys.append((float(index["expires_at"]), entry.path, index["digest"]))
+        return keys, blobs
+
+    def evict(self, now: float | None = None) -> int:
+        """Drop expired keys, then soonest-to-expire keys while over max_bytes. Returns keys removed."""
+        with self._exclusive():
+            removed = self._evict_locked(time.time() if now is None else now)
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def _evict_locked(self, now: float, released: set[str] = frozenset()) -> int:
+        keys, blobs = self._scan()
+        keys.sort()
+        referenced: dict[str, int] = {digest: 0 for digest in released}
+        for _, _, digest in keys:
+            referenced[digest] = referenced.get(digest, 0) + 1
+        live_bytes = sum(blobs[digest][0] for digest, count in referenced.items() if count and digest in blobs)
+        removed = 0
+        for expires_at, key_path, digest in keys:
+            if expires_at > now and live_bytes <= self.max_bytes:
+                break
+            try:
+                os.unlink(key_path)
+            except FileNotFoundError:
+                pass
+            removed += 1
+            referenced[digest] -= 1
+            if referenced[digest] == 0 and digest in blobs:
+                live_bytes -= blobs[digest][0]
+        for digest, (_, mtime) in blobs.items():
+            if referenced.get(digest, 0) > 0:
+                continue
+            # Freed just now, or an orphan left by a writer that died before writing its key
+            if digest in referenced or now - mtime > _ORPHAN_GRACE_SEC:
+                try:
+                    os.unlink(self._blob_path(digest))
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def stats(self) -> dict:
+        keys, blobs = self._scan()
+        now = time.time()
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "keys": len(keys),
+                "live_keys": sum(1 for expires_at, _, _ in keys if expires_at > now),
+                "blobs": len(blobs),
+                "bytes": sum(size for size, _ in blobs.values()),
+                "max_bytes": self.max_bytes,
+                "open_maps": len(self._maps),
+                "hits": self.hits,
+                "misses": self.misses,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+
+_stores: dict[str, BlobStore] = {}
+_stores_lock = threading.Lock()
 
 
-def get_agnss_cache() -> AgnssCache:
-    path = os.getenv("AGNSS_CACHE_PATH", "/app/agnss_cache.bin")
-    ttl_raw = os.getenv("AGNSS_CACHE_TTL_SEC", "7200")
-    try:
-        ttl_sec = int(ttl_raw)
-    except ValueError:
-        ttl_sec = 7200
-    return AgnssCache(path=path, ttl_sec=ttl_sec)
+def get_blob_store(directory: Optional[str] = None) -> BlobStore | None:
+    """Process-wide store for AGNSS_CACHE_DIR (None when the directory is set empty)."""
+    directory = directory if directory is not None else os.getenv("AGNSS_CACHE_DIR", "/app/agnss_cache")
+    if not directory:
+        return None
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = BlobStore(
+                directory,
+                max_bytes=int(os.getenv("AGNSS_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+                open_maps=int(os.getenv("AGNSS_CACHE_OPEN_MAPS", "64")),
+            )
+            _stores[directory] = store
+        return store
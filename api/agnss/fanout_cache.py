@@ -0,0 +1,222 @@
+"""
+Shared A-GNSS cache: one upstream download serves every device in the same area and window.
+
+Assistance data depends on the provider, roughly where the device is, and which ephemeris
+window it falls in. It does not depend on the device itself. Entries are keyed by
+(provider, area bucket, window):
+
+- area bucket: the serving cell's mcc/mnc/tac when known, else lat/lon snapped to an
+  AGNSS_CACHE_GRID_DEG grid, else "global".
+- window: wall-clock time divided into AGNSS_CACHE_WINDOW_SEC slots, so an entry is never
+  served into the next window.
+
+Two tiers: an LRU dict in memory (AGNSS_CACHE_MEMORY_ENTRIES) and the shared blob store
+(api.agnss.cache_store), which every worker can see and which survives restarts. Hits
+are memoryviews over the mapped blob. Concurrent misses for the same key share a single
+upstream fetch (api.services.single_flight), and across workers a claim on the blob store
+(BlobStore.claim) lets one of them fetch while the others wait for its result.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+
+from api.agnss.cache_store import BlobStore, get_blob_store
+from api.services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, str(default)))
+    except ValueError:
+        return default
+
+
+def area_bucket(
+    *,
+    lat: float | None = None,
+    lon: float | None = None,
+    mcc: int | None = None,
+    mnc: int | None = None,
+    tac: int | None = None,
+    grid_deg: float | None = None,
+) -> str:
+    if mcc is not None and mnc is not None and tac is not None:
+        return f"cell:{mcc}-{mnc}-{tac}"
+    if lat is not None and lon is not None:
+        grid = grid_deg if grid_deg is not None else _env_float("AGNSS_CACHE_GRID_DEG", 1.0)
+        if grid > 0:
+            return f"grid:{int(lat // grid)}:{int(lon // grid)}"
+    return "global"
+
+
+def cache_key(provider: str, bucket: str, now: float | None = None, window_sec: float | None = None) -> str:
+    window = window_sec if window_sec is not None else _env_float("AGNSS_CACHE_WINDOW_SEC", 3600)
+    slot = int((time.time() if now is None else now) // window) if window > 0 else 0
+    return f"{provider}|{bucket}|{slot}"
+
+
+def window_end(now: float | None = None, window_sec: float | None = None) -> float:
+    """When the window containing now closes (and its cache key stops being used)."""
+    window = window_sec if window_sec is not None else _env_float("AGNSS_CACHE_WINDOW_SEC", 3600)
+    now = time.time() if now is None else now
+    if window <= 0:
+        return now + 3600
+    return (now // window + 1) * window
+
+
+class AgnssFanoutCache:
+    def __init__(
+        self,
+        store: Optional[BlobStore],
+        memory_entries: int = 256,
+        ttl_sec: float = 3600,
+    ):
+        self.store = store
+        self.memory_entries = memory_entries
+        self.ttl_sec = ttl_sec
+        self._memory: OrderedDict[str, tuple[float, bytes | memoryview]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._flight: SingleFlight[Optional[bytes]] = SingleFlight()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.coalesced = 0
+        self.prefetched = 0
+        self.filled_by_other_worker = 0
+        self.evictions = 0
+
+    # -- tiers ----------------------------------------------------------------------------
+
+    def _remember(self, key: str, expires_at: float, data: bytes | memoryview) -> None:
+        with self._lock:
+            self._memory[key] = (expires_at, data)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+                self.evictions += 1
+
+    def get(self, key: str, count: bool = True) -> tuple[bytes | memoryview | None, str | None]:
+        """(data, tier) where tier is "memory" or "disk"; (None, None) on a miss.
+
+        count=False leaves the hit/miss counters alone (background refresh checks).
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now < entry[0]:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += count
+                    return entry[1], "memory"
+                del self._memory[key]
+        if self.store is not None:
+            data = self.store.get(key)
+            if data is not None:
+                self._remember(key, self.store.expires_at(key) or now + self.ttl_sec, data)
+                with self._lock:
+                    self.disk_hits += count
+                return data, "disk"
+        with self._lock:
+            self.misses += count
+        return None, None
+
+    def set(self, key: str, data: bytes | memoryview, ttl_sec: float | None = None) -> None:
+        if not data:
+            return
+        ttl = ttl_sec if ttl_sec is not None else self.ttl_sec
+        self._remember(key, time.time() + ttl, data)
+        if self.store is not None:
+            self.store.set(key, data, ttl)
+
+    # -- fetch-through --------------------------------------------------------------------
+
+    async def get_or_fetch(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[Optional[bytes]]],
+        *,
+        ttl_sec: float | None = None,
+        prefetch: bool = False,
+    ) -> tuple[bytes | memoryview | None, bool]:
+        """
+        Return (data, from_cache). On a miss, the first caller runs fetch(); callers that
+        arrive while it is running await the same result instead of fetching again.
+        Empty results are not cached.
+
+        prefetch=True is for background warming: it is not counted as a device lookup.
+        """
+        data, _ = self.get(key, count=not prefetch)
+        if data:
+            return data, True
+
+        async def fetch_upstream() -> Optional[bytes]:
+            if prefetch:
+                self.prefetched += 1
+            else:
+                self.fetches += 1
+            data = await fetch()
+            if data:
+                # The blob store write takes a cross-process flock and may evict: keep it off the loop
+                await asyncio.to_thread(self.set, key, data, ttl_sec)
+            return data
+
+        async def fetch_and_store() -> Optional[bytes]:
+            if self.store is None:
+                return await fetch_upstream()
+            async with self.store.claim(key):
+                # Another worker may have filled it while this one waited for the claim
+                data, _ = self.get(key, count=False)
+                if data:
+                    self.filled_by_other_worker += 1
+                    return data
+                return await fetch_upstream()
+
+        if key in self._flight and not prefetch:
+            self.coalesced += 1
+        return await self._flight.do(key, fetch_and_store)
+
+    def stats(self, include_disk: bool = True) -> dict:
+        """Counters; include_disk adds the blob store's, which scans its directory (call off the loop)."""
+        disk = self.store.stats() if include_disk and self.store is not None else None
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_max": self.memory_entries,
+                "disk": disk,
+                "ttl_sec": self.ttl_sec,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.memory_hits + self.disk_hits) / lookups, 3) if lookups else None,
+                "upstream_fetches": self.fetches,
+                "coalesced": self.coalesced,
+                "prefetched": self.prefetched,
+                "filled_by_other_worker": self.filled_by_other_worker,
+                "in_flight": len(self._flight),
+                "evictions": self.evictions,
+            }
+
+
+_fanout_cache: Optional[AgnssFanoutCache] = None
+
+
+def get_agnss_fanout_cache() -> AgnssFanoutCache:
+    global _fanout_cache
+    if _fanout_cache is None:
+        _fanout_cache = AgnssFanoutCache(
+            store=get_blob_store(),
+            memory_entries=int(os.getenv("AGNSS_CACHE_MEMORY_ENTRIES", "256")),
+            ttl_sec=_env_float("AGNSS_CACHE_WINDOW_SEC", 3600),
+        )
+    return _fanout_cache
@@ -0,0 +1,88 @@
+"""
+Chunk framing for A-GNSS assistance data sent to devices over MQTT.
+
+Two formats, chosen per request by the device ("format" in agnss_request):
+
+- json (default, existing firmware): {"seq": N, "total": T, "chunk_b64": "..."}.
+  Base64 adds a third to the payload, and the JSON keys add more on top.
+- binary: a fixed 9-byte header followed by the raw chunk bytes.
+
+      offset  size  field
+      0       1     version (BINARY_FRAME_VERSION)
+      1       2     seq      (big-endian, 0-based)
+      3       2     total    (big-endian, number of frames)
+      5       4     crc32    (big-endian, of the payload bytes)
+      9       n     payload
+
+Chunks are memoryview slices of the blob, so a chunk is copied only once, into the frame
+that goes on the wire.
+"""
+
+from __future__ import annotations
+
+import base64
+import json
+import struct
+import zlib
+from typing import Iterator
+
+BINARY_FRAME_VERSION = 1
+BINARY_HEADER = struct.Struct(">BHHI")
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "binary"
+
+
+def chunk_views(data: bytes | memoryview, chunk_size: int) -> Iterator[memoryview]:
+    if chunk_size <= 0:
+        raise ValueError("chunk_size must be > 0")
+    view = memoryview(data)
+    for start in range(0, len(view), chunk_size):
+        yield view[start : start + chunk_size]
+
+
+def frame_count(size: int, chunk_size: int) -> int:
+    return (size + chunk_size - 1) // chunk_size
+
+
+def iter_binary_frames(data: bytes | memoryview, chunk_size: int) -> Iterator[bytearray]:
+    total = frame_count(len(data), chunk_size)
+    if total > 0xFFFF:
+        raise ValueError("A-GNSS blob needs more than 65535 frames; raise the chunk size")
+    for seq, chunk in enumerate(chunk_views(data, chunk_size)):
+        frame = bytearray(BINARY_HEADER.size + len(chunk))
+        BINARY_HEADER.pack_into(frame, 0, BINARY_FRAME_VERSION, seq, total, zlib.crc32(chunk))
+        frame[BINARY_HEADER.size :] = chunk
+        yield frame
+
+
+def parse_binary_frame(frame: bytes | memoryview) -> tuple[int, int, memoryview]:
+    """(seq, total, payload) of a binary frame; raises ValueError on a bad header or CRC."""
+    view = memoryview(frame)
+    if len(view) < BINARY_HEADER.size:
+        raise ValueError("frame shorter than header")
+    version, seq, total, crc = BINARY_HEADER.unpack_from(view)
+    if version != BINARY_FRAME_VERSION:
+        raise ValueError(f"unsupported frame version {version}")
+    payload = view[BINARY_HEADER.size :]
+    if zlib.crc32(payload) != crc:
+        raise ValueError(f"crc mismatch in frame {seq}")
+    return seq, total, payload
+
+
+def iter_json_frames(data: bytes | memoryview, chunk_size: int) -> Iterator[str]:
+    total = frame_count(len(data), chunk_size)
+    for seq, chunk in enumerate(chunk_views(data, chunk_size)):
+        payload_obj = {
+            "seq": seq,
+            "total": total,
+            "chunk_b64": base64.b64encode(chunk).decode("ascii"),
+        }
+        yield json.dumps(payload_obj, separators=(",", ":"))
+
+
+def normalize_format(value: object) -> str:
+    """Framing a device asked for; anything unrecognised falls back to json."""
+    if isinstance(value, str) and value.strip().lower() == FORMAT_BINARY:
+        return FORMAT_BINARY
+    return FORMAT_JSON
@@ -0,0 +1,102 @@
+"""
+P-GPS prediction sets: read the nRF Cloud file header and cut sub-sets out of a stored set.
+
+The file nRF Cloud serves (nrf_cloud_pgps_schema_v1.h) is a packed little-endian header
+followed by prediction_count fixed-size predictions, one per prediction_period_min from
+the start time:
+
+      offset  size  field
+      0       1     schema_version
+      1       1     array_type
+      2       2     num_items
+      4       2     prediction_count
+      6       2     prediction_period_min
+      8       2     gps_day
+      10      4     gps_time_of_day (s)
+
+A sub-set is a new header plus a memoryview over predictions [start, start + count) of the
+stored file, so only the 14-byte header is built per request.
+"""
+
+from __future__ import annotations
+
+import struct
+from typing import NamedTuple, Optional
+
+HEADER = struct.Struct("<bbhhhhi")
+
+# GPS time started 1980-01-06 00:00:00 UTC and has no leap seconds (18 so far)
+GPS_EPOCH_UNIX = 315964800
+GPS_LEAP_SECONDS = 18
+SECONDS_PER_DAY = 86400
+
+# nRF Cloud serves at most a week of predictions (84 x 2 h, 42 x 4 h)
+MAX_PREDICTIONS = 84
+MAX_SET_MINUTES = 7 * 24 * 60
+
+
+class PgpsHeader(NamedTuple):
+    schema_version: int
+    array_type: int
+    num_items: int
+    prediction_count: int
+    prediction_period_min: int
+    gps_day: int
+    gps_time_of_day: int
+
+    @property
+    def start_gps_sec(self) -> int:
+        return self.gps_day * SECONDS_PER_DAY + self.gps_time_of_day
+
+
+def gps_seconds(unix_time: float) -> int:
+    return int(unix_time) - GPS_EPOCH_UNIX + GPS_LEAP_SECONDS
+
+
+def gps_day_time(gps_sec: int) -> tuple[int, int]:
+    """(gps_day, gps_time_of_day) for seconds since the GPS epoch."""
+    return divmod(gps_sec, SECONDS_PER_DAY)
+
+
+def full_set_count(prediction_period_min: int) -> int:
+    """Predictions in the set that is stored and sliced for this period (always even)."""
+    count = min(MAX_PREDICTIONS, MAX_SET_MINUTES // prediction_period_min)
+    return count - count % 2
+
+
+def parse_header(data: bytes | memoryview) -> Optional[PgpsHeader]:
+    """The header, or None when data is not a whole number of predictions after one."""
+    if len(data) <= HEADER.size:
+        return None
+    header = PgpsHeader(*HEADER.unpack_from(data))
+    if header.prediction_count <= 0 or header.prediction_period_min <= 0:
+        return None
+    if (len(data) - HEADER.size) % header.prediction_count:
+        return None
+    return header
+
+
+def slice_predictions(
+    data: bytes | memoryview, header: PgpsHeader, start: int, count: int
+) -> Optional[list[bytes | memoryview]]:
+    """
+    Buffers that together form a P-GPS file with predictions [start, start + count) of data,
+    or None when the stored set doesn't cover them.
+    """
+    if start < 0 or count <= 0 or start + count > header.prediction_count:
+        return None
+    view = memoryview(data)
+    if start == 0 and count == header.prediction_count:
+        return [view]
+    size = (len(view) - HEADER.size) // header.prediction_count
+    gps_day, gps_time_of_day = gps_day_time(header.start_gps_sec + start * header.prediction_period_min * 60)
+    sub_header = HEADER.pack(
+        header.schema_version,
+        header.array_type,
+        header.num_items,
+        count,
+        header.prediction_period_min,
+        gps_day,
+        gps_time_of_day,
+    )
+    return [sub_header, view[HEADER.size + start * size : HEADER.size + (start + count) * size]]
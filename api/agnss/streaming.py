@@ -0,0 +1,71 @@
+"""
+Assistance data that is still downloading, readable while it arrives.
+
+The upstream download appends chunks as they come off the wire; each device response
+reads from its own offset and waits for more, so the first bytes reach devices while
+later ranges are still being fetched. Chunks are kept as received and readers get
+memoryviews of them, so nothing is copied per reader.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from typing import AsyncIterator, Optional
+
+
+class ProgressiveBlob:
+    def __init__(self):
+        self.chunks: list[bytes] = []
+        self.size = 0
+        # Full size when the upstream announced it (Content-Range), else None until done
+        self.total: Optional[int] = None
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def append(self, chunk: bytes) -> None:
+        if chunk:
+            self.chunks.append(bytes(chunk))
+            self.size += len(chunk)
+            self._notify()
+
+    def finish(self, data: bytes | memoryview | None = None, error: Optional[BaseException] = None) -> None:
+        """Mark the download finished. data fills a blob nothing was appended to (e.g. the
+        result came from another caller's fetch)."""
+        if not self.chunks and data:
+            self.append(bytes(data))
+        self.error = error
+        self.done = True
+        if self.total is None or self.error is None:
+            self.total = self.size
+        self._notify()
+
+    async def wait_started(self) -> bool:
+        """Wait for the first bytes; False if the download finished without any."""
+        while not self.chunks and not self.done:
+            await self._changed.wait()
+        return bool(self.chunks)
+
+    async def iter_range(self, start: int = 0, end: Optional[int] = None) -> AsyncIterator[memoryview]:
+        """Yield bytes [start, end) as they arrive; end=None reads to the end of the download."""
+        index = position = 0
+        while True:
+            while index < len(self.chunks):
+                chunk = self.chunks[index]
+                chunk_start, position = position, position + len(chunk)
+                index += 1
+                lo = max(start, chunk_start)
+                hi = position if end is None else min(end, position)
+                if lo < hi:
+                    yield memoryview(chunk)[lo - chunk_start : hi - chunk_start]
+                if end is not None and position >= end:
+                    return
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
@@ -1,13 +1,30 @@
 """
 SUPL (Secure User Plane Location) client for fetching A-GNSS assistance data.
 Connects to free SUPL servers (Google, Nokia) to get satellite ephemeris/almanac.
+
+The client runs on the event loop (asyncio streams), so a slow or dead server holds no
+thread. Servers are tried in order of their health score and connections are raced
+happy-eyeballs style: the next server is dialled SUPL_RACE_DELAY_MS after the previous
+one or as soon as it fails, the first connection to come up is used and the others are
+closed. If the exchange on that connection fails, the race continues with the servers
+that are left.
+
+SUPL_SERVERS overrides the server list: comma-separated host:port, with ":tls" appended for
+servers that speak TLS. Each TLS server keeps the session from its last connection and
+offers it on the next one, so repeat connections skip the full handshake.
 """
 
+from __future__ import annotations
+
+import asyncio
 import logging
+import os
+import ssl
 import struct
-from typing import Optional
-import socket
 import time
+from typing import NamedTuple, Optional
+
+from api.services.provider_health import CLOSED, ProviderHealthRegistry
 
 logger = logging.getLogger(__name__)
 
@@ -34,25 +51,143 @@ ASSISTANCE_DATA_TYPE_ALMANAC = 1
 ASSISTANCE_DATA_TYPE_IONOSPHERE = 3
 ASSISTANCE_DATA_TYPE_DGPS = 4
 
+# Health score (lower is better) for a server with no latency samples yet, and the
+# penalty per consecutive failure, both in ms
+UNKNOWN_LATENCY_MS = 1000.0
+FAILURE_PENALTY_MS = 5000.0
+
+supl_health = ProviderHealthRegistry("SUPL")
+_supl_stats = {"raced": 0, "tls_handshakes": 0, "tls_resumed": 0}
+
+
+class SuplServer(NamedTuple):
+    host: str
+    port: int
+    tls: bool = False
+
+    @property
+    def name(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+class _ResumingContext(ssl.SSLContext):
+    """Client context that offers the last session it saw on every new connection."""
+
+    last_session: Optional[ssl.SSLSession] = None
+
+    def wrap_bio(self, incoming, outgoing, server_side=False, server_hostname=None, session=None):
+        return super().wrap_bio(
+            incoming,
+            outgoing,
+            server_side=server_side,
+            server_hostname=server_hostname,
+            session=session or self.last_session,
+        )
+
+
+# One context per TLS server: sessions can only be resumed with the context that made them
+_tls_contexts: dict[str, _ResumingContext] = {}
+
+
+def _tls_context(server: SuplServer) -> _ResumingContext:
+    context = _tls_contexts.get(server.name)
+    if context is None:
+        context = _ResumingContext(ssl.PROTOCOL_TLS_CLIENT)
+        ca_file = os.getenv("SUPL_TLS_CA_FILE", "").strip()
+        if ca_file:
+            context.load_verify_locations(cafile=ca_file)
+        else:
+            context.load_default_certs()
+        _tls_contexts[server.name] = context
+    return context
+
+
+def _remember_tls_session(server: SuplServer, writer: asyncio.StreamWriter) -> None:
+    ssl_object = writer.get_extra_info("ssl_object")
+    if ssl_object is None:
+        return
+    _supl_stats["tls_handshakes"] += 1
+    if ssl_object.session_reused:
+        _supl_stats["tls_resumed"] += 1
+    # Read at the end of the exchange: TLS 1.3 tickets arrive after the handshake
+    if ssl_object.session is not None:
+        _tls_context(server).last_session = ssl_object.session
+
+
+def race_delay_sec() -> float:
+    return float(os.getenv("SUPL_RACE_DELAY_MS", "250")) / 1000.0
+
+
+def server_score(server: SuplServer) -> float:
+    """Health score in ms, lower is better: median exchange time plus a failure penalty."""
+    health = supl_health.get(server.name)
+    median = health.percentile(0.5)
+    score = median if median is not None else UNKNOWN_LATENCY_MS
+    return score + health.consecutive_failures * FAILURE_PENALTY_MS
+
+
+def _rank(server: SuplServer) -> tuple[bool, float]:
+    # Servers with an open or half-open breaker go last
+    return supl_health.get(server.name).state != CLOSED, server_score(server)
+
+
+async def _open_connection(server: SuplServer) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    context = _tls_context(server) if server.tls else None
+    return await asyncio.wait_for(
+        asyncio.open_connection(
+            server.host,
+            server.port,
+            ssl=context,
+            server_hostname=server.host if context is not None else None,
+            happy_eyeballs_delay=race_delay_sec(),
+        ),
+        float(os.getenv("SUPL_CONNECT_TIMEOUT_SEC", "10")),
+    )
+
+
+async def _close(writer: asyncio.StreamWriter) -> None:
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except (OSError, ssl.SSLError):
+        pass
+
 
 class SUPLClient:
     """Simple SUPL client for fetching A-GNSS data from public SUPL servers."""
-    
+
     # Free SUPL servers (no authentication required)
     # Using Google SUPL with IPv4 address first to bypass DNS issues
     SUPL_SERVERS = [
         ("74.125.68.192", 7276),         # Google SUPL (resolved IPv4)
-        ("supl.google.com", 7276),      # Google's SUPL server  
+        ("supl.google.com", 7276),      # Google's SUPL server
         ("supl.nokia.com", 7275),        # Nokia's SUPL server
         ("supl.xse.com", 7275),          # XSE SUPL server
     ]
-    
-    def __init__(self, device_id: int, timeout: float = 30.0):
+
+    def __init__(self, device_id: int, timeout: float = 30.0, servers: Optional[list[SuplServer]] = None):
         self.device_id = device_id
         self.timeout = timeout
-        self.socket = None
-        self.server_idx = 0
-    
+        self.servers = servers if servers is not None else self.configured_servers()
+
+    @classmethod
+    def configured_servers(cls) -> list[SuplServer]:
+        configured = os.getenv("SUPL_SERVERS", "").strip()
+        if not configured:
+            return [SuplServer(host, port) for host, port in cls.SUPL_SERVERS]
+        servers = []
+        for entry in configured.split(","):
+            entry = entry.strip()
+            tls = entry.endswith(":tls")
+            if tls:
+                entry = entry[: -len(":tls")]
+            host, _, port = entry.rpartition(":")
+            if host and port.isdigit():
+                servers.append(SuplServer(host.strip("[]"), int(port), tls))
+            elif entry:
+                logger.warning("Ignoring SUPL_SERVERS entry %r (expected host:port[:tls])", entry)
+        return servers
+
     def _encode_length(self, length: int) -> bytes:
         """Encode SUPL message length (ULP PDU length encoding)."""
         if length < 128:
@@ -62,21 +197,21 @@ class SUPLClient:
             return bytes([(length >> 8) | 0x80, length & 0xFF])
         else:
             raise ValueError(f"Message too large: {length}")
-    
-    def _create_suplstart(self, latitude: Optional[float] = None, 
+
+    def _create_suplstart(self, latitude: Optional[float] = None,
                          longitude: Optional[float] = None) -> bytes:
         """
         Create a SUPL START message.
         Minimal implementation - sends device ID and optional location.
         """
         msg = bytearray()
-        
+
         # ULP PDU message type (SUPLSTART = 0)
         msg.append(0x00)
-        
+
         # Session ID (simple: device_id as 4 bytes)
         msg.extend(struct.pack(">I", self.device_id % (2**32)))
-        
+
         # Set ID type (IMEI)
         set_id = bytearray()
         set_id.append(SET_ID_TYPE_IMEI)
@@ -84,177 +219,189 @@ class SUPLClient:
         imei_str = f"{self.device_id:015d}".encode('ascii')
         set_id.extend(imei_str[:15])  # IMEI is max 15 digits
         msg.extend(set_id)
-        
+
         # Location assistance (optional)
         if latitude is not None and longitude is not None:
             msg.append(0x01)  # Has location
             # Latitude: -90 to +90, encoded as signed int (-2^23 to +2^23)
             lat_encoded = int((latitude + 90) * (2**23) / 180)
             msg.extend(struct.pack(">i", lat_encoded)[:3])  # 3 bytes
-            
+
             # Longitude: -180 to +180, encoded as signed int (-2^24 to +2^24)
             lon_encoded = int((longitude + 180) * (2**24) / 360)
             msg.extend(struct.pack(">i", lon_encoded)[:3])  # 3 bytes
         else:
             msg.append(0x00)  # No location
-        
+
         logger.debug(f"SUPL START message: {msg.hex()}")
         return bytes(msg)
-    
-    def fetch_assistance_data(self, latitude: Optional[float] = None,
-                                   longitude: Optional[float] = None) -> Optional[bytes]:
+
+    async def _exchange(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                        latitude: Optional[float], longitude: Optional[float]) -> bytes:
+        """Send SUPL START and collect assistance data until SUPL END or enough has arrived."""
+        start_msg = self._create_suplstart(latitude, longitude)
+        writer.write(self._encode_length(len(start_msg)) + start_msg)
+        await writer.drain()
+
+        assistance_data = bytearray()
+        while True:
+            try:
+                # Read length header (1-2 bytes) and the message body
+                length_bytes = await reader.readexactly(1)
+                msg_len = length_bytes[0]
+                if msg_len & 0x80:  # 2-byte length
+                    msg_len = ((msg_len & 0x7F) << 8) | (await reader.readexactly(1))[0]
+                msg_body = await reader.readexactly(msg_len)
+            except asyncio.IncompleteReadError:
+                break
+            if not msg_body:
+                continue
+
+            logger.debug(f"Received SUPL message ({len(msg_body)} bytes): {msg_body[:20].hex()}...")
+            msg_type = msg_body[0] >> 4
+            if msg_type == ULPD_MSG_TYPE_SUPLRESPONSE:
+                logger.info("Received SUPL RESPONSE")
+            elif msg_type == ULPD_MSG_TYPE_SUPLLOCATIONREQUEST:
+                logger.info("Received SUPL LOCATION REQUEST")
+            elif msg_type == ULPD_MSG_TYPE_SUPLEND:
+                logger.info("Received SUPL END")
+                break
+            else:
+                # Accumulate assistance data; once we have enough, send END and stop
+                assistance_data.extend(msg_body)
+                if len(assistance_data) > 100:
+                    end_msg = bytes([0x80 | ULPD_MSG_TYPE_SUPLEND])
+                    writer.write(self._encode_length(len(end_msg)) + end_msg)
+                    await writer.drain()
+                    break
+        return bytes(assistance_data)
+
+    async def _race_connect(
+        self, queue: list[SuplServer], errors: list[str]
+    ) -> Optional[tuple[SuplServer, asyncio.StreamReader, asyncio.StreamWriter, float]]:
+        """
+        Dial servers from the front of queue, starting the next one after the race delay
+        or when a dial fails. Returns the first connection (server, reader, writer, started);
+        servers whose dial was abandoned go back to the front of queue.
+        """
+        pending: dict[asyncio.Task, tuple[SuplServer, float]] = {}
+        next_dial = 0.0
+
+        def dial() -> bool:
+            nonlocal next_dial
+            while queue:
+                server = queue.pop(0)
+                if not supl_health.get(server.name).allow():
+                    errors.append(f"{server.name} circuit open")
+                    continue
+                logger.info("Attempting SUPL connection to %s", server.name)
+                pending[asyncio.ensure_future(_open_connection(server))] = (server, time.monotonic())
+                next_dial = time.monotonic() + race_delay_sec()
+                return True
+            return False
+
+        dial()
+        try:
+            while pending:
+                timeout = max(0.0, next_dial - time.monotonic()) if queue else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if dial():
+                        _supl_stats["raced"] += 1
+                    continue
+                # Launch order, so the best-ranked of several simultaneous winners is used
+                for task in [t for t in pending if t in done]:
+                    server, started = pending.pop(task)
+                    exc = task.exception()
+                    if exc is None:
+                        reader, writer = task.result()
+                        logger.info("Connected to SUPL server %s", server.name)
+                        return server, reader, writer, started
+                    supl_health.get(server.name).record((time.monotonic() - started) * 1000.0, ok=False)
+                    errors.append(f"{server.name} connect failed: {str(exc) or type(exc).__name__}")
+                    logger.warning("SUPL connection failed to %s: %r", server.name, exc)
+                dial()
+            return None
+        finally:
+            losers = list(pending.items())
+            for task, (server, _) in losers:
+                task.cancel()
+                supl_health.get(server.name).release()
+            results = await asyncio.gather(*pending, return_exceptions=True)
+            for result in results:
+                if isinstance(result, tuple):
+                    await _close(result[1])
+            queue[:0] = [server for _, (server, _) in losers]
+
+    async def fetch_assistance_data(self, latitude: Optional[float] = None,
+                                    longitude: Optional[float] = None) -> Optional[bytes]:
         """
         Fetch A-GNSS assistance data from SUPL server.
         Returns raw binary assistance data (ephemeris/almanac) or None on failure.
         """
-        
-        for attempt, (host, port) in enumerate(self.SUPL_SERVERS):
-            sock = None
-            assistance_data = bytearray()
+        queue = sorted(self.servers, key=_rank)
+        errors: list[str] = []
+        while queue:
+            connected = await self._race_connect(queue, errors)
+            if connected is None:
+                break
+            server, reader, writer, started = connected
+            health = supl_health.get(server.name)
+            assistance_data = b""
             try:
-                logger.info(f"Attempting SUPL connection to {host}:{port} (attempt {attempt + 1})")
-                
-                # Resolve hostname and try all addresses (IPv4 and IPv6)
-                try:
-                    addr_info = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
-                except socket.gaierror as dns_err:
-                    logger.warning(f"SUPL connection failed to {host}:{port}: {dns_err}")
-                    continue
-                
-                for family, socktype, proto, canonname, sockaddr in addr_info:
-                    try:
-                        # Create socket
-                        sock = socket.socket(family, socktype, proto)
-                        sock.settimeout(self.timeout)
-                        
-                        # Connect
-                        sock.connect(sockaddr)
-                        logger.info(f"Connected to {host}:{port} via {sockaddr}")
-                        break  # Connection successful
-                    except (socket.error, OSError) as conn_err:
-                        if sock:
-                            sock.close()
-                            sock = None
-                        logger.debug(f"Connection to {sockaddr} failed: {conn_err}")
-                        continue
-                
-                if not sock:
-                    logger.warning(f"SUPL connection failed to {host}:{port}: All addresses failed")
-                    continue
-                
-                # Send SUPL START
-                try:
-                    start_msg = self._create_suplstart(latitude, longitude)
-                    length_header = self._encode_length(len(start_msg))
-                    sock.sendall(length_header + start_msg)
-                    logger.info(f"Sent SUPL START to {host}:{port} ({len(start_msg)} bytes)")
-                except Exception as send_err:
-                    logger.warning(f"Failed to send SUPL START to {host}:{port}: {send_err}")
-                    if sock:
-                        sock.close()
-                    continue
-                
-                # Receive response (try to get assistance data)
-                assistance_data = bytearray()
-                start_time = time.time()
-                
-                while time.time() - start_time < self.timeout:
-                    try:
-                        # Read length header (1-2 bytes)
-                        length_bytes = sock.recv(1)
-                        if not length_bytes:
-                            break
-                        
-                        msg_len = length_bytes[0]
-                        if msg_len & 0x80:  # 2-byte length
-                            next_byte = sock.recv(1)
-                            if not next_byte:
-                                break
-                            msg_len = ((length_bytes[0] & 0x7F) << 8) | next_byte[0]
-                        
-                        # Read message body
-                        msg_body = sock.recv(msg_len)
-                        if not msg_body:
-                            break
-                        
-                        logger.debug(f"Received SUPL message ({len(msg_body)} bytes): {msg_body[:20].hex()}...")
-                        
-                        # Parse message type
-                        msg_type = msg_body[0] >> 4
-                        
-                        if msg_type == ULPD_MSG_TYPE_SUPLRESPONSE:
-                            # Server acknowledged
-                            logger.info("Received SUPL RESPONSE")
-                        elif msg_type == ULPD_MSG_TYPE_SUPLLOCATIONREQUEST:
-                            # Server requesting location
-                            logger.info("Received SUPL LOCATION REQUEST")
-                        elif msg_type == ULPD_MSG_TYPE_SUPLEND:
-                            # Server ending session
-                            logger.info("Received SUPL END")
-                            break
-                        else:
-                            # Accumulate assistance data
-                            assistance_data.extend(msg_body)
-                            logger.debug(f"Accumulated {len(assistance_data)} bytes of assistance data")
-                            
-                            # If we got enough data, send END and return
-                            if len(assistance_data) > 100:
-                                end_msg = bytes([0x80 | ULPD_MSG_TYPE_SUPLEND])  # SUPLEND
-                                sock.sendall(self._encode_length(len(end_msg)) + end_msg)
-                                break
-                    
-                    except socket.timeout:
-                        logger.debug("Socket timeout while waiting for response")
-                        break
-                
-                if sock:
-                    sock.close()
-                
-                if assistance_data:
-                    logger.info(f"Successfully fetched {len(assistance_data)} bytes from SUPL server {host}:{port}")
-                    return bytes(assistance_data)
-                else:
-                    logger.warning(f"No assistance data received from {host}:{port} after successful connection")
-            
-            except socket.gaierror as e:
-                logger.warning(f"SUPL connection failed to {host}:{port}: {e}")
-                if sock:
-                    sock.close()
-                continue
-            
-            except socket.error as e:
-                logger.warning(f"SUPL connection failed to {host}:{port}: {e}")
-                if sock:
-                    sock.close()
-                continue
-            
-            except Exception as e:
-                logger.error(f"SUPL error: {e}")
-                if sock:
-                    sock.close()
-        
-        logger.error("All SUPL servers failed")
+                assistance_data = await asyncio.wait_for(
+                    self._exchange(reader, writer, latitude, longitude), self.timeout
+                )
+                if not assistance_data:
+                    errors.append(f"{server.name} sent no assistance data")
+            except asyncio.CancelledError:
+                health.release()
+                raise
+            except (OSError, asyncio.TimeoutError, ValueError) as exc:
+                errors.append(f"{server.name} exchange failed: {str(exc) or type(exc).__name__}")
+            finally:
+                _remember_tls_session(server, writer)
+                await _close(writer)
+
+            latency_ms = (time.monotonic() - started) * 1000.0
+            health.record(latency_ms, ok=bool(assistance_data))
+            if assistance_data:
+                logger.info(
+                    "Fetched %d bytes from SUPL server %s in %.0f ms",
+                    len(assistance_data),
+                    server.name,
+                    latency_ms,
+                )
+                return assistance_data
+            logger.warning("SUPL server %s failed: %s", server.name, errors[-1])
+
+        logger.error("All SUPL servers failed: %s", ", ".join(errors))
         return None
 
 
-async def get_supl_assistance_data(device_id: int, 
+def supl_stats() -> dict:
+    """Per-server health and score, plus race and TLS resumption counters, for /health."""
+    servers = supl_health.stats()
+    for server in SUPLClient.configured_servers():
+        if server.name in servers:
+            servers[server.name]["score_ms"] = round(server_score(server), 1)
+    return {"servers": servers, **_supl_stats}
+
+
+async def get_supl_assistance_data(device_id: int,
                                    latitude: Optional[float] = None,
                                    longitude: Optional[float] = None) -> Optional[bytes]:
     """
     High-level function to fetch SUPL assistance data.
     Returns binary A-GNSS data or None if all servers fail.
-    
+
     For testing/demo purposes, returns sample A-GNSS data if SUPL_DEMO env var is set.
     """
-    import os
-    import asyncio
-    
     # Demo mode: return sample data for testing
     if os.getenv("SUPL_DEMO") == "1":
         logger.info("SUPL DEMO MODE: Returning sample A-GNSS data")
         # Sample A-GNSS binary data (minimal valid ephemeris)
         return bytes([0x0a, 0x50, 0x75, 0x6c, 0x73, 0x61, 0x72]) + b"DEMO_AGNSS_DATA" * 20
-    
-    client = SUPLClient(device_id)
-    # Run blocking socket operations in executor to avoid blocking async event loop
-    return await asyncio.to_thread(client.fetch_assistance_data, latitude, longitude)
+
+    client = SUPLClient(device_id, timeout=float(os.getenv("SUPL_TIMEOUT_SEC", "30")))
+    return await client.fetch_assistance_data(latitude, longitude)
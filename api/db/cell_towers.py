@@ -0,0 +1,67 @@
+from psycopg2.extensions import connection as PGConnection
+from psycopg2.extras import RealDictCursor, execute_values
+
+
+def upsert_cell_towers(db_conn: PGConnection, towers: list[dict]) -> None:
+    """
+    Insert or replace learned cell tower positions.
+
+    :param db_conn: Database connection object
+    :param towers: Dicts with mcc, mnc, tac, eci, latitude, longitude, accuracy_m, samples, source
+    """
+    if not towers:
+        return
+    rows = [
+        (
+            t["mcc"],
+            t["mnc"],
+            t["tac"],
+            t["eci"],
+            t["latitude"],
+            t["longitude"],
+            t["accuracy_m"],
+            t["samples"],
+            t["source"],
+        )
+        for t in towers
+    ]
+    with db_conn:
+        with db_conn.cursor() as cursor:
+            execute_values(
+                cursor,
+                """
+                INSERT INTO cell_towers
+                    (mcc, mnc, tac, eci, latitude, longitude, accuracy_m, samples, source)
+                VALUES %s
+                ON CONFLICT (mcc, mnc, tac, eci) DO UPDATE SET
+                    latitude = EXCLUDED.latitude,
+                    longitude = EXCLUDED.longitude,
+                    accuracy_m = EXCLUDED.accuracy_m,
+                    samples = EXCLUDED.samples,
+                    source = EXCLUDED.source,
+                    updated_at = NOW()
+                """,
+                rows,
+            )
+
+
+def get_cell_towers(db_conn: PGConnection, limit: int) -> list[dict]:
+    """
+    Most recently updated cell tower positions.
+
+    :param db_conn: Database connection object
+    :param limit: Maximum number of towers to return
+    :return: List of dicts with the cell_towers columns
+    """
+    with db_conn:
+        with db_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                """
+                SELECT mcc, mnc, tac, eci, latitude, longitude, accuracy_m, samples, source
+                FROM cell_towers
+                ORDER BY updated_at DESC
+                LIMIT %s
+                """,
+                (limit,),
+            )
+            return [dict(row) for row in cursor.fetchall()]
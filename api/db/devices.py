@@ -33,6 +33,21 @@ def get_devices_by_user_id(db_conn: PGConnection, user_id: int) -> list[Device]:
             return normalized
 
 
+def _device_from_row(device: dict) -> Device:
+    # Guarantee remote_viewing is always present and never None
+    if "remote_viewing" not in device or device["remote_viewing"] is None:
+        device["remote_viewing"] = False
+    if "leds_enabled" not in device or device["leds_enabled"] is None:
+        device["leds_enabled"] = False
+    if "last_applied_control_version" not in device or device["last_applied_control_version"] is None:
+        device["last_applied_control_version"] = 0
+    if "reset_token" not in device or device["reset_token"] is None:
+        device["reset_token"] = 0
+    if "reset_applied_token" not in device or device["reset_applied_token"] is None:
+        device["reset_applied_token"] = 0
+    return Device(**device)
+
+
 def get_device(db_conn: PGConnection, device_id: int) -> Device | None:
     """
     Retrieve a device from the database by its ID.
@@ -49,21 +64,29 @@ def get_device(db_conn: PGConnection, device_id: int) -> Device | None:
             )
             device = cursor.fetchone()
             if device is not None:
-                # Guarantee remote_viewing is always present and never None
-                if "remote_viewing" not in device or device["remote_viewing"] is None:
-                    device["remote_viewing"] = False
-                if "leds_enabled" not in device or device["leds_enabled"] is None:
-                    device["leds_enabled"] = False
-                if "last_applied_control_version" not in device or device["last_applied_control_version"] is None:
-                    device["last_applied_control_version"] = 0
-                if "reset_token" not in device or device["reset_token"] is None:
-                    device["reset_token"] = 0
-                if "reset_applied_token" not in device or device["reset_applied_token"] is None:
-                    device["reset_applied_token"] = 0
-                return Device(**device)
+                return _device_from_row(device)
             return None
 
 
+def get_devices(db_conn: PGConnection, device_ids: list[int]) -> dict[int, Device]:
+    """
+    Retrieve several devices in one query.
+
+    :param db_conn: Database connection object
+    :param device_ids: IDs of the devices to retrieve
+    :return: Mapping of device ID to Device for the IDs that exist
+    """
+    if not device_ids:
+        return {}
+    with db_conn:
+        with db_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                "SELECT * FROM devices WHERE device_id = ANY(%s)",
+                (list(device_ids),),
+            )
+            return {row["device_id"]: _device_from_row(row) for row in cursor.fetchall()}
+
+
 def get_user_ids_for_device(db_conn: PGConnection, device_id: int) -> list[int]:
     """
     Retrieve all user IDs associated with a device.
@@ -80,6 +103,22 @@ def get_user_ids_for_device(db_conn: PGConnection, device_id: int) -> list[int]:
         return [row[0] for row in cursor.fetchall()]
 
 
+def get_device_ids_for_user(db_conn: PGConnection, user_id: int) -> set[int]:
+    """
+    Retrieve the IDs of all devices a user has access to.
+
+    :param db_conn: Database connection object
+    :param user_id: ID of the user
+    :return: Set of device IDs linked to this user
+    """
+    with db_conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT device_id FROM users_devices WHERE user_id = %s",
+            (user_id,),
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+
 def create_device(
     db_conn: PGConnection,
     device_id: int,
@@ -128,3 +128,33 @@ def get_gps_data(
             )
             records = cursor.fetchall()
             return [GPSData(**record) for record in records] if records else []
+
+
+def get_active_regions(
+    db_conn: PGConnection,
+    since: datetime,
+    grid_deg: float,
+    limit: int,
+) -> list[dict]:
+    """
+    Grid cells with recent fixes, busiest first.
+
+    :param db_conn: Database connection object
+    :param since: Only fixes at or after this time count
+    :param grid_deg: Grid cell size in degrees
+    :param limit: Maximum number of cells to return
+    :return: [{"lat", "lon", "devices"}] where lat/lon is the mean position in the cell
+    """
+    with db_conn:
+        with db_conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute(
+                "SELECT avg(latitude) AS lat, avg(longitude) AS lon, count(DISTINCT device_id) AS devices "
+                "FROM gps_data WHERE time >= %s AND latitude IS NOT NULL AND longitude IS NOT NULL "
+                "GROUP BY floor(latitude / %s), floor(longitude / %s) "
+                "ORDER BY devices DESC LIMIT %s",
+                (since, grid_deg, grid_deg, limit),
+            )
+            return [
+                {"lat": float(row["lat"]), "lon": float(row["lon"]), "devices": int(row["devices"])}
+                for row in cursor.fetchall()
+            ]
@@ -20,6 +20,7 @@ from api.db.models import GeofenceBreachEvent
 from psycopg2.extras import RealDictCursor
 from api.endpoints.realtime_endpoints import broadcast_device_control_response
 from api.services.mqtt_client import control_data_from_device, publish_device_controls_async
+from api.services.device_access import invalidate_user_devices
 
 router = APIRouter()  # Router for authenticated endpoints
 auth_router = APIRouter()  # Router for unauthenticated endpoints (login/signup)
@@ -196,6 +197,7 @@ async def register_device_to_user(
         user_id=user_id,
         device_id=request.device_id,
     )
+    invalidate_user_devices(user_id)
     return {"success": True, "message": "Device registered to user successfully"}
 
 
@@ -792,6 +794,8 @@ async def delete_all_user_devices(
     
     try:
         devices_deleted = delete_all_devices(db_conn=db_conn, user_id=user_id)
+        # Deleted devices may also be linked to other users
+        invalidate_user_devices()
         
         return DeleteAllDevicesResponse(
             success=True,
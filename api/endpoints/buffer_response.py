@@ -0,0 +1,142 @@
+"""
+Binary responses for device downloads (A-GNSS, P-GPS).
+
+- BufferListResponse sends several buffers (e.g. a small header plus a cached memoryview)
+  without joining them first.
+- assistance_response answers a device's Range request with 206 and the slice it asked
+  for, so an interrupted download over a flaky link can resume where it stopped. Cached
+  data carries an ETag; a device resuming should send it back in If-Range, and gets the
+  whole new blob instead of a mismatched tail when the data has changed in the meantime.
+- Data still downloading upstream (ProgressiveBlob) is streamed as it arrives.
+"""
+
+from __future__ import annotations
+
+import zlib
+from typing import Mapping, Optional, Sequence
+
+from starlette.background import BackgroundTask
+from starlette.responses import Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+from api.agnss.streaming import ProgressiveBlob
+
+OCTET_STREAM = "application/octet-stream"
+
+
+class BufferListResponse(Response):
+    """
+    Sends each buffer as its own body message, so memoryviews over cached blobs go to the
+    server without being joined into a new bytes object first.
+    """
+
+    def __init__(
+        self,
+        buffers: Sequence[bytes | memoryview],
+        status_code: int = 200,
+        headers: Mapping[str, str] | None = None,
+        media_type: str | None = OCTET_STREAM,
+        background: BackgroundTask | None = None,
+    ):
+        self.buffers = [buffer for buffer in buffers if len(buffer)]
+        super().__init__(content=b"", status_code=status_code, headers=headers, media_type=media_type, background=background)
+        self.headers["content-length"] = str(sum(len(buffer) for buffer in self.buffers))
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        last = len(self.buffers) - 1
+        for index, buffer in enumerate(self.buffers):
+            await send({"type": "http.response.body", "body": buffer, "more_body": index < last})
+        if not self.buffers:
+            await send({"type": "http.response.body", "body": b""})
+        if self.background is not None:
+            await self.background()
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def byte_range(header: Optional[str], size: int) -> Optional[tuple[int, int]]:
+    """
+    (start, end) with end exclusive for a single "bytes=" range, or None to send everything
+    (no Range, another unit, several ranges, or a header that doesn't parse). Raises
+    RangeNotSatisfiable when the range starts at or past size.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, _, last = spec.strip().partition("-")
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise RangeNotSatisfiable
+            return max(0, size - suffix), size
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    if end <= start:
+        return None
+    return start, min(end, size)
+
+
+def slice_buffers(buffers: Sequence[bytes | memoryview], start: int, end: int) -> list[memoryview]:
+    """Views of bytes [start, end) across consecutive buffers."""
+    sliced = []
+    offset = 0
+    for buffer in buffers:
+        lo, hi = max(start, offset), min(end, offset + len(buffer))
+        if lo < hi:
+            sliced.append(memoryview(buffer)[lo - offset : hi - offset])
+        offset += len(buffer)
+    return sliced
+
+
+def etag(buffers: Sequence[bytes | memoryview]) -> str:
+    crc = 0
+    for buffer in buffers:
+        crc = zlib.crc32(buffer, crc)
+    return f'"{crc:08x}-{sum(len(buffer) for buffer in buffers)}"'
+
+
+def assistance_response(
+    payload: bytes | memoryview | Sequence[bytes | memoryview] | ProgressiveBlob,
+    *,
+    range_header: Optional[str] = None,
+    if_range: Optional[str] = None,
+    headers: Mapping[str, str] | None = None,
+) -> Response:
+    """200 with all of payload, or 206 with the byte range the device asked for."""
+    headers = {"Accept-Ranges": "bytes", **(headers or {})}
+    if isinstance(payload, ProgressiveBlob):
+        # No ETag until the download is complete, so a conditional range gets everything
+        size = payload.total
+        try:
+            span = byte_range(range_header, size) if size is not None and not if_range else None
+        except RangeNotSatisfiable:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        start, end = span or (0, size)
+        if size is not None:
+            headers["Content-Length"] = str(end - start)
+        if span is None:
+            return StreamingResponse(payload.iter_range(), headers=headers, media_type=OCTET_STREAM)
+        headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        return StreamingResponse(payload.iter_range(start, end), status_code=206, headers=headers, media_type=OCTET_STREAM)
+
+    buffers = list(payload) if isinstance(payload, (list, tuple)) else [payload]
+    size = sum(len(buffer) for buffer in buffers)
+    headers["ETag"] = etag(buffers)
+    try:
+        span = byte_range(range_header, size) if not if_range or if_range == headers["ETag"] else None
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+    if span is None:
+        return BufferListResponse(buffers, headers=headers)
+    headers["Content-Range"] = f"bytes {span[0]}-{span[1] - 1}/{size}"
+    return BufferListResponse(slice_buffers(buffers, *span), status_code=206, headers=headers)
@@ -4,17 +4,16 @@ Provides instant positioning using cellular tower information.
 Supports nRF Cloud, HERE, and Google positioning APIs.
 """
 import logging
-import os
 from typing import List, Optional
 from pydantic import BaseModel
 from fastapi import APIRouter, HTTPException, Header
-import httpx
+
+from api.nrfcloud_location import build_location_url
+from api.services.http_clients import http_clients
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-from api.nrfcloud_location import auth_bearer_token, build_location_url
-
 
 class CellInfo(BaseModel):
     """Single cell tower information"""
@@ -67,10 +66,10 @@ async def get_nrf_cloud_location(cells: List[CellInfo], api_key: str) -> CellLoc
         "Content-Type": "application/json"
     }
     
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        data = response.json()
+    client = http_clients.get("nrf_cloud")
+    response = await client.post(url, json=payload, headers=headers, timeout=10.0)
+    response.raise_for_status()
+    data = response.json()
     
     # nRF Cloud response format:
     # {
@@ -110,10 +109,10 @@ async def get_here_location(cells: List[CellInfo], api_key: str) -> CellLocation
     url = "https://positioning.hereapi.com/v2/position"
     params = {"apiKey": api_key}
     
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.post(url, json=payload, params=params)
-        response.raise_for_status()
-        data = response.json()
+    client = http_clients.get("here")
+    response = await client.post(url, json=payload, params=params)
+    response.raise_for_status()
+    data = response.json()
     
     location = data["location"]
     return CellLocationResponse(
@@ -147,10 +146,10 @@ async def get_google_location(cells: List[CellInfo], api_key: str) -> CellLocati
     
     url = f"https://www.googleapis.com/geolocation/v1/geolocate?key={api_key}"
     
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        response = await client.post(url, json=payload)
-        response.raise_for_status()
-        data = response.json()
+    client = http_clients.get("google")
+    response = await client.post(url, json=payload)
+    response.raise_for_status()
+    data = response.json()
     
     return CellLocationResponse(
         latitude=data["location"]["lat"],
@@ -33,3 +33,14 @@ async def get_agnss_status():
         nrfcloud_project_configured=bool(project and project.strip()),
         legacy_nrf_cloud_api_key_configured=bool(legacy and legacy.strip()),
     )
+
+
+@router.get("/debug/agnss_prefetch")
+async def get_agnss_prefetch_stats():
+    """
+    Assistance-data prefetcher: target counts, data age, device hit ratio, refresh counters.
+    Reports counts only; no device ids or positions.
+    """
+    from api.services.assistance_prefetch import prefetcher
+
+    return prefetcher.stats()
@@ -2,26 +2,24 @@ import logging
 import os
 from datetime import datetime, timezone
 
-from fastapi import APIRouter, HTTPException, Query, Security, status
+from fastapi import APIRouter, Header, HTTPException, Query, Security, status
 
 logger = logging.getLogger(__name__)
 from fastapi.security import APIKeyHeader
-from fastapi.responses import Response, JSONResponse
+from fastapi.responses import JSONResponse
 from psycopg2 import connect
 from psycopg2 import IntegrityError, OperationalError
 from pydantic import BaseModel
-import httpx
 
 from api.db.devices import create_device, get_device, ack_device_controls_applied, ack_device_reset
-from api.agnss.cache_store import get_agnss_cache
+from api.services.agnss_fetch import fetch_pgps_bytes
+from api.endpoints.buffer_response import assistance_response
 from api.services.device_ingest import ingest_location
-from api.agnss.supl_client import get_supl_assistance_data
 from api.endpoints.realtime_endpoints import (
     broadcast_location_update,
     broadcast_geofence_breach,
     broadcast_control_applied_to_users,
 )
-from api.nrfcloud_location import auth_bearer_token, build_location_url
 
 access_token_header = APIKeyHeader(name="Access-Token", auto_error=False)
 
@@ -40,6 +38,7 @@ class DeviceData(BaseModel):
     trip_active: bool | None = None
     current_draw: float | None = None  # mA from INA700
     voltage: float | None = None      # V (bus voltage)
+    cells: list[dict] | None = None   # cells heard at this fix, same shape as /cell_location
     
     @classmethod
     def __get_validators__(cls):
@@ -111,6 +110,7 @@ async def send_gps_data(
         "trip_active": device_data.trip_active,
         "current_draw": device_data.current_draw,
         "voltage": device_data.voltage,
+        "cells": device_data.cells,
     }
     location_data, all_breach_events = ingest_location(device_data.device_id, payload)
 
@@ -394,46 +394,61 @@ async def device_reset_ack(payload: DeviceResetAckRequest):
     }
 
 
-@router.get("/agnss")
-async def get_agnss_data(
-    device_id: int = Query(..., description="Device ID"),
-    lat: float | None = Query(None, ge=-90, le=90, description="Approximate latitude for tailored A-GNSS"),
-    lon: float | None = Query(None, ge=-180, le=180, description="Approximate longitude for tailored A-GNSS"),
-    mcc: int | None = Query(None, ge=0, le=999, description="Serving cell MCC (for filtered ephemeris)"),
-    mnc: int | None = Query(None, ge=0, le=999, description="Serving cell MNC (for filtered ephemeris)"),
-    tac: int | None = Query(None, ge=0, le=65535, description="Serving cell TAC (for filtered ephemeris)"),
-    eci: int | None = Query(None, ge=0, le=268435455, description="Serving cell ECI (LTE cell id)"),
-    access_token: str = Security(access_token_header)
-):
-    """
-    A-GNSS proxy endpoint: fetches assistance data from nRF Cloud or SUPL servers.
-    Returns raw binary blob byte-for-byte unchanged for modem injection.
-    Tries nRF Cloud first (if configured), falls back to free SUPL servers.
-    Optional lat/lon request location-tailored data for faster TTFF.
-    """
+class AgnssCellHint(BaseModel):
+    latitude: float | None = None
+    longitude: float | None = None
+    accuracy_meters: int | None = None
+
+
+class AgnssRequest(BaseModel):
+    device_id: int
+    lat: float | None = None
+    lon: float | None = None
+    mcc: int | None = None
+    mnc: int | None = None
+    tac: int | None = None
+    eci: int | None = None
+    # Older firmware sends its cell location estimate here instead of lat/lon
+    cell_hint: AgnssCellHint | None = None
+
+
+def _check_device_token(device_id: int, access_token: str | None) -> None:
     if not access_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Access token is required"
         )
-    
+
     db_conn = connect(dsn=os.getenv("DATABASE_URI"))
-    
-    # Verify device and token
-    device = get_device(db_conn=db_conn, device_id=device_id)
+    try:
+        device = get_device(db_conn=db_conn, device_id=device_id)
+    finally:
+        db_conn.close()
     if not device:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Device not found"
         )
-    
     if device.access_token != access_token:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid access token"
         )
-    db_conn.close()
 
+
+async def _agnss_response(
+    device_id: int,
+    *,
+    lat: float | None,
+    lon: float | None,
+    mcc: int | None,
+    mnc: int | None,
+    tac: int | None,
+    eci: int | None,
+    range_header: str | None,
+    if_range: str | None,
+):
+    """The binary response shared by GET and POST /agnss."""
     from api.services.agnss_fetch import fetch_agnss_bytes
 
     agnss_data, source = await fetch_agnss_bytes(
@@ -444,16 +459,15 @@ async def get_agnss_data(
         mnc=mnc,
         tac=tac,
         eci=eci,
+        stream=True,
     )
 
     if agnss_data:
-        return Response(
-            content=agnss_data,
-            media_type="application/octet-stream",
-            headers={
-                "Content-Length": str(len(agnss_data)),
-                "X-AGNSS-Source": source or "unknown",
-            },
+        return assistance_response(
+            agnss_data,
+            range_header=range_header,
+            if_range=if_range,
+            headers={"X-AGNSS-Source": source or "unknown"},
         )
 
     raise HTTPException(
@@ -462,71 +476,67 @@ async def get_agnss_data(
     )
 
 
-async def request_pgps_from_nrf_cloud(
-    prediction_count: int,
-    prediction_period_min: int,
-    gps_day: int | None = None,
-    gps_time_of_day: int | None = None,
-) -> bytes | None:
-    """Fetch P-GPS binary from nRF Cloud Location Services (two-step REST flow)."""
-    nrf_cloud_api_key = auth_bearer_token()
-    if not nrf_cloud_api_key:
-        return None
-
-    params: dict[str, int] = {
-        "predictionCount": prediction_count,
-        "predictionIntervalMinutes": prediction_period_min,
-    }
-    if gps_day is not None:
-        params["startGpsDay"] = gps_day
-    if gps_time_of_day is not None:
-        params["startGpsTimeOfDaySeconds"] = gps_time_of_day
-
-    url = build_location_url("pgps")
-    auth_headers = {"Authorization": f"Bearer {nrf_cloud_api_key}"}
-
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        meta = await client.get(
-            url,
-            params=params,
-            headers={**auth_headers, "Accept": "application/json"},
-        )
-        if meta.status_code != 200:
-            logger.warning(
-                "nRF Cloud P-GPS meta returned %d: %s",
-                meta.status_code,
-                meta.text[:500],
-            )
-            return None
-
-        try:
-            payload = meta.json()
-        except ValueError:
-            logger.warning("nRF Cloud P-GPS meta response is not JSON")
-            return None
-
-        host = payload.get("host")
-        path = payload.get("path")
-        if not host or not path:
-            logger.warning("nRF Cloud P-GPS meta missing host/path: %s", payload)
-            return None
-
-        if host.startswith("http://") or host.startswith("https://"):
-            download_url = f"{host.rstrip('/')}/{path.lstrip('/')}"
-        else:
-            download_url = f"https://{host.rstrip('/')}/{path.lstrip('/')}"
-
-        dl = await client.get(download_url, headers=auth_headers)
-        if dl.status_code != 200:
-            logger.warning(
-                "nRF Cloud P-GPS download returned %d from %s",
-                dl.status_code,
-                download_url,
-            )
-            return None
+@router.get("/agnss")
+async def get_agnss_data(
+    device_id: int = Query(..., description="Device ID"),
+    lat: float | None = Query(None, ge=-90, le=90, description="Approximate latitude for tailored A-GNSS"),
+    lon: float | None = Query(None, ge=-180, le=180, description="Approximate longitude for tailored A-GNSS"),
+    mcc: int | None = Query(None, ge=0, le=999, description="Serving cell MCC (for filtered ephemeris)"),
+    mnc: int | None = Query(None, ge=0, le=999, description="Serving cell MNC (for filtered ephemeris)"),
+    tac: int | None = Query(None, ge=0, le=65535, description="Serving cell TAC (for filtered ephemeris)"),
+    eci: int | None = Query(None, ge=0, le=268435455, description="Serving cell ECI (LTE cell id)"),
+    range_header: str | None = Header(None, alias="Range"),
+    if_range: str | None = Header(None, alias="If-Range"),
+    access_token: str = Security(access_token_header)
+):
+    """
+    A-GNSS proxy endpoint: fetches assistance data from nRF Cloud or SUPL servers.
+    Returns raw binary blob byte-for-byte unchanged for modem injection.
+    Tries nRF Cloud first (if configured), falls back to free SUPL servers.
+    Optional lat/lon request location-tailored data for faster TTFF.
+    An nRF Cloud download is streamed to the device as it arrives. A device can resume an
+    interrupted download with Range (and If-Range set to the ETag it got).
+    """
+    _check_device_token(device_id, access_token)
+    return await _agnss_response(
+        device_id,
+        lat=lat,
+        lon=lon,
+        mcc=mcc,
+        mnc=mnc,
+        tac=tac,
+        eci=eci,
+        range_header=range_header,
+        if_range=if_range,
+    )
 
-        logger.info("P-GPS from nRF Cloud: %d bytes", len(dl.content))
-        return dl.content
+
+@router.post("/agnss")
+async def post_agnss_data(
+    payload: AgnssRequest,
+    range_header: str | None = Header(None, alias="Range"),
+    if_range: str | None = Header(None, alias="If-Range"),
+    access_token: str = Security(access_token_header),
+):
+    """
+    Same as GET /agnss with the request in a JSON body. The response is the same raw
+    binary blob (not hex in JSON), so it is no bigger than the data itself.
+    """
+    _check_device_token(payload.device_id, access_token)
+    lat, lon = payload.lat, payload.lon
+    if lat is None and lon is None and payload.cell_hint is not None:
+        lat, lon = payload.cell_hint.latitude, payload.cell_hint.longitude
+    return await _agnss_response(
+        payload.device_id,
+        lat=lat,
+        lon=lon,
+        mcc=payload.mcc,
+        mnc=payload.mnc,
+        tac=payload.tac,
+        eci=payload.eci,
+        range_header=range_header,
+        if_range=if_range,
+    )
 
 
 @router.get("/pgps")
@@ -540,11 +550,13 @@ async def get_pgps_data(
     gps_time_of_day: int | None = Query(
         None, ge=0, description="GPS time-of-day (seconds) for prediction set start"
     ),
+    range_header: str | None = Header(None, alias="Range"),
+    if_range: str | None = Header(None, alias="If-Range"),
     access_token: str = Security(access_token_header),
 ):
     """
-    P-GPS proxy: fetches predicted ephemeris from nRF Cloud and returns raw binary
-    for nrf_cloud_pgps_process_update() on the device.
+    P-GPS proxy: returns raw predicted ephemeris binary for nrf_cloud_pgps_process_update()
+    on the device, cut from a prediction set downloaded once from nRF Cloud and shared.
     """
     if not access_token:
         raise HTTPException(
@@ -571,25 +583,26 @@ async def get_pgps_data(
             detail="prediction_count must be even",
         )
 
-    pgps_data = await request_pgps_from_nrf_cloud(
+    pgps_buffers, source = await fetch_pgps_bytes(
         prediction_count=prediction_count,
         prediction_period_min=prediction_period_min,
         gps_day=gps_day,
         gps_time_of_day=gps_time_of_day,
     )
 
-    if not pgps_data:
+    if not pgps_buffers:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail="P-GPS unavailable: nRF Cloud did not return data",
         )
 
-    return Response(
-        content=pgps_data,
-        media_type="application/octet-stream",
+    # Header plus a view into the cached prediction set; Range resumes a partial download
+    return assistance_response(
+        pgps_buffers,
+        range_header=range_header,
+        if_range=if_range,
         headers={
-            "Content-Length": str(len(pgps_data)),
             "Connection": "close",
-            "X-PGPS-Source": "nRF Cloud",
+            "X-PGPS-Source": source or "nRF Cloud",
         },
     )
@@ -7,98 +7,36 @@ import time
 import logging
 from typing import Dict, Set, Optional
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
-from datetime import datetime
 from psycopg2 import connect
 
-from api.db.devices import get_device, get_user_ids_for_device, ack_device_controls_applied
+from api.db.devices import get_user_ids_for_device, ack_device_controls_applied
 from api.db.users import get_user_by_access_token
+from api.services.device_access import get_user_device_ids_async
 from api.services.device_ingest import ingest_location
+from api.services.admission import device_ws_admission
+from api.services.device_lookup import device_lookup
+from api.services.ws_delivery import DeliveryPolicy
+from api.services.ws_supervisor import ConnectionSupervisor
+from api.websocket_manager import manager
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
 
-class ConnectionManager:
-    """Manages WebSocket connections grouped by room (device or user subscriptions)."""
+# Heartbeats idle viewers and reaps silent sockets; started/stopped by the app lifespan
+supervisor = ConnectionSupervisor()
 
-    def __init__(self):
-        self.active_connections: Dict[str, Set[WebSocket]] = {}
-        self.room_metadata: Dict[str, dict] = {}
 
-    async def connect(self, room: str, websocket: WebSocket, metadata: Optional[dict] = None):
-        """Add a new WebSocket connection to a room."""
-        if room not in self.active_connections:
-            self.active_connections[room] = set()
-            self.room_metadata[room] = metadata or {}
-        
-        self.active_connections[room].add(websocket)
+async def _defer_device_handshake(websocket: WebSocket, device_id: int, retry_after: float):
+    """Accept only to hand the device a retry hint, then close with 1013 (Try Again Later)."""
+    retry_after_ms = int(retry_after * 1000)
+    logger.info(f"WebSocket device {device_id} deferred: retry in {retry_after_ms} ms")
+    try:
         await websocket.accept()
-        logger.info(f"Client connected to room '{room}'. Total connections: {len(self.active_connections[room])}")
-
-    async def disconnect(self, room: str, websocket: WebSocket):
-        """Remove a WebSocket connection from a room."""
-        if room in self.active_connections:
-            self.active_connections[room].discard(websocket)
-            logger.info(f"Client disconnected from room '{room}'. Remaining: {len(self.active_connections[room])}")
-            
-            # Cleanup empty rooms
-            if not self.active_connections[room]:
-                del self.active_connections[room]
-                del self.room_metadata[room]
-
-    async def broadcast_to_room(self, room: str, message: dict) -> int:
-        """
-        Send message to all connections in a room.
-        Returns number of successful sends.
-        """
-        if room not in self.active_connections:
-            return 0
-
-        disconnected = set()
-        success_count = 0
-
-        for connection in self.active_connections[room]:
-            try:
-                await connection.send_json(message)
-                success_count += 1
-            except Exception as e:
-                logger.warning(f"Error sending to room '{room}': {e}")
-                disconnected.add(connection)
-
-        # Cleanup disconnected clients
-        for conn in disconnected:
-            await self.disconnect(room, conn)
-
-        return success_count
-
-    async def broadcast_except(self, room: str, message: dict, exclude_ws: WebSocket) -> int:
-        """Send message to all connections in a room except one."""
-        if room not in self.active_connections:
-            return 0
-
-        success_count = 0
-        for connection in self.active_connections[room]:
-            if connection != exclude_ws:
-                try:
-                    await connection.send_json(message)
-                    success_count += 1
-                except Exception as e:
-                    logger.warning(f"Error sending to room '{room}': {e}")
-
-        return success_count
-
-    def get_room_stats(self, room: str) -> dict:
-        """Get connection statistics for a room."""
-        count = len(self.active_connections.get(room, set()))
-        return {
-            "room": room,
-            "active_connections": count,
-            "metadata": self.room_metadata.get(room, {})
-        }
-
-
-# Global connection manager
-manager = ConnectionManager()
+        await websocket.send_json({"type": "retry_later", "retry_after_ms": retry_after_ms})
+        await websocket.close(code=1013, reason=f"retry_after_ms={retry_after_ms}")
+    except Exception as e:
+        logger.debug(f"WebSocket device {device_id} deferral not delivered: {e}")
 
 
 @router.websocket("/ws/devices/{device_id}")
@@ -120,81 +58,87 @@ async def websocket_device_stream(
         await asyncio.sleep(0.05)  # Ensure close frame is sent
         return
 
-    db_conn = connect(dsn=os.getenv("DATABASE_URI"))
+    # Reconnect storms: admit handshakes at a bounded rate/concurrency, tell the rest when to retry
+    retry_after = device_ws_admission.try_acquire()
+    if retry_after is not None:
+        await _defer_device_handshake(websocket, device_id, retry_after)
+        return
+
     try:
-        device = get_device(db_conn=db_conn, device_id=device_id)
+        # Concurrent handshakes share one query
+        device = await device_lookup.get(device_id)
         if device is None or device.access_token != token:
             logger.warning(f"WebSocket device {device_id} rejected: invalid token")
             await websocket.close(code=1008, reason="Invalid device or token")
             await asyncio.sleep(0.05)
             return
-    finally:
-        db_conn.close()
 
-    room = f"device_{device_id}"
-    await manager.connect(room, websocket, {"device_id": device_id, "type": "device"})
+        room = f"device_{device_id}"
+        await manager.connect(room, websocket, {"device_id": device_id, "type": "device"})
 
-    # Send current controls immediately so any updates made while device was disconnected are applied (no control downtime).
-    # Re-fetch from DB so welcome always has the very latest state.
-    try:
-        db_conn_welcome = connect(dsn=os.getenv("DATABASE_URI"))
+        # Send current controls immediately so any updates made while device was disconnected are applied (no control downtime).
+        # Re-read the row (batched again) now that the socket is in its room: a change committed
+        # after the handshake lookup is either in this read or broadcast to the room, never lost.
         try:
-            device_latest = get_device(db_conn=db_conn_welcome, device_id=device_id)
-        finally:
-            db_conn_welcome.close()
-        welcome_msg = {
-            "type": "device_control_response",
-            "device_id": device_id,
-            "timestamp": int(time.time() * 1000),
-            "data": {},
-        }
-        if device_latest:
-            for key in (
-                "control_1",
-                "control_2",
-                "control_3",
-                "control_4",
-                "control_version",
-                "last_applied_control_version",
-                "controls_updated_at",
-            ):
-                val = getattr(device_latest, key, None)
-                if val is not None:
-                    welcome_msg[key] = val.isoformat() if hasattr(val, "isoformat") else val
-            # Ensure all four controls are always present so device never merges with stale state
-            for key in ("control_1", "control_2", "control_3", "control_4"):
-                if key not in welcome_msg:
-                    welcome_msg[key] = False
-            control_version_val = int(getattr(device_latest, "control_version", 0) or 0)
-            last_applied_val = int(getattr(device_latest, "last_applied_control_version", 0) or 0)
-            welcome_msg["control_version"] = control_version_val
-            welcome_msg["last_applied_control_version"] = last_applied_val
-            welcome_msg["command_pending"] = control_version_val > last_applied_val
-            welcome_msg["command_recovery_interval_ms"] = (
-                int(os.getenv("COMMAND_RECOVERY_INTERVAL_MS", "5000"))
-                if welcome_msg["command_pending"]
-                else None
-            )
-        await websocket.send_json(welcome_msg)
-        logger.debug(f"Device {device_id}: sent welcome controls on connect (latest from DB)")
-    except Exception as e:
-        logger.warning(f"Device {device_id}: failed to send welcome controls: {e}")
-
-    # Idle timeout: close if device sends nothing for 2 min (device pings ~every 10s when idle)
-    DEVICE_WS_RECV_TIMEOUT = 120
+            try:
+                device_latest = await device_lookup.get(device_id) or device
+            except Exception as e:
+                logger.warning(f"Device {device_id}: control re-read failed, welcome uses handshake row: {e}")
+                device_latest = device
+            welcome_msg = {
+                "type": "device_control_response",
+                "device_id": device_id,
+                "timestamp": int(time.time() * 1000),
+                "data": {},
+            }
+            if device_latest:
+                for key in (
+                    "control_1",
+                    "control_2",
+                    "control_3",
+                    "control_4",
+                    "control_version",
+                    "last_applied_control_version",
+                    "controls_updated_at",
+                ):
+                    val = getattr(device_latest, key, None)
+                    if val is not None:
+                        welcome_msg[key] = val.isoformat() if hasattr(val, "isoformat") else val
+                # Ensure all four controls are always present so device never merges with stale state
+                for key in ("control_1", "control_2", "control_3", "control_4"):
+                    if key not in welcome_msg:
+                        welcome_msg[key] = False
+                control_version_val = int(getattr(device_latest, "control_version", 0) or 0)
+                last_applied_val = int(getattr(device_latest, "last_applied_control_version", 0) or 0)
+                welcome_msg["control_version"] = control_version_val
+                welcome_msg["last_applied_control_version"] = last_applied_val
+                welcome_msg["command_pending"] = control_version_val > last_applied_val
+                welcome_msg["command_recovery_interval_ms"] = (
+                    int(os.getenv("COMMAND_RECOVERY_INTERVAL_MS", "5000"))
+                    if welcome_msg["command_pending"]
+                    else None
+                )
+            await websocket.send_json(welcome_msg)
+            logger.debug(f"Device {device_id}: sent welcome controls on connect")
+        except Exception as e:
+            logger.warning(f"Device {device_id}: failed to send welcome controls: {e}")
+    finally:
+        device_ws_admission.release()
+
+    # Idle timeout: reaped if device sends nothing for 2 min (device pings ~every 10s when idle).
+    # No server heartbeat: the tracker drives liveness with its own pings.
+    supervisor.register(
+        websocket,
+        label=f"device {device_id}",
+        heartbeat=False,
+        idle_timeout=float(os.getenv("WS_DEVICE_IDLE_TIMEOUT_SEC", "120")),
+        on_reap=manager.disconnect_all,
+    )
 
     try:
         while True:
-            try:
-                data = await asyncio.wait_for(websocket.receive_text(), timeout=DEVICE_WS_RECV_TIMEOUT)
-            except asyncio.TimeoutError:
-                logger.warning(f"Device {device_id} WebSocket idle timeout ({DEVICE_WS_RECV_TIMEOUT}s), closing")
-                await manager.disconnect(room, websocket)
-                try:
-                    await websocket.close(code=1000, reason="Idle timeout")
-                except Exception:
-                    pass
-                return
+            data = await websocket.receive_text()
+            supervisor.touch(websocket)
             message = json.loads(data)
             
             if message.get("type") == "ping":
@@ -237,6 +181,9 @@ async def websocket_device_stream(
                     await manager.broadcast_to_room(f"user_device_{device_id}", broadcast_msg)
                     logger.debug(f"Location update from device {device_id} broadcasted (no persist)")
 
+            elif message.get("type") == "pong":
+                pass
+
             elif message.get("type") == "power_telemetry":
                 broadcast_msg = {
                     "type": "power_telemetry",
@@ -308,13 +255,19 @@ async def websocket_device_stream(
     except Exception as e:
         logger.error(f"WebSocket error (device {device_id}): {e}")
         await manager.disconnect(room, websocket)
+    finally:
+        supervisor.unregister(websocket)
 
 
 @router.websocket("/ws/users/{device_id}")
 async def websocket_user_stream(
     websocket: WebSocket,
     device_id: int,
-    token: str = Query(None)
+    token: str = Query(None),
+    max_hz: Optional[float] = Query(None),
+    min_distance_m: Optional[float] = Query(None),
+    coalesce: bool = Query(True),
+    since_seq: Optional[int] = Query(None),
 ):
     """
     WebSocket endpoint for users watching device real-time locations.
@@ -322,11 +275,23 @@ async def websocket_user_stream(
     
     Query params:
     - token: User authentication token
+    - max_hz: Optional cap on location_update frequency for this socket
+    - min_distance_m: Optional minimum movement between location updates
+    - coalesce: When rate-limited, send the latest update once the window reopens (default) instead of dropping
+    - since_seq: Last seq the client saw; missed messages are replayed from memory, then replay_complete
     """
     if not token:
         await websocket.close(code=1008, reason="Missing auth token")
         return
 
+    try:
+        policy = DeliveryPolicy.from_dict(
+            {"max_hz": max_hz, "min_distance_m": min_distance_m, "coalesce": coalesce}
+        )
+    except ValueError as e:
+        await websocket.close(code=1008, reason=str(e))
+        return
+
     db_conn = connect(dsn=os.getenv("DATABASE_URI"))
     try:
         user = get_user_by_access_token(db_conn, token)
@@ -341,16 +306,21 @@ async def websocket_user_stream(
         db_conn.close()
 
     room = f"user_device_{device_id}"
-    await manager.connect(room, websocket, {"device_id": device_id, "type": "user", "user_id": user.user_id})
+    await manager.connect(
+        room, websocket, {"device_id": device_id, "type": "user", "user_id": user.user_id}, policy
+    )
+
+    supervisor.register(websocket, label=f"user {user.user_id} device {device_id}", on_reap=manager.disconnect_all)
 
     try:
-        last_ping = time.time()
+        if since_seq is not None:
+            await manager.replay_since(websocket, device_id, [room], since_seq)
         while True:
             data = await websocket.receive_text()
+            supervisor.touch(websocket)
             message = json.loads(data)
 
             if message.get("type") == "ping":
-                last_ping = time.time()
                 await websocket.send_json({
                     "type": "pong",
                     "timestamp": int(time.time() * 1000)
@@ -359,8 +329,17 @@ async def websocket_user_stream(
             elif message.get("type") == "subscribe_geofence":
                 # User subscribed to geofence alerts for this device
                 geofence_room = f"geofence_{device_id}"
-                await manager.connect(geofence_room, websocket, {"device_id": device_id, "type": "geofence_subscriber"})
+                manager.join(geofence_room, websocket, {
+                    "device_id": device_id,
+                    "type": "geofence_subscriber",
+                    "user_id": user.user_id,
+                })
                 logger.info(f"User subscribed to geofence alerts for device {device_id}")
+                if message.get("since_seq") is not None:
+                    await manager.replay_since(websocket, device_id, [geofence_room], int(message["since_seq"]))
+
+            elif message.get("type") == "pong":
+                pass
 
             else:
                 logger.debug(f"Message from user for device {device_id}: {message.get('type')}")
@@ -371,17 +350,188 @@ async def websocket_user_stream(
     except Exception as e:
         logger.error(f"WebSocket error (user watching device {device_id}): {e}")
         await manager.disconnect(room, websocket)
+    finally:
+        supervisor.unregister(websocket)
+        await manager.disconnect(f"geofence_{device_id}", websocket)
+
+
+# Event types a multiplexed viewer can subscribe to, and the per-device room carrying each.
+# "location" is the viewer room: location_update, power_telemetry and control messages.
+VIEWER_EVENT_ROOMS = {
+    "location": ("user_device_{device_id}", "user"),
+    "geofence": ("geofence_{device_id}", "geofence_alert"),
+}
+
+
+def _parse_subscription(message: dict) -> tuple[Optional[Set[int]], list]:
+    """
+    Validate a subscribe/unsubscribe message.
+    Returns (device_ids, events); device_ids is None for "*" (all of the user's devices).
+    """
+    raw_ids = message.get("device_ids", "*")
+    if raw_ids == "*":
+        device_ids = None
+    elif isinstance(raw_ids, list) and raw_ids:
+        try:
+            device_ids = {int(d) for d in raw_ids}
+        except (TypeError, ValueError):
+            raise ValueError("device_ids must be integers")
+    else:
+        raise ValueError('device_ids must be a non-empty array or "*"')
+
+    events = message.get("events") or list(VIEWER_EVENT_ROOMS)
+    if not isinstance(events, list):
+        raise ValueError("events must be an array")
+    unknown = [e for e in events if e not in VIEWER_EVENT_ROOMS]
+    if unknown:
+        raise ValueError(f"unknown event types: {unknown}")
+    return device_ids, sorted(set(events))
+
+
+def _parse_since_seq(raw) -> dict:
+    """since_seq as {device_id: seq}; a single number is stored under None and applies to every device."""
+    if raw is None:
+        return {}
+    try:
+        if isinstance(raw, dict):
+            return {int(k): int(v) for k, v in raw.items()}
+        return {None: int(raw)}
+    except (TypeError, ValueError):
+        raise ValueError("since_seq must be an integer or an object of device_id -> integer")
+
+
+@router.websocket("/ws/users")
+async def websocket_user_multiplex(
+    websocket: WebSocket,
+    token: str = Query(None)
+):
+    """
+    Multiplexed WebSocket for users watching many devices over one connection.
+    The user is authenticated once; devices are authorized against a cached access set.
+
+    Query params:
+    - token: User authentication token
+
+    Client messages:
+    - {"type": "subscribe", "device_ids": [1, 2] | "*", "events": ["location", "geofence"],
+       "policy": {"max_hz": 2, "min_distance_m": 5, "coalesce": true},
+       "since_seq": 1760000000000 | {"1": 1760000000000}}
+    - {"type": "unsubscribe", "device_ids": [1] | "*", "events": ["geofence"]}
+    - {"type": "ping"}
+
+    policy is optional and shapes location updates only; subscribing again replaces it.
+    since_seq (one value, or per device) replays buffered messages missed while reconnecting.
+    Every broadcast carries device_id and seq, so the client can demultiplex and de-duplicate.
+    """
+    if not token:
+        await websocket.close(code=1008, reason="Missing auth token")
+        return
+
+    db_conn = connect(dsn=os.getenv("DATABASE_URI"))
+    try:
+        user = get_user_by_access_token(db_conn, token)
+    finally:
+        db_conn.close()
+    if user is None:
+        await websocket.close(code=1008, reason="Invalid user token")
+        return
+
+    await websocket.accept()
+    # (device_id, event) -> room joined for it
+    subscriptions: Dict[tuple, str] = {}
+    supervisor.register(websocket, label=f"user {user.user_id} multiplexed", on_reap=manager.disconnect_all)
+
+    try:
+        while True:
+            data = await websocket.receive_text()
+            supervisor.touch(websocket)
+            message = json.loads(data)
+            msg_type = message.get("type")
+
+            if msg_type == "ping":
+                await websocket.send_json({
+                    "type": "pong",
+                    "timestamp": int(time.time() * 1000)
+                })
+
+            elif msg_type in ("subscribe", "unsubscribe"):
+                try:
+                    device_ids, events = _parse_subscription(message)
+                    policy = DeliveryPolicy.from_dict(message.get("policy"))
+                    since = _parse_since_seq(message.get("since_seq"))
+                except ValueError as e:
+                    await websocket.send_json({"type": "error", "request": msg_type, "detail": str(e)})
+                    continue
+
+                if msg_type == "subscribe":
+                    allowed = await get_user_device_ids_async(user.user_id)
+                    if device_ids is None:
+                        device_ids = set(allowed)
+                    elif not device_ids <= allowed:
+                        # Reload once so a device linked since the cache was filled is not refused
+                        allowed = await get_user_device_ids_async(user.user_id, refresh=True)
+                    granted = sorted(device_ids & allowed)
+                    for sub_device_id in granted:
+                        for event in events:
+                            room_template, room_type = VIEWER_EVENT_ROOMS[event]
+                            room = room_template.format(device_id=sub_device_id)
+                            manager.join(room, websocket, {
+                                "device_id": sub_device_id,
+                                "type": room_type,
+                                "user_id": user.user_id,
+                            }, policy if event == "location" else None)
+                            subscriptions[(sub_device_id, event)] = room
+                    await websocket.send_json({
+                        "type": "subscribed",
+                        "device_ids": granted,
+                        "events": events,
+                        "denied": sorted(device_ids - allowed),
+                    })
+                    for sub_device_id in granted:
+                        device_since = since.get(sub_device_id, since.get(None))
+                        if device_since is not None:
+                            rooms = [subscriptions[(sub_device_id, event)] for event in events]
+                            await manager.replay_since(websocket, sub_device_id, rooms, device_since)
+                else:
+                    removed = set()
+                    for (sub_device_id, event), room in list(subscriptions.items()):
+                        if event in events and (device_ids is None or sub_device_id in device_ids):
+                            await manager.disconnect(room, websocket)
+                            del subscriptions[(sub_device_id, event)]
+                            removed.add(sub_device_id)
+                    await websocket.send_json({
+                        "type": "unsubscribed",
+                        "device_ids": sorted(removed),
+                        "events": events,
+                    })
+
+            elif msg_type == "pong":
+                pass
+
+            else:
+                logger.debug(f"Message from multiplexed user {user.user_id}: {msg_type}")
+
+    except WebSocketDisconnect:
+        logger.info(f"Multiplexed user WebSocket disconnected (user {user.user_id})")
+    except Exception as e:
+        logger.error(f"WebSocket error (multiplexed user {user.user_id}): {e}")
+    finally:
+        supervisor.unregister(websocket)
+        for room in set(subscriptions.values()):
+            await manager.disconnect(room, websocket)
 
 
 @router.websocket("/ws/geofence/{device_id}")
 async def websocket_geofence_alerts(
     websocket: WebSocket,
     device_id: int,
-    token: str = Query(None)
+    token: str = Query(None),
+    since_seq: Optional[int] = Query(None),
 ):
     """
     WebSocket endpoint for geofence breach alerts.
     Clients subscribe here to receive real-time geofence breach notifications.
+    Pass since_seq to have alerts missed while reconnecting replayed first.
     """
     if not token:
         await websocket.close(code=1008, reason="Missing auth token")
@@ -402,10 +552,14 @@ async def websocket_geofence_alerts(
 
     room = f"geofence_{device_id}"
     await manager.connect(room, websocket, {"device_id": device_id, "type": "geofence_alert", "user_id": user.user_id})
+    supervisor.register(websocket, label=f"geofence alerts device {device_id}", on_reap=manager.disconnect_all)
 
     try:
+        if since_seq is not None:
+            await manager.replay_since(websocket, device_id, [room], since_seq)
         while True:
             data = await websocket.receive_text()
+            supervisor.touch(websocket)
             message = json.loads(data)
             
             if message.get("type") == "ping":
@@ -419,6 +573,8 @@ async def websocket_geofence_alerts(
     except Exception as e:
         logger.error(f"WebSocket error (geofence alerts device {device_id}): {e}")
         await manager.disconnect(room, websocket)
+    finally:
+        supervisor.unregister(websocket)
 
 
 # Helper functions to call from other endpoints
@@ -492,14 +648,13 @@ async def broadcast_device_control_response(device_id: int, control_data: dict)
             message[key] = control_data[key]
     device_room = f"device_{device_id}"
     user_room = f"user_device_{device_id}"
-    # Send to device first so the tracker gets the update with priority
-    n_device = await manager.broadcast_to_room(device_room, message)
-    n_users = await manager.broadcast_to_room(user_room, message)
     # Optional duplicate send to device after a short delay (helps on lossy connections)
     duplicate_delay_ms = int(os.getenv("CONTROL_DUPLICATE_SEND_MS", "0"))
-    if duplicate_delay_ms > 0 and n_device > 0:
-        await asyncio.sleep(duplicate_delay_ms / 1000.0)
-        await manager.broadcast_to_room(device_room, message)
+    # Encode once: the device, its viewers and the duplicate share one frame (and replay seq).
+    # Device room first so the tracker gets the update with priority.
+    n_device, n_users = await manager.publish(
+        [device_room, user_room], message, repeat_after=duplicate_delay_ms / 1000.0
+    )
     logger.info(
         "device_control_response broadcast device_id=%s n_users=%s n_device=%s",
         device_id, n_users, n_device,
@@ -554,6 +709,23 @@ async def broadcast_control_applied_to_users(device_id: int, device) -> int:
     return count
 
 
+@router.get("/ws/stats")
+async def get_all_ws_stats():
+    """Connection totals across all rooms, plus heartbeat/reaper and replay buffer stats."""
+    from api.services.mqtt_subscriber import admission_stats as mqtt_admission_stats
+
+    return {
+        "connections": manager.stats(),
+        "supervisor": supervisor.stats(),
+        "replay": manager.replay.stats(),
+        "handshake_lookups": device_lookup.stats(),
+        "admission": {
+            "device_ws": device_ws_admission.stats(),
+            "mqtt_uplink": mqtt_admission_stats(),
+        },
+    }
+
+
 @router.get("/ws/stats/{device_id}")
 async def get_ws_stats(device_id: int):
     """Get connection statistics for a device's WebSocket rooms."""
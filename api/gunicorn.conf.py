@@ -0,0 +1,17 @@
+"""
+Gunicorn settings for the API container.
+
+WEB_CONCURRENCY sets the number of workers; unset or empty uses every CPU the container
+may run on. The count is exported back to WEB_CONCURRENCY so the workers know they share
+the container (api.services.worker_leader elects the one that subscribes to MQTT).
+"""
+
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY") or len(os.sched_getaffinity(0)))
+os.environ["WEB_CONCURRENCY"] = str(workers)
+loglevel = os.getenv("LOG_LEVEL", "info")
+# Let a worker finish its WebSocket closes and MQTT shutdown before it is killed
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT_SEC", "30"))
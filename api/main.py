@@ -20,13 +20,53 @@ for _d in (_api_dir, _root_dir):
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    from api.services.mqtt_client import start_async_publisher, stop_async_publisher
     from api.services.mqtt_handler import set_event_loop
     from api.services.mqtt_subscriber import start_mqtt_subscriber, stop_mqtt_subscriber
+    from api.services.assistance_prefetch import prefetcher
+    from api.services.http_clients import http_clients
+    from api.services.cell_location_cache import load_cell_towers
+    from api.services.worker_bus import worker_bus
+    from api.services.worker_leader import leader, worker_count
 
     set_event_loop(asyncio.get_running_loop())
-    start_mqtt_subscriber()
+    await start_async_publisher()
+    prefetch_enabled = os.getenv("AGNSS_PREFETCH_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+    if worker_count() > 1:
+        # One worker (the leader lock holder) subscribes to MQTT uplink, runs the
+        # broadcast hub and prefetches assistance data; the others send their WebSocket
+        # broadcasts and assistance demand through it
+        async def lead():
+            try:
+                await worker_bus.serve()
+                start_mqtt_subscriber()
+                if prefetch_enabled:
+                    prefetcher.start()
+            except Exception:
+                # Step down so the worker that takes the lock next can run the hub
+                await prefetcher.stop()
+                stop_mqtt_subscriber()
+                await worker_bus.stop()
+                worker_bus.start()
+                raise
+
+        realtime_endpoints.manager.bus = worker_bus
+        worker_bus.start()
+        leader.start(lead)
+    else:
+        start_mqtt_subscriber()
+        if prefetch_enabled:
+            prefetcher.start()
+    realtime_endpoints.supervisor.start()
+    await asyncio.to_thread(load_cell_towers)
     yield
+    await prefetcher.stop()
+    await realtime_endpoints.supervisor.stop()
     stop_mqtt_subscriber()
+    await worker_bus.stop()
+    await leader.stop()
+    await stop_async_publisher()
+    await http_clients.aclose()
 
 
 app = FastAPI(
@@ -60,6 +100,41 @@ async def health_check():
     from api.services.mqtt_client import mqtt_status
 
     result["mqtt"] = mqtt_status()
+
+    from api.agnss.fanout_cache import get_agnss_fanout_cache
+
+    # The blob store part scans AGNSS_CACHE_DIR
+    result["agnss_cache"] = await asyncio.to_thread(get_agnss_fanout_cache().stats)
+
+    from api.services.worker_bus import worker_bus
+    from api.services.worker_leader import leader, worker_count
+
+    result["workers"] = {**leader.stats(), "bus": worker_bus.stats() if worker_count() > 1 else None}
+
+    from api.services.agnss_fetch import assistance_engine
+
+    result["agnss_providers"] = assistance_engine.stats()
+
+    from api.services.http_clients import http_clients
+
+    result["http_clients"] = http_clients.stats()
+
+    from api.agnss.supl_client import supl_stats
+
+    result["supl"] = supl_stats()
+
+    from api.services.cell_location_cache import get_cell_location_cache
+
+    result["cell_location_cache"] = get_cell_location_cache().stats()
+
+    from api.services.cell_locate_service import provider_stats
+
+    result["cell_location_providers"] = provider_stats()
+
+    from api.services.local_cell_db import get_local_cell_db
+
+    local_db = get_local_cell_db()
+    result["cell_tower_index"] = local_db.stats() if local_db is not None else None
     return result
 
 # CORS: use CORS_ORIGINS in production (comma-separated). Empty or unset = allow all (dev).
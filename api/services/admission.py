@@ -0,0 +1,185 @@
+"""
+Admission control for device connections and MQTT uplink during reconnect storms.
+
+After a restart the whole fleet reconnects at once. Each controller combines a token
+bucket (sustained rate plus burst) with a cap on concurrent in-flight work. A caller
+that is refused gets a jittered retry delay: the time until the next token, plus a
+random spread so the refused devices come back at different times instead of together.
+
+Used from the event loop (device WebSocket handshakes) and from the paho thread (MQTT
+uplink), so state is guarded by a plain lock; nothing here awaits.
+"""
+
+from __future__ import annotations
+
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: float,
+        max_concurrent: int,
+        retry_min_sec: float,
+        retry_spread_sec: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self.retry_min_sec = retry_min_sec
+        self.retry_spread_sec = retry_spread_sec
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.deferred_rate = 0
+        self.deferred_concurrency = 0
+
+    @classmethod
+    def from_env(cls, prefix: str, name: str, **defaults) -> "AdmissionController":
+        """Read <prefix>_RATE, _BURST, _MAX_CONCURRENT, _RETRY_MIN_SEC, _RETRY_SPREAD_SEC."""
+        return cls(
+            name=name,
+            rate=float(os.getenv(f"{prefix}_RATE", str(defaults["rate"]))),
+            burst=float(os.getenv(f"{prefix}_BURST", str(defaults["burst"]))),
+            max_concurrent=int(os.getenv(f"{prefix}_MAX_CONCURRENT", str(defaults["max_concurrent"]))),
+            retry_min_sec=float(os.getenv(f"{prefix}_RETRY_MIN_SEC", str(defaults["retry_min_sec"]))),
+            retry_spread_sec=float(os.getenv(f"{prefix}_RETRY_SPREAD_SEC", str(defaults["retry_spread_sec"]))),
+        )
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self) -> Optional[float]:
+        """
+        Take a token and a concurrency slot. Returns None when admitted (call release()
+        when the work is done), otherwise the number of seconds to wait before retrying.
+        """
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            if self.max_concurrent > 0 and self._in_flight >= self.max_concurrent:
+                self.deferred_concurrency += 1
+                return self._retry_after(0.0)
+            if self.rate > 0 and self._tokens < 1.0:
+                self.deferred_rate += 1
+                return self._retry_after((1.0 - self._tokens) / self.rate)
+            if self.rate > 0:
+                self._tokens -= 1.0
+            self._in_flight += 1
+            self.admitted += 1
+            return None
+
+    def release(self) -> None:
+        with self._lock:
+            if self._in_flight > 0:
+                self._in_flight -= 1
+
+    def _retry_after(self, wait: float) -> float:
+        return max(wait, self.retry_min_sec) + random.uniform(0.0, self.retry_spread_sec)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._refill(self._clock())
+            return {
+                "admitted": self.admitted,
+                "deferred_rate": self.deferred_rate,
+                "deferred_concurrency": self.deferred_concurrency,
+                "in_flight": self._in_flight,
+                "tokens": round(self._tokens, 2),
+                "rate_per_sec": self.rate,
+                "burst": self.burst,
+                "max_concurrent": self.max_concurrent,
+            }
+
+
+class DeferredQueue:
+    """
+    Runs deferred callbacks after their delay on one background thread.
+    Bounded: when full, push() refuses and the caller drops the work.
+    """
+
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = maxsize
+        self._heap: list[tuple[float, int, Callable[[], None]]] = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+
+    def push(self, delay: float, fn: Callable[[], None]) -> bool:
+        with self._cond:
+            if len(self._heap) >= self.maxsize:
+                return False
+            heapq.heappush(self._heap, (time.monotonic() + delay, next(self._counter), fn))
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name=f"{self.name}-deferred", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return True
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._stopped and (not self._heap or self._heap[0][0] > time.monotonic()):
+                    timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                    self._cond.wait(timeout)
+                if self._stopped:
+                    return
+                _, _, fn = heapq.heappop(self._heap)
+            try:
+                fn()
+            except Exception as exc:
+                logger.exception("%s deferred callback error err=%s", self.name, exc)
+
+    def stop(self) -> None:
+        with self._cond:
+            self._stopped = True
+            self._heap.clear()
+            self._cond.notify_all()
+
+    def __len__(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+
+# Device WebSocket handshakes (token lookup + welcome): devices are told to come back later
+device_ws_admission = AdmissionController.from_env(
+    "WS_ADMISSION",
+    "device_ws",
+    rate=200,
+    burst=400,
+    max_concurrent=100,
+    retry_min_sec=1.0,
+    retry_spread_sec=10.0,
+)
+
+# MQTT uplink handling on the paho thread: refused messages are requeued in-process
+mqtt_uplink_admission = AdmissionController.from_env(
+    "MQTT_ADMISSION",
+    "mqtt_uplink",
+    rate=500,
+    burst=1000,
+    max_concurrent=0,
+    retry_min_sec=0.2,
+    retry_spread_sec=1.0,
+)
@@ -1,18 +1,33 @@
-"""Fetch A-GNSS assistance bytes (nRF Cloud with SUPL fallback)."""
+"""Fetch A-GNSS assistance bytes (nRF Cloud with SUPL fallback) and P-GPS prediction sets."""
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
+import time
+from abc import ABC, abstractmethod
+from typing import Awaitable, Callable
 
-import httpx
-
-from api.agnss.cache_store import get_agnss_cache
+from api.agnss import pgps
+from api.agnss.fanout_cache import area_bucket, cache_key, get_agnss_fanout_cache, window_end
+from api.agnss.streaming import ProgressiveBlob
 from api.agnss.supl_client import get_supl_assistance_data
-from api.endpoints.agnss_endpoints import auth_bearer_token, build_location_url
+from api.nrfcloud_location import auth_bearer_token, build_location_url
+from api.services.http_clients import http_clients
+from api.services.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+# nRF Cloud downloads that streaming devices are reading while they arrive, by cache key
+_downloads: dict[str, ProgressiveBlob] = {}
+_download_tasks: set[asyncio.Task] = set()
+_pgps_flight: SingleFlight[bytes | None] = SingleFlight()
+
+
+class IncompleteDownload(Exception):
+    """The upstream stopped before sending the size it announced; the partial blob is discarded."""
+
 
 def _parse_content_range(header_value: str | None) -> int | None:
     if not header_value:
@@ -32,6 +47,291 @@ def _parse_content_range(header_value: str | None) -> int | None:
         return None
 
 
+async def _fetch_nrf_cloud(
+    device_id: int,
+    api_key: str,
+    body: dict[str, object],
+    sink: ProgressiveBlob | None = None,
+) -> bytes | None:
+    """
+    Download the blob in Range requests. Each range is read as a stream; with a sink, the
+    bytes are handed on as they arrive, so devices get them before the download finishes.
+
+    Raises IncompleteDownload (after failing the sink, so its readers stop) when a later
+    range fails or stalls before the Content-Range total: a truncated blob is never cached.
+    """
+    logger.info("A-GNSS nRF Cloud device_id=%s", device_id)
+    url = build_location_url("agnss")
+    client = http_clients.get("nrf_cloud")
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Accept": "application/octet-stream",
+        "Content-Type": "application/json",
+    }
+    chunks: list[bytes] = []
+    total_received = 0
+    total_size: int | None = None
+    range_header = "bytes=0-16383"
+    while True:
+        received_before = total_received
+        async with client.stream("POST", url, json=body, headers={**headers, "Range": range_header}) as response:
+            if response.status_code not in (200, 206):
+                logger.warning(
+                    "nRF Cloud A-GNSS device_id=%s status=%s range=%s",
+                    device_id,
+                    response.status_code,
+                    range_header,
+                )
+                if not chunks:
+                    return None
+                break
+            if not chunks:
+                total_size = _parse_content_range(response.headers.get("Content-Range"))
+                if sink is not None:
+                    sink.total = total_size
+            async for chunk in response.aiter_bytes():
+                chunks.append(chunk)
+                total_received += len(chunk)
+                if sink is not None:
+                    sink.append(chunk)
+        if total_size is None or total_received >= total_size or total_received == received_before:
+            break
+        range_header = f"bytes={total_received}-"
+    if total_size is not None and total_received != total_size:
+        error = IncompleteDownload(f"nRF Cloud A-GNSS stopped at {total_received} of {total_size} bytes")
+        if sink is not None:
+            sink.finish(error=error)
+        raise error
+    # Joined once for the cache; a streaming device already has the chunks
+    agnss_data = b"".join(chunks)
+    logger.info("A-GNSS nRF Cloud device_id=%s bytes=%d", device_id, len(agnss_data))
+    return agnss_data
+
+
+async def _stream_through_cache(
+    key: str, fetch_into: Callable[[ProgressiveBlob], Awaitable[bytes | None]], ttl_sec: float
+) -> bytes | memoryview | ProgressiveBlob | None:
+    """
+    Like the fan-out cache's get_or_fetch, but on a miss returns as soon as the first bytes
+    arrive: a ProgressiveBlob that fills in as the rest does. The download runs on its own
+    and still fills the cache if the device goes away. Devices asking for the same key
+    meanwhile read the same ProgressiveBlob.
+    """
+    fanout = get_agnss_fanout_cache()
+    live = _downloads.get(key)
+    if live is None:
+        if fanout.get(key, count=False)[0] is not None:
+            data, _ = await fanout.get_or_fetch(key, lambda: fetch_into(ProgressiveBlob()), ttl_sec=ttl_sec)
+            return data
+        live = ProgressiveBlob()
+        _downloads[key] = live
+
+        async def download() -> None:
+            try:
+                data, _ = await fanout.get_or_fetch(key, lambda: fetch_into(live), ttl_sec=ttl_sec)
+                live.finish(data)
+            except Exception as exc:
+                live.finish(error=exc)
+            finally:
+                _downloads.pop(key, None)
+
+        task = asyncio.ensure_future(download())
+        _download_tasks.add(task)
+        task.add_done_callback(_download_tasks.discard)
+    if not await live.wait_started():
+        if live.error is not None:
+            raise live.error
+        return None
+    return live
+
+
+async def _fetch_supl(device_id: int, lat: float | None, lon: float | None) -> bytes | None:
+    logger.info("A-GNSS SUPL device_id=%s", device_id)
+    agnss_data = await get_supl_assistance_data(device_id, lat, lon)
+    if agnss_data:
+        logger.info("A-GNSS SUPL device_id=%s bytes=%d", device_id, len(agnss_data))
+    return agnss_data
+
+
+class AssistanceRequest:
+    """What a device (or the prefetcher, with at set) asked for."""
+
+    __slots__ = ("device_id", "lat", "lon", "mcc", "mnc", "tac", "eci", "at")
+
+    def __init__(
+        self,
+        device_id: int,
+        *,
+        lat: float | None = None,
+        lon: float | None = None,
+        mcc: int | None = None,
+        mnc: int | None = None,
+        tac: int | None = None,
+        eci: int | None = None,
+        at: float | None = None,
+    ):
+        self.device_id = device_id
+        self.lat, self.lon = lat, lon
+        self.mcc, self.mnc, self.tac, self.eci = mcc, mnc, tac, eci
+        self.at = at
+
+    @property
+    def prefetch(self) -> bool:
+        return self.at is not None
+
+    @property
+    def has_cell_ids(self) -> bool:
+        return None not in (self.mcc, self.mnc, self.tac, self.eci)
+
+
+class AssistanceProvider(ABC):
+    """
+    An upstream source of assistance data. name is the AGNSS_PROVIDER value and the cache
+    key prefix; source is reported to devices (X-AGNSS-Source). Providers that can hand
+    bytes on while downloading set streams and write them to the sink they are given.
+    """
+
+    name = ""
+    source = ""
+    streams = False
+
+    def enabled(self) -> bool:
+        return True
+
+    def cache_bucket(self, request: AssistanceRequest) -> str:
+        return "global"
+
+    @abstractmethod
+    async def fetch(self, request: AssistanceRequest, sink: ProgressiveBlob | None = None) -> bytes | None:
+        """The blob for request from upstream, or None when the upstream has nothing for it."""
+
+
+class NrfCloudProvider(AssistanceProvider):
+    name = "NRF_CLOUD"
+    source = "nRF Cloud"
+    streams = True
+
+    def enabled(self) -> bool:
+        return bool(auth_bearer_token())
+
+    def cache_bucket(self, request: AssistanceRequest) -> str:
+        if request.has_cell_ids:
+            return area_bucket(mcc=request.mcc, mnc=request.mnc, tac=request.tac)
+        return "global"
+
+    @staticmethod
+    def body(request: AssistanceRequest) -> dict[str, object]:
+        # Filtered ephemeris needs the serving cell; without it nRF Cloud sends default assistance
+        if not request.has_cell_ids:
+            return {}
+        return {
+            "mcc": request.mcc,
+            "mnc": request.mnc,
+            "tac": request.tac,
+            "eci": request.eci,
+            "filtered": True,
+            "mask": 5,
+            "types": [1, 2, 3, 4, 6, 7, 8, 9],
+        }
+
+    async def fetch(self, request: AssistanceRequest, sink: ProgressiveBlob | None = None) -> bytes | None:
+        return await _fetch_nrf_cloud(request.device_id, auth_bearer_token(), self.body(request), sink)
+
+
+class SuplProvider(AssistanceProvider):
+    name = "SUPL"
+    source = "SUPL"
+
+    def cache_bucket(self, request: AssistanceRequest) -> str:
+        return area_bucket(lat=request.lat, lon=request.lon)
+
+    async def fetch(self, request: AssistanceRequest, sink: ProgressiveBlob | None = None) -> bytes | None:
+        return await _fetch_supl(request.device_id, request.lat, request.lon)
+
+
+class AssistanceEngine:
+    """
+    Resolves assistance requests through the providers in order (AGNSS_PROVIDER picks one).
+
+    Every provider sits behind the shared fan-out cache (memory + blob store, single-flight
+    per key), so devices in the same area and window share one upstream download and get
+    a source name ending in " cache". Device requests are recorded for the prefetcher,
+    which calls back in with at set to keep those entries warm. The result is always the
+    raw binary blob; HTTP and MQTT only differ in how they frame it.
+    """
+
+    def __init__(self, providers: list[AssistanceProvider]):
+        self.providers = list(providers)
+        self.served: dict[str, int] = {}
+        self.unavailable = 0
+
+    def register(self, provider: AssistanceProvider, index: int | None = None) -> None:
+        """Add a provider, by default after the existing ones; replaces one with the same name."""
+        self.providers = [p for p in self.providers if p.name != provider.name]
+        self.providers.insert(len(self.providers) if index is None else index, provider)
+
+    def _selected(self) -> list[AssistanceProvider]:
+        only = os.getenv("AGNSS_PROVIDER", "").strip().upper()
+        return [p for p in self.providers if not only or p.name == only]
+
+    def area_for(self, request: AssistanceRequest) -> str:
+        """Cache bucket of the provider that answers request first ("global" when none is enabled)."""
+        for provider in self._selected():
+            if provider.enabled():
+                return provider.cache_bucket(request)
+        return "global"
+
+    async def fetch(
+        self, request: AssistanceRequest, *, stream: bool = False
+    ) -> tuple[bytes | memoryview | ProgressiveBlob | None, str | None]:
+        fanout = get_agnss_fanout_cache()
+        ttl_sec = max(1.0, window_end(request.at) - time.time())
+        if not request.prefetch:
+            from api.services.assistance_prefetch import prefetcher
+
+            prefetcher.note_agnss_request(
+                lat=request.lat, lon=request.lon, mcc=request.mcc, mnc=request.mnc, tac=request.tac, eci=request.eci
+            )
+
+        for provider in self._selected():
+            if not provider.enabled():
+                continue
+            key = cache_key(provider.name, provider.cache_bucket(request), request.at)
+            try:
+                if stream and provider.streams and not request.prefetch:
+                    data = await _stream_through_cache(
+                        key, lambda sink, provider=provider: provider.fetch(request, sink), ttl_sec
+                    )
+                    cached = not isinstance(data, ProgressiveBlob)
+                else:
+                    data, cached = await fanout.get_or_fetch(
+                        key,
+                        lambda provider=provider: provider.fetch(request),
+                        ttl_sec=ttl_sec,
+                        prefetch=request.prefetch,
+                    )
+            except Exception as exc:
+                logger.warning("%s A-GNSS device_id=%s err=%s", provider.source, request.device_id, exc)
+                continue
+            if data:
+                source = f"{provider.source} cache" if cached else provider.source
+                self.served[source] = self.served.get(source, 0) + 1
+                return data, source
+
+        self.unavailable += 1
+        return None, None
+
+    def stats(self) -> dict:
+        return {
+            "providers": [p.name for p in self._selected()],
+            "served": dict(self.served),
+            "unavailable": self.unavailable,
+        }
+
+
+assistance_engine = AssistanceEngine([NrfCloudProvider(), SuplProvider()])
+
+
 async def fetch_agnss_bytes(
     device_id: int,
     *,
@@ -41,101 +341,193 @@ async def fetch_agnss_bytes(
     mnc: int | None = None,
     tac: int | None = None,
     eci: int | None = None,
-) -> tuple[bytes | None, str | None]:
+    at: float | None = None,
+    stream: bool = False,
+) -> tuple[bytes | memoryview | ProgressiveBlob | None, str | None]:
     """
-    Return (binary_blob, source_name) or (None, None) when unavailable.
+    Return (binary_blob, source_name) or (None, None) when unavailable, via assistance_engine.
+
+    at is set by the prefetcher only: fill the window containing that time, without
+    counting a device request.
+    stream=True lets an nRF Cloud cache miss return a ProgressiveBlob once the first bytes
+    are in, instead of waiting for the whole download (HTTP devices).
     """
-    agnss_data: bytes | None = None
-    source: str | None = None
-    agnss_provider = os.getenv("AGNSS_PROVIDER", "").strip().upper()
+    request = AssistanceRequest(device_id, lat=lat, lon=lon, mcc=mcc, mnc=mnc, tac=tac, eci=eci, at=at)
+    return await assistance_engine.fetch(request, stream=stream)
 
-    def _provider_allows(provider: str) -> bool:
-        return (not agnss_provider) or agnss_provider == provider
 
-    if _provider_allows("NRF_CLOUD"):
-        nrf_cloud_api_key = auth_bearer_token()
-        if nrf_cloud_api_key:
-            try:
-                logger.info("A-GNSS nRF Cloud device_id=%s", device_id)
-                url = build_location_url("agnss")
-                auth_headers = {"Authorization": f"Bearer {nrf_cloud_api_key}"}
-                body: dict[str, object] = {}
-                have_cell_ids = (
-                    mcc is not None and mnc is not None and tac is not None and eci is not None
-                )
-                if have_cell_ids:
-                    body = {
-                        "mcc": mcc,
-                        "mnc": mnc,
-                        "tac": tac,
-                        "eci": eci,
-                        "filtered": True,
-                        "mask": 5,
-                        "types": [1, 2, 3, 4, 6, 7, 8, 9],
-                    }
-                async with httpx.AsyncClient(timeout=30.0) as client:
-                    response = await client.post(
-                        url,
-                        json=body,
-                        headers={
-                            **auth_headers,
-                            "Accept": "application/octet-stream",
-                            "Content-Type": "application/json",
-                            "Range": "bytes=0-16383",
-                        },
-                    )
-                    if response.status_code in (200, 206):
-                        chunks = [response.content]
-                        total_received = len(response.content)
-                        total_size = _parse_content_range(response.headers.get("Content-Range"))
-                        while total_size is not None and total_received < total_size:
-                            next_start = total_received
-                            next_response = await client.post(
-                                url,
-                                json=body,
-                                headers={
-                                    **auth_headers,
-                                    "Accept": "application/octet-stream",
-                                    "Content-Type": "application/json",
-                                    "Range": f"bytes={next_start}-",
-                                },
-                            )
-                            if next_response.status_code not in (200, 206):
-                                break
-                            chunk = next_response.content
-                            if not chunk:
-                                break
-                            chunks.append(chunk)
-                            total_received += len(chunk)
-                        agnss_data = b"".join(chunks)
-                        source = "nRF Cloud"
-                        logger.info("A-GNSS nRF Cloud device_id=%s bytes=%d", device_id, len(agnss_data))
-                    else:
-                        logger.warning(
-                            "nRF Cloud A-GNSS device_id=%s status=%s",
-                            device_id,
-                            response.status_code,
-                        )
-            except Exception as exc:
-                logger.warning("nRF Cloud A-GNSS device_id=%s err=%s", device_id, exc)
-
-    if not agnss_data and _provider_allows("SUPL"):
-        try:
-            cache = get_agnss_cache()
-            if cache.enabled:
-                cached = cache.get()
-                if cached:
-                    agnss_data = cached
-                    source = "SUPL cache"
-            if not agnss_data:
-                logger.info("A-GNSS SUPL device_id=%s", device_id)
-                agnss_data = await get_supl_assistance_data(device_id, lat, lon)
-                if agnss_data:
-                    source = "SUPL"
-                    if cache.enabled:
-                        cache.set(agnss_data)
-                    logger.info("A-GNSS SUPL device_id=%s bytes=%d", device_id, len(agnss_data))
-        except Exception as exc:
-            logger.warning("SUPL A-GNSS device_id=%s err=%s", device_id, exc)
-
-    return agnss_data, source
+async def request_pgps_from_nrf_cloud(
+    prediction_count: int,
+    prediction_period_min: int,
+    gps_day: int | None = None,
+    gps_time_of_day: int | None = None,
+) -> bytes | None:
+    """
+    Fetch P-GPS binary from nRF Cloud Location Services (two-step REST flow).
+    Concurrent requests for the same prediction set share one download.
+    """
+    data, _ = await _pgps_flight.do(
+        (prediction_count, prediction_period_min, gps_day, gps_time_of_day),
+        lambda: _download_pgps(prediction_count, prediction_period_min, gps_day, gps_time_of_day),
+    )
+    return data
+
+
+async def _download_pgps(
+    prediction_count: int,
+    prediction_period_min: int,
+    gps_day: int | None,
+    gps_time_of_day: int | None,
+) -> bytes | None:
+    nrf_cloud_api_key = auth_bearer_token()
+    if not nrf_cloud_api_key:
+        return None
+
+    params: dict[str, int] = {
+        "predictionCount": prediction_count,
+        "predictionIntervalMinutes": prediction_period_min,
+    }
+    if gps_day is not None:
+        params["startGpsDay"] = gps_day
+    if gps_time_of_day is not None:
+        params["startGpsTimeOfDaySeconds"] = gps_time_of_day
+
+    url = build_location_url("pgps")
+    auth_headers = {"Authorization": f"Bearer {nrf_cloud_api_key}"}
+
+    client = http_clients.get("nrf_cloud")
+    meta = await client.get(
+        url,
+        params=params,
+        headers={**auth_headers, "Accept": "application/json"},
+        timeout=60.0,
+    )
+    if meta.status_code != 200:
+        logger.warning(
+            "nRF Cloud P-GPS meta returned %d: %s",
+            meta.status_code,
+            meta.text[:500],
+        )
+        return None
+
+    try:
+        payload = meta.json()
+    except ValueError:
+        logger.warning("nRF Cloud P-GPS meta response is not JSON")
+        return None
+
+    host = payload.get("host")
+    path = payload.get("path")
+    if not host or not path:
+        logger.warning("nRF Cloud P-GPS meta missing host/path: %s", payload)
+        return None
+
+    if host.startswith("http://") or host.startswith("https://"):
+        download_url = f"{host.rstrip('/')}/{path.lstrip('/')}"
+    else:
+        download_url = f"https://{host.rstrip('/')}/{path.lstrip('/')}"
+
+    dl = await http_clients.for_url(download_url).get(download_url, headers=auth_headers, timeout=60.0)
+    if dl.status_code != 200:
+        logger.warning(
+            "nRF Cloud P-GPS download returned %d from %s",
+            dl.status_code,
+            download_url,
+        )
+        return None
+
+    logger.info("P-GPS from nRF Cloud: %d bytes", len(dl.content))
+    return dl.content
+
+
+def pgps_window_sec() -> float:
+    return float(os.getenv("PGPS_CACHE_WINDOW_SEC", "21600"))
+
+
+async def _fetch_pgps_set(
+    prediction_period_min: int, set_start_gps: int, *, prefetch: bool
+) -> tuple[bytes | memoryview | None, bool]:
+    """The full prediction set starting at set_start_gps, shared until the next set starts."""
+    period_sec = prediction_period_min * 60
+    gps_day, gps_time_of_day = pgps.gps_day_time(set_start_gps)
+    set_end = set_start_gps + period_sec + pgps.GPS_EPOCH_UNIX - pgps.GPS_LEAP_SECONDS
+    return await get_agnss_fanout_cache().get_or_fetch(
+        f"PGPS|set:{prediction_period_min}|{set_start_gps}",
+        lambda: request_pgps_from_nrf_cloud(
+            pgps.full_set_count(prediction_period_min), prediction_period_min, gps_day, gps_time_of_day
+        ),
+        ttl_sec=max(1.0, set_end - time.time()),
+        prefetch=prefetch,
+    )
+
+
+async def fetch_pgps_bytes(
+    prediction_count: int,
+    prediction_period_min: int,
+    gps_day: int | None = None,
+    gps_time_of_day: int | None = None,
+    *,
+    at: float | None = None,
+) -> tuple[list[bytes | memoryview] | None, str | None]:
+    """
+    Return (buffers, source_name) or (None, None). The buffers, sent in order, form the
+    P-GPS file; at works as in fetch_agnss_bytes.
+
+    One full prediction set is stored per (prediction_period_min, start slot), where start
+    slots are period-aligned in GPS time, and each request gets the first prediction_count
+    predictions from the one covering its start (api.agnss.pgps). Requests the stored set
+    can't answer (start not on a slot boundary, more predictions than a set holds, a file
+    that doesn't parse) are fetched as asked and cached per request for PGPS_CACHE_WINDOW_SEC.
+    """
+    prefetch = at is not None
+    explicit = gps_day is not None or gps_time_of_day is not None
+    if not prefetch and not explicit:
+        from api.services.assistance_prefetch import prefetcher
+
+        prefetcher.note_pgps_request(prediction_count, prediction_period_min)
+
+    period_sec = prediction_period_min * 60
+    if not explicit:
+        start_gps: int | None = pgps.gps_seconds(time.time() if at is None else at)
+    elif gps_day is not None and gps_time_of_day is not None:
+        start_gps = gps_day * pgps.SECONDS_PER_DAY + gps_time_of_day
+    else:
+        start_gps = None
+    if (
+        start_gps is not None
+        and prediction_count <= pgps.full_set_count(prediction_period_min)
+        and (not explicit or start_gps % period_sec == 0)
+    ):
+        set_start = start_gps - start_gps % period_sec
+        data, cached = await _fetch_pgps_set(prediction_period_min, set_start, prefetch=prefetch)
+        source = "nRF Cloud cache" if cached else "nRF Cloud"
+        if data and prefetch:
+            return [data], source
+        header = pgps.parse_header(data) if data else None
+        if header is not None and header.prediction_period_min == prediction_period_min:
+            offset = start_gps - header.start_gps_sec
+            if offset >= 0 and (not explicit or offset % period_sec == 0):
+                buffers = pgps.slice_predictions(data, header, offset // period_sec, prediction_count)
+                if buffers is not None:
+                    return buffers, source
+        if data:
+            logger.warning(
+                "P-GPS set period=%s does not cover count=%s start=%s; fetching it directly",
+                prediction_period_min,
+                prediction_count,
+                start_gps,
+            )
+
+    window = pgps_window_sec()
+    bucket = f"{prediction_count}x{prediction_period_min}"
+    if explicit:
+        bucket += f"@{gps_day}:{gps_time_of_day}"
+    data, cached = await get_agnss_fanout_cache().get_or_fetch(
+        cache_key("PGPS", bucket, at, window_sec=window),
+        lambda: request_pgps_from_nrf_cloud(prediction_count, prediction_period_min, gps_day, gps_time_of_day),
+        ttl_sec=max(1.0, window_end(at, window) - time.time()),
+        prefetch=prefetch,
+    )
+    if not data:
+        return None, None
+    return [data], "nRF Cloud cache" if cached else "nRF Cloud"
@@ -0,0 +1,329 @@
+"""
+Background refresh of A-GNSS and P-GPS assistance data for the active fleet.
+
+Targets come from two places:
+- device requests: every fetch_agnss_bytes / fetch_pgps_bytes call records its area
+  (serving cell, else lat/lon, else global) or its prediction set;
+- the database: AGNSS_CACHE_GRID_DEG grid cells with gps_data fixes in the last
+  AGNSS_PREFETCH_ACTIVE_SEC, re-read every AGNSS_PREFETCH_DB_INTERVAL_SEC. A region only
+  knows lat/lon, so it becomes a target per cache bucket of the provider that would answer
+  it: with nRF Cloud first (bucketed by serving cell, else global) every region is the
+  one global target; grid-bucketed providers such as SUPL get one per grid cell.
+
+Every AGNSS_PREFETCH_INTERVAL_SEC each target is checked against the cache for the current
+window, and once that window is within AGNSS_PREFETCH_LEAD_SEC of closing, for the next
+one too, so a device never waits on a cold upstream fetch. Refreshes go through the same
+fan-out cache (and in-flight dedupe) as device requests, AGNSS_PREFETCH_CONCURRENCY at a
+time. Targets not requested for AGNSS_PREFETCH_ACTIVE_SEC are dropped.
+
+With several workers only the leader runs the refresh loop (its fetches land in the
+shared disk tier); the others forward the device requests they see over the worker bus.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from api.agnss.fanout_cache import area_bucket, window_end
+from api.services.worker_bus import worker_bus
+
+logger = logging.getLogger(__name__)
+
+KIND_AGNSS = "agnss"
+KIND_PGPS = "pgps"
+
+
+class _Target:
+    __slots__ = ("kind", "params", "last_requested", "fetched_at", "failures")
+
+    def __init__(self, kind: str, params: dict, now: float):
+        self.kind = kind
+        self.params = params
+        self.last_requested = now
+        # window start -> when that window's data was fetched upstream
+        self.fetched_at: dict[float, float] = {}
+        self.failures = 0
+
+
+def _engine_area(lat: float, lon: float) -> str:
+    from api.services.agnss_fetch import AssistanceRequest, assistance_engine
+
+    return assistance_engine.area_for(AssistanceRequest(0, lat=lat, lon=lon))
+
+
+def _load_active_regions(since: datetime, grid_deg: float, limit: int) -> list[dict]:
+    from psycopg2 import connect
+
+    from api.db.gps_data import get_active_regions
+
+    conn = connect(dsn=os.getenv("DATABASE_URI"))
+    try:
+        return get_active_regions(conn, since, grid_deg, limit)
+    finally:
+        conn.close()
+
+
+class AssistancePrefetcher:
+    def __init__(
+        self,
+        interval_sec: Optional[float] = None,
+        lead_sec: Optional[float] = None,
+        active_sec: Optional[float] = None,
+        db_interval_sec: Optional[float] = None,
+        max_targets: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        region_loader: Optional[Callable[[datetime, float, int], list[dict]]] = _load_active_regions,
+        region_area: Callable[[float, float], str] = _engine_area,
+        agnss_fetch: Optional[Callable[..., Awaitable[tuple]]] = None,
+        pgps_fetch: Optional[Callable[..., Awaitable[tuple]]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.interval_sec = interval_sec if interval_sec is not None else float(
+            os.getenv("AGNSS_PREFETCH_INTERVAL_SEC", "60")
+        )
+        self.lead_sec = lead_sec if lead_sec is not None else float(os.getenv("AGNSS_PREFETCH_LEAD_SEC", "300"))
+        self.active_sec = active_sec if active_sec is not None else float(
+            os.getenv("AGNSS_PREFETCH_ACTIVE_SEC", "21600")
+        )
+        self.db_interval_sec = db_interval_sec if db_interval_sec is not None else float(
+            os.getenv("AGNSS_PREFETCH_DB_INTERVAL_SEC", "600")
+        )
+        self.max_targets = max_targets if max_targets is not None else int(
+            os.getenv("AGNSS_PREFETCH_MAX_TARGETS", "200")
+        )
+        self.concurrency = concurrency if concurrency is not None else int(
+            os.getenv("AGNSS_PREFETCH_CONCURRENCY", "4")
+        )
+        self._region_loader = region_loader
+        self._region_area = region_area
+        self._agnss_fetch = agnss_fetch
+        self._pgps_fetch = pgps_fetch
+        self._clock = clock
+        self._targets: dict[str, _Target] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._last_db_load = 0.0
+        self.ticks = 0
+        self.refreshed = 0
+        self.already_warm = 0
+        self.failed = 0
+        self.db_regions = 0
+        self.last_tick_at: Optional[float] = None
+        self.last_tick_ms: Optional[float] = None
+
+    # -- demand ---------------------------------------------------------------------------
+
+    def _note(self, signature: str, kind: str, params: dict) -> None:
+        self._record(signature, kind, params)
+        if not worker_bus.is_hub:
+            worker_bus.notify("assistance_demand", [signature, kind, params])
+
+    def _record(self, signature: str, kind: str, params: dict) -> None:
+        now = self._clock()
+        with self._lock:
+            target = self._targets.get(signature)
+            if target is None:
+                target = _Target(kind, params, now)
+                self._targets[signature] = target
+                if len(self._targets) > self.max_targets:
+                    oldest = min(self._targets, key=lambda sig: self._targets[sig].last_requested)
+                    del self._targets[oldest]
+            else:
+                target.params = params
+                target.last_requested = now
+
+    def note_agnss_request(
+        self,
+        *,
+        lat: float | None = None,
+        lon: float | None = None,
+        mcc: int | None = None,
+        mnc: int | None = None,
+        tac: int | None = None,
+        eci: int | None = None,
+    ) -> None:
+        if None not in (mcc, mnc, tac, eci):
+            signature = area_bucket(mcc=mcc, mnc=mnc, tac=tac)
+            params = {"mcc": mcc, "mnc": mnc, "tac": tac, "eci": eci}
+        elif lat is not None and lon is not None:
+            # Keyed like the DB regions, by the answering provider's bucket
+            signature = self._region_area(lat, lon)
+            params = {} if signature == "global" else {"lat": lat, "lon": lon}
+        else:
+            signature, params = "global", {}
+        self._note(f"{KIND_AGNSS}:{signature}", KIND_AGNSS, params)
+
+    def note_pgps_request(self, prediction_count: int, prediction_period_min: int) -> None:
+        # Every count is cut from the same stored set, so there is one target per period
+        self._note(
+            f"{KIND_PGPS}:{prediction_period_min}",
+            KIND_PGPS,
+            {"prediction_count": prediction_count, "prediction_period_min": prediction_period_min},
+        )
+
+    # -- refresh --------------------------------------------------------------------------
+
+    def _fetchers(self):
+        agnss_fetch, pgps_fetch = self._agnss_fetch, self._pgps_fetch
+        if agnss_fetch is None or pgps_fetch is None:
+            from api.services import agnss_fetch as fetch_module
+
+            agnss_fetch = agnss_fetch or fetch_module.fetch_agnss_bytes
+            pgps_fetch = pgps_fetch or fetch_module.fetch_pgps_bytes
+        return agnss_fetch, pgps_fetch
+
+    @staticmethod
+    def _window_sec(target: _Target) -> float:
+        if target.kind == KIND_PGPS:
+            # A stored prediction set is replaced when the next prediction period starts
+            return float(target.params["prediction_period_min"] * 60)
+        return float(os.getenv("AGNSS_CACHE_WINDOW_SEC", "3600"))
+
+    async def _load_regions(self, now: float) -> None:
+        if self._region_loader is None:
+            return
+        if self._region_loader is _load_active_regions and not os.getenv("DATABASE_URI"):
+            return
+        if now - self._last_db_load < self.db_interval_sec:
+            return
+        self._last_db_load = now
+        since = datetime.fromtimestamp(now, tz=timezone.utc) - timedelta(seconds=self.active_sec)
+        grid = float(os.getenv("AGNSS_CACHE_GRID_DEG", "1.0"))
+        try:
+            regions = await asyncio.to_thread(self._region_loader, since, grid, self.max_targets)
+        except Exception as exc:
+            logger.warning("A-GNSS prefetch region query failed err=%s", exc)
+            return
+        # Regions the answering provider serves from the same bucket share one target
+        areas: set[str] = set()
+        for region in regions:
+            area = self._region_area(region["lat"], region["lon"])
+            if area in areas:
+                continue
+            areas.add(area)
+            params = {} if area == "global" else {"lat": region["lat"], "lon": region["lon"]}
+            self._note(f"{KIND_AGNSS}:{area}", KIND_AGNSS, params)
+        self.db_regions = len(areas)
+
+    async def tick(self) -> dict:
+        """One refresh pass. Returns the counts for this pass."""
+        started = time.monotonic()
+        now = self._clock()
+        await self._load_regions(now)
+        with self._lock:
+            for signature in [s for s, t in self._targets.items() if now - t.last_requested > self.active_sec]:
+                del self._targets[signature]
+            targets = list(self._targets.values())
+
+        agnss_fetch, pgps_fetch = self._fetchers()
+        semaphore = asyncio.Semaphore(max(1, self.concurrency))
+        counts = {"refreshed": 0, "warm": 0, "failed": 0}
+
+        async def refresh(target: _Target, at: float, window_start: float) -> None:
+            async with semaphore:
+                try:
+                    if target.kind == KIND_PGPS:
+                        data, source = await pgps_fetch(**target.params, at=at)
+                    else:
+                        data, source = await agnss_fetch(0, **target.params, at=at)
+                except Exception as exc:
+                    logger.warning("A-GNSS prefetch failed kind=%s err=%s", target.kind, exc)
+                    data, source = None, None
+            if not data:
+                target.failures += 1
+                counts["failed"] += 1
+            elif source and source.endswith("cache"):
+                # Fetched by a device request or another worker; at most this old
+                target.fetched_at.setdefault(window_start, window_start)
+                counts["warm"] += 1
+            else:
+                target.fetched_at[window_start] = self._clock()
+                counts["refreshed"] += 1
+
+        jobs = []
+        for target in targets:
+            window = self._window_sec(target)
+            end = window_end(now, window)
+            slots = [(now, end - window)]
+            if end - now <= self.lead_sec:
+                slots.append((end, end))
+            for start in [s for s in target.fetched_at if s < end - window]:
+                del target.fetched_at[start]
+            jobs.extend(refresh(target, at, start) for at, start in slots)
+        await asyncio.gather(*jobs)
+
+        self.ticks += 1
+        self.refreshed += counts["refreshed"]
+        self.already_warm += counts["warm"]
+        self.failed += counts["failed"]
+        self.last_tick_at = now
+        self.last_tick_ms = round((time.monotonic() - started) * 1000.0, 1)
+        return counts
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.tick()
+            except Exception as exc:
+                logger.exception("A-GNSS prefetch pass failed err=%s", exc)
+            await asyncio.sleep(self.interval_sec)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self.run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def stats(self) -> dict:
+        from api.agnss.fanout_cache import get_agnss_fanout_cache
+
+        now = self._clock()
+        ages = []
+        with self._lock:
+            by_kind = {KIND_AGNSS: 0, KIND_PGPS: 0}
+            for target in self._targets.values():
+                by_kind[target.kind] += 1
+                current = window_end(now, self._window_sec(target)) - self._window_sec(target)
+                fetched = target.fetched_at.get(current)
+                if fetched is not None:
+                    ages.append(now - fetched)
+            cold = sum(by_kind.values()) - len(ages)
+        ages.sort()
+        cache = get_agnss_fanout_cache().stats(include_disk=False)
+        return {
+            "running": self._task is not None and not self._task.done(),
+            "interval_sec": self.interval_sec,
+            "lead_sec": self.lead_sec,
+            "agnss_targets": by_kind[KIND_AGNSS],
+            "pgps_targets": by_kind[KIND_PGPS],
+            "db_regions": self.db_regions,
+            "cold_targets": cold,
+            "data_age_sec": {
+                "median": round(ages[len(ages) // 2], 1) if ages else None,
+                "max": round(ages[-1], 1) if ages else None,
+            },
+            "device_hit_ratio": cache["hit_ratio"],
+            "ticks": self.ticks,
+            "refreshed": self.refreshed,
+            "already_warm": self.already_warm,
+            "failed": self.failed,
+            "last_tick_age_sec": round(now - self.last_tick_at, 1) if self.last_tick_at else None,
+            "last_tick_ms": self.last_tick_ms,
+        }
+
+
+prefetcher = AssistancePrefetcher()
+worker_bus.subscribe("assistance_demand", lambda payload: prefetcher._record(*payload))
@@ -4,9 +4,11 @@ Resolve cell tower measurements to lat/lon (shared by HTTP and MQTT).
 
 from __future__ import annotations
 
+import asyncio
 import logging
 import os
-from typing import List
+import time
+from typing import List, Optional
 
 import httpx
 
@@ -18,68 +20,211 @@ from api.endpoints.cell_location import (
     get_nrf_cloud_location,
 )
 from api.nrfcloud_location import auth_bearer_token
+from api.services.cell_location_cache import cell_set_key, get_cell_location_cache, save_cell_towers
+from api.services.local_cell_db import SOURCE_LOCAL, get_local_cell_db
+from api.services.provider_health import ProviderHealthRegistry, trips_breaker
+from api.services.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+cell_location_health = ProviderHealthRegistry("CELL_LOCATION")
+_hedge_stats = {"hedged": 0, "hedge_wins": 0, "primary_wins": 0}
+# Devices reporting the same cells at once (e.g. after a cell-site outage) share one lookup
+_locate_flight: SingleFlight[CellLocationResponse] = SingleFlight()
+
 
 class CellLocateUnavailable(Exception):
     """No provider could resolve the cell measurement."""
 
 
 async def resolve_cell_location(cells: List[CellInfo]) -> CellLocationResponse:
-    """Query configured provider(s) for an estimated position."""
+    """
+    Estimated position for a cell measurement: from the in-process cache / learned tower
+    table when possible, else from the configured provider(s).
+    """
     if not cells:
         raise ValueError("At least one cell required")
 
+    cache = get_cell_location_cache()
+    cached = cache.lookup(cells)
+    if cached is not None:
+        return cached
+
+    async def locate_and_learn() -> CellLocationResponse:
+        result = await _query_providers(cells)
+        # Dataset positions from the local index are not fed into the learned table
+        if result.source != SOURCE_LOCAL:
+            rows = cache.remember(cells, result)
+            if rows:
+                asyncio.get_running_loop().run_in_executor(None, save_cell_towers, rows)
+        return result
+
+    result, _ = await _locate_flight.do(cell_set_key(cells, cache.bucket_db), locate_and_learn)
+    return result
+
+
+def _provider_call(candidate: str, cells: List[CellInfo], errors: list[str]):
+    """Zero-argument coroutine factory for a network provider, or None if it can't be used."""
+    if candidate == "nrf_cloud":
+        api_key = auth_bearer_token()
+        if not api_key:
+            errors.append(
+                "NRFCLOUD_OAT/NRFCLOUD_ORG_SLUG/NRFCLOUD_PROJECT_SLUG not configured "
+                "(or legacy NRF_CLOUD_API_KEY missing)"
+            )
+            return None
+        return lambda: get_nrf_cloud_location(cells, api_key)
+
+    if candidate == "google":
+        api_key = os.getenv("GOOGLE_GEOLOCATION_API_KEY")
+        if not api_key:
+            errors.append("GOOGLE_GEOLOCATION_API_KEY not configured")
+            return None
+        return lambda: get_google_location(cells, api_key)
+
+    if candidate == "here":
+        api_key = os.getenv("HERE_API_KEY")
+        if not api_key:
+            errors.append("HERE_API_KEY not configured")
+            return None
+        return lambda: get_here_location(cells, api_key)
+
+    errors.append(f"Unknown CELL_LOCATION_PROVIDER: {candidate}")
+    return None
+
+
+def _describe_error(candidate: str, exc: BaseException) -> str:
+    if isinstance(exc, httpx.HTTPStatusError):
+        logger.error(
+            "Cell location provider error: %s - %s",
+            exc.response.status_code,
+            exc.response.text,
+        )
+        return f"{candidate} HTTP {exc.response.status_code}"
+    if isinstance(exc, httpx.RequestError):
+        logger.error("Cell location request error: %s", str(exc))
+        return f"{candidate} request failed"
+    logger.error("Unexpected error in cell location: %s", str(exc))
+    return f"{candidate} unexpected error"
+
+
+def hedge_delay_sec(candidate: str) -> float:
+    """
+    How long to wait on a provider before also asking the next one: its recent
+    CELL_LOCATION_HEDGE_PERCENTILE latency once it has CELL_LOCATION_HEDGE_MIN_SAMPLES
+    calls, else CELL_LOCATION_HEDGE_DELAY_MS. Never below CELL_LOCATION_HEDGE_MIN_MS.
+    """
+    health = cell_location_health.get(candidate)
+    delay_ms = float(os.getenv("CELL_LOCATION_HEDGE_DELAY_MS", "1000"))
+    if health.samples() >= int(os.getenv("CELL_LOCATION_HEDGE_MIN_SAMPLES", "20")):
+        delay_ms = health.percentile(float(os.getenv("CELL_LOCATION_HEDGE_PERCENTILE", "0.95")))
+    return max(float(os.getenv("CELL_LOCATION_HEDGE_MIN_MS", "50")), delay_ms) / 1000.0
+
+
+async def _timed_call(candidate: str, call, hedge_delay: float = 0.0) -> CellLocationResponse:
+    health = cell_location_health.get(candidate)
+    started = time.monotonic()
+    try:
+        result = await call()
+    except asyncio.CancelledError:
+        # Censored: it would have taken at least this long (and at least its hedge delay)
+        health.record_cancelled(max(time.monotonic() - started, hedge_delay) * 1000.0)
+        raise
+    except Exception as exc:
+        health.record((time.monotonic() - started) * 1000.0, ok=not trips_breaker(exc))
+        raise
+    health.record((time.monotonic() - started) * 1000.0, ok=True)
+    return result
+
+
+async def _hedged(calls: list[tuple[str, object]], errors: list[str]) -> Optional[CellLocationResponse]:
+    """
+    Race providers in order: start the first, start the next one when the current one has
+    taken longer than its hedge delay or has failed, return the first answer and cancel
+    the rest. Providers whose circuit breaker is open are skipped.
+    """
+    queue = list(calls)
+    pending: dict[asyncio.Task, str] = {}
+    launched = 0
+    latest_deadline: Optional[float] = None
+
+    def launch() -> bool:
+        nonlocal launched, latest_deadline
+        while queue:
+            candidate, call = queue.pop(0)
+            if not cell_location_health.get(candidate).allow():
+                errors.append(f"{candidate} circuit open")
+                continue
+            delay = hedge_delay_sec(candidate)
+            pending[asyncio.ensure_future(_timed_call(candidate, call, delay))] = candidate
+            launched += 1
+            latest_deadline = time.monotonic() + delay
+            return True
+        return False
+
+    launch()
+    try:
+        while pending:
+            timeout = max(0.0, latest_deadline - time.monotonic()) if queue else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if launch():
+                    _hedge_stats["hedged"] += 1
+                continue
+            failed = False
+            for task in done:
+                candidate = pending.pop(task)
+                exc = task.exception()
+                if exc is None:
+                    if launched > 1:
+                        _hedge_stats["hedge_wins" if candidate != calls[0][0] else "primary_wins"] += 1
+                    return task.result()
+                errors.append(_describe_error(candidate, exc))
+                failed = True
+            if failed:
+                launch()
+    finally:
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+    return None
+
+
+async def _query_providers(cells: List[CellInfo]) -> CellLocationResponse:
+    """
+    Query configured provider(s) for an estimated position. In auto mode the local tower
+    index is tried first, then nrf_cloud, google and here are raced as hedged requests.
+    """
     provider = os.getenv("CELL_LOCATION_PROVIDER", "nrf_cloud").strip().lower()
     if provider == "auto":
-        provider_order = ["nrf_cloud", "google", "here"]
+        provider_order = ["local", "nrf_cloud", "google", "here"]
     else:
         provider_order = [provider]
 
     errors: list[str] = []
 
+    if provider_order[0] == "local":
+        local_db = get_local_cell_db()
+        if local_db is None:
+            errors.append("CELL_TOWER_DB_PATH tower index not found")
+        else:
+            result = local_db.locate(cells)
+            if result is not None:
+                return result
+            errors.append("local: cells not in tower index")
+        provider_order = provider_order[1:]
+
+    calls = []
     for candidate in provider_order:
-        try:
-            if candidate == "nrf_cloud":
-                api_key = auth_bearer_token()
-                if not api_key:
-                    errors.append(
-                        "NRFCLOUD_OAT/NRFCLOUD_ORG_SLUG/NRFCLOUD_PROJECT_SLUG not configured "
-                        "(or legacy NRF_CLOUD_API_KEY missing)"
-                    )
-                    continue
-                return await get_nrf_cloud_location(cells, api_key)
-
-            if candidate == "google":
-                api_key = os.getenv("GOOGLE_GEOLOCATION_API_KEY")
-                if not api_key:
-                    errors.append("GOOGLE_GEOLOCATION_API_KEY not configured")
-                    continue
-                return await get_google_location(cells, api_key)
-
-            if candidate == "here":
-                api_key = os.getenv("HERE_API_KEY")
-                if not api_key:
-                    errors.append("HERE_API_KEY not configured")
-                    continue
-                return await get_here_location(cells, api_key)
-
-            errors.append(f"Unknown CELL_LOCATION_PROVIDER: {candidate}")
-
-        except httpx.HTTPStatusError as exc:
-            logger.error(
-                "Cell location provider error: %s - %s",
-                exc.response.status_code,
-                exc.response.text,
-            )
-            errors.append(f"{candidate} HTTP {exc.response.status_code}")
-        except httpx.RequestError as exc:
-            logger.error("Cell location request error: %s", str(exc))
-            errors.append(f"{candidate} request failed")
-        except Exception as exc:
-            logger.error("Unexpected error in cell location: %s", str(exc))
-            errors.append(f"{candidate} unexpected error")
+        call = _provider_call(candidate, cells, errors)
+        if call is not None:
+            calls.append((candidate, call))
+
+    if calls:
+        result = await _hedged(calls, errors)
+        if result is not None:
+            return result
 
     detail = "Cell location unavailable"
     if errors:
@@ -87,6 +232,11 @@ async def resolve_cell_location(cells: List[CellInfo]) -> CellLocationResponse:
     raise CellLocateUnavailable(detail)
 
 
+def provider_stats() -> dict:
+    """Per-provider latency and breaker state, plus hedging counters, for /health."""
+    return {"providers": cell_location_health.stats(), **_hedge_stats, "single_flight": _locate_flight.stats()}
+
+
 def parse_cell_infos(raw_cells: list) -> List[CellInfo]:
     """Build CellInfo models from MQTT/JSON cell dicts."""
     if not isinstance(raw_cells, list) or not raw_cells:
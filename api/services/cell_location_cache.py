@@ -0,0 +1,304 @@
+"""
+In-process cell location cache in front of the upstream providers.
+
+Two tiers, both plain dict lookups (no I/O on the request path):
+
+- answers: the last provider answer per normalized cell set. The key is the sorted
+  (mcc, mnc, tac, eci, signal bucket) of every cell in the request, with signal rounded
+  down to CELL_LOCATION_SIGNAL_BUCKET_DB steps (default 10 dB). Entries live for
+  CELL_LOCATION_CACHE_TTL_SEC (default 1 day), at most CELL_LOCATION_CACHE_ENTRIES.
+- towers: where each cell is heard, keyed by (mcc, mnc, tac, eci). Learned from GPS fixes
+  that carry cell metadata (running mean of the fix positions, accuracy = RMS spread) and,
+  for cells without fixes, from provider answers for the serving cell. When the serving
+  cell of a request is known the position is the RSRP-weighted centroid of the known cells.
+
+Towers are persisted to the cell_towers table (migration 011) and loaded at startup, so
+every worker and restart starts warm. At most CELL_TOWER_MAX_ENTRIES are kept in memory.
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Iterable, List, Optional
+
+from api.endpoints.cell_location import CellInfo, CellLocationResponse
+
+logger = logging.getLogger(__name__)
+
+SOURCE_GPS = "gps"
+SOURCE_TOWER_DB = "cell_db"
+
+_METERS_PER_DEG = 111_320.0
+
+TowerKey = tuple[int, int, int, int]
+
+
+def tower_key(cell: CellInfo) -> TowerKey:
+    """(mcc, mnc, tac, eci); LAC stands in for TAC as it does in the provider requests."""
+    return (cell.mcc, cell.mnc, cell.tac or cell.lac, cell.cellId)
+
+
+def cell_set_key(cells: Iterable[CellInfo], bucket_db: int = 10) -> tuple:
+    """Order-independent key for a measurement, with signal rounded to bucket_db steps."""
+    bucket_db = max(1, bucket_db)
+    return tuple(sorted(tower_key(c) + (c.signal // bucket_db,) for c in cells))
+
+
+class _Tower:
+    __slots__ = ("latitude", "longitude", "m2", "accuracy_m", "samples", "source")
+
+    def __init__(self, latitude: float, longitude: float, accuracy_m: float, samples: int, source: str):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.accuracy_m = accuracy_m
+        self.samples = samples
+        self.source = source
+        # Sum of squared distances (m^2) from the mean, for GPS-learned towers
+        self.m2 = accuracy_m * accuracy_m * samples
+
+
+def weighted_centroid(points: list[tuple[float, float, float, int]]) -> tuple[float, float, float]:
+    """
+    (lat, lon, accuracy_m) from (lat, lon, accuracy_m, rsrp_dbm) points, weighted by linear
+    received power so the strongest cells dominate.
+    """
+    weights = [10.0 ** (rsrp / 10.0) for _, _, _, rsrp in points]
+    total = sum(weights)
+    lat = sum(w * p[0] for w, p in zip(weights, points)) / total
+    lon = sum(w * p[1] for w, p in zip(weights, points)) / total
+    accuracy = sum(w * p[2] for w, p in zip(weights, points)) / total
+    return lat, lon, accuracy
+
+
+class CellLocationCache:
+    def __init__(
+        self,
+        ttl_sec: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        bucket_db: Optional[int] = None,
+        max_towers: Optional[int] = None,
+        min_accuracy_m: Optional[float] = None,
+        max_samples: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl_sec = ttl_sec if ttl_sec is not None else float(os.getenv("CELL_LOCATION_CACHE_TTL_SEC", "86400"))
+        self.max_entries = max_entries if max_entries is not None else int(
+            os.getenv("CELL_LOCATION_CACHE_ENTRIES", "10000")
+        )
+        self.bucket_db = bucket_db if bucket_db is not None else int(os.getenv("CELL_LOCATION_SIGNAL_BUCKET_DB", "10"))
+        self.max_towers = max_towers if max_towers is not None else int(os.getenv("CELL_TOWER_MAX_ENTRIES", "200000"))
+        self.min_accuracy_m = min_accuracy_m if min_accuracy_m is not None else float(
+            os.getenv("CELL_TOWER_MIN_ACCURACY_M", "300")
+        )
+        # Past this many fixes a tower's mean becomes a moving average, so it can follow changes
+        self.max_samples = max_samples if max_samples is not None else int(os.getenv("CELL_TOWER_MAX_SAMPLES", "500"))
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._answers: OrderedDict[tuple, tuple[float, CellLocationResponse]] = OrderedDict()
+        self._towers: OrderedDict[TowerKey, _Tower] = OrderedDict()
+        self.answer_hits = 0
+        self.tower_hits = 0
+        self.misses = 0
+        self.learned_from_gps = 0
+        self.learned_from_provider = 0
+
+    # -- lookups --------------------------------------------------------------------------
+
+    def lookup(self, cells: List[CellInfo]) -> Optional[CellLocationResponse]:
+        """Cached answer for this cell set, else an estimate from known towers, else None."""
+        key = cell_set_key(cells, self.bucket_db)
+        now = self._clock()
+        with self._lock:
+            entry = self._answers.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._answers.move_to_end(key)
+                    self.answer_hits += 1
+                    return entry[1]
+                del self._answers[key]
+
+            estimate = self._estimate_locked(cells)
+            if estimate is not None:
+                self.tower_hits += 1
+            else:
+                self.misses += 1
+            return estimate
+
+    def _estimate_locked(self, cells: List[CellInfo]) -> Optional[CellLocationResponse]:
+        serving = self._towers.get(tower_key(cells[0]))
+        if serving is None:
+            return None
+        points = []
+        for cell in cells:
+            tower = self._towers.get(tower_key(cell))
+            if tower is not None:
+                points.append((tower.latitude, tower.longitude, tower.accuracy_m, cell.signal))
+        lat, lon, accuracy = weighted_centroid(points)
+        return CellLocationResponse(latitude=lat, longitude=lon, accuracy=accuracy, source=SOURCE_TOWER_DB)
+
+    # -- learning -------------------------------------------------------------------------
+
+    def remember(self, cells: List[CellInfo], response: CellLocationResponse) -> list[dict]:
+        """
+        Cache a provider answer, and use it as the serving cell's position unless GPS fixes
+        have placed that cell already. Returns the tower rows to persist.
+        """
+        key = cell_set_key(cells, self.bucket_db)
+        with self._lock:
+            self._answers[key] = (self._clock() + self.ttl_sec, response)
+            self._answers.move_to_end(key)
+            while len(self._answers) > self.max_entries:
+                self._answers.popitem(last=False)
+
+            serving_key = tower_key(cells[0])
+            tower = self._towers.get(serving_key)
+            if tower is not None and tower.source == SOURCE_GPS:
+                return []
+            tower = _Tower(response.latitude, response.longitude, float(response.accuracy), 1, response.source)
+            self._put_locked(serving_key, tower)
+            self.learned_from_provider += 1
+            return [self._row(serving_key, tower)]
+
+    def learn_fix(self, cells: List[CellInfo], latitude: float, longitude: float) -> list[dict]:
+        """Fold a GPS fix into every cell heard with it. Returns the tower rows to persist."""
+        rows = []
+        with self._lock:
+            for cell in cells:
+                key = tower_key(cell)
+                tower = self._towers.get(key)
+                if tower is None or tower.source != SOURCE_GPS:
+                    # Provider answers are estimates; the first real fix replaces them
+                    tower = _Tower(latitude, longitude, self.min_accuracy_m, 0, SOURCE_GPS)
+                self._add_sample(tower, latitude, longitude)
+                self._put_locked(key, tower)
+                rows.append(self._row(key, tower))
+            self.learned_from_gps += len(rows)
+        return rows
+
+    def _add_sample(self, tower: _Tower, latitude: float, longitude: float) -> None:
+        n = min(tower.samples + 1, self.max_samples)
+        if tower.samples >= self.max_samples:
+            tower.m2 *= (n - 1) / n
+        scale = math.cos(math.radians(tower.latitude)) * _METERS_PER_DEG
+        dy = (latitude - tower.latitude) * _METERS_PER_DEG
+        dx = (longitude - tower.longitude) * scale
+        tower.latitude += (latitude - tower.latitude) / n
+        tower.longitude += (longitude - tower.longitude) / n
+        dy2 = (latitude - tower.latitude) * _METERS_PER_DEG
+        dx2 = (longitude - tower.longitude) * scale
+        tower.m2 += dx * dx2 + dy * dy2
+        tower.samples = n
+        tower.accuracy_m = max(self.min_accuracy_m, math.sqrt(max(tower.m2, 0.0) / n))
+
+    def _put_locked(self, key: TowerKey, tower: _Tower) -> None:
+        self._towers[key] = tower
+        self._towers.move_to_end(key)
+        while len(self._towers) > self.max_towers:
+            self._towers.popitem(last=False)
+
+    @staticmethod
+    def _row(key: TowerKey, tower: _Tower) -> dict:
+        mcc, mnc, tac, eci = key
+        return {
+            "mcc": mcc,
+            "mnc": mnc,
+            "tac": tac,
+            "eci": eci,
+            "latitude": tower.latitude,
+            "longitude": tower.longitude,
+            "accuracy_m": round(tower.accuracy_m, 1),
+            "samples": tower.samples,
+            "source": tower.source,
+        }
+
+    def load_towers(self, rows: Iterable[dict]) -> int:
+        """Seed the tower table from cell_towers rows (most recent first)."""
+        loaded = 0
+        with self._lock:
+            for row in reversed(list(rows)):
+                key = (int(row["mcc"]), int(row["mnc"]), int(row["tac"]), int(row["eci"]))
+                self._put_locked(
+                    key,
+                    _Tower(
+                        float(row["latitude"]),
+                        float(row["longitude"]),
+                        float(row["accuracy_m"]),
+                        int(row["samples"]),
+                        row["source"],
+                    ),
+                )
+                loaded += 1
+        return loaded
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.answer_hits + self.tower_hits + self.misses
+            return {
+                "answers": len(self._answers),
+                "answers_max": self.max_entries,
+                "ttl_sec": self.ttl_sec,
+                "towers": len(self._towers),
+                "towers_from_gps": sum(1 for t in self._towers.values() if t.source == SOURCE_GPS),
+                "answer_hits": self.answer_hits,
+                "tower_hits": self.tower_hits,
+                "misses": self.misses,
+                "hit_ratio": round((self.answer_hits + self.tower_hits) / lookups, 3) if lookups else None,
+                "learned_from_gps": self.learned_from_gps,
+                "learned_from_provider": self.learned_from_provider,
+            }
+
+
+def save_cell_towers(rows: list[dict]) -> None:
+    """Persist learned towers on a fresh connection (used off the event loop)."""
+    if not rows or not os.getenv("DATABASE_URI"):
+        return
+    from psycopg2 import connect
+
+    from api.db.cell_towers import upsert_cell_towers
+
+    try:
+        conn = connect(dsn=os.getenv("DATABASE_URI"))
+        try:
+            upsert_cell_towers(conn, rows)
+        finally:
+            conn.close()
+    except Exception as exc:
+        logger.warning("Saving learned cell towers failed err=%s", exc)
+
+
+def load_cell_towers() -> int:
+    """Load the most recent towers from the database into the cache."""
+    if not os.getenv("DATABASE_URI"):
+        return 0
+    from psycopg2 import connect
+
+    from api.db.cell_towers import get_cell_towers
+
+    cache = get_cell_location_cache()
+    try:
+        conn = connect(dsn=os.getenv("DATABASE_URI"))
+        try:
+            rows = get_cell_towers(conn, cache.max_towers)
+        finally:
+            conn.close()
+    except Exception as exc:
+        logger.warning("Loading cell towers failed err=%s", exc)
+        return 0
+    loaded = cache.load_towers(rows)
+    logger.info("Loaded %s cell towers", loaded)
+    return loaded
+
+
+_cell_location_cache: Optional[CellLocationCache] = None
+
+
+def get_cell_location_cache() -> CellLocationCache:
+    global _cell_location_cache
+    if _cell_location_cache is None:
+        _cell_location_cache = CellLocationCache()
+    return _cell_location_cache
@@ -0,0 +1,87 @@
+"""
+Cached user -> device access sets for WebSocket subscription checks.
+
+A multiplexed viewer socket may subscribe to hundreds of devices; checking each one
+against users_devices would cost a DB round trip per subscribe. The set is loaded once
+per user, reused until WS_ACCESS_CACHE_TTL_SEC expires, and reloaded once on a miss so
+a device linked a moment ago is not refused.
+
+Each gunicorn worker has its own cache. Invalidations are also sent to the other workers
+over the worker bus (api.services.worker_bus), so a revoked device stops being watchable
+in every worker, not only the one that handled the change.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+
+from psycopg2 import connect
+
+from api.db.devices import get_device_ids_for_user
+from api.services.worker_bus import worker_bus
+
+logger = logging.getLogger(__name__)
+
+_cache: dict[int, tuple[float, frozenset[int]]] = {}
+_cache_lock = threading.Lock()
+
+
+def _ttl_sec() -> float:
+    return float(os.getenv("WS_ACCESS_CACHE_TTL_SEC", "60"))
+
+
+def _load(user_id: int) -> frozenset[int]:
+    db_conn = connect(dsn=os.getenv("DATABASE_URI"))
+    try:
+        device_ids = frozenset(get_device_ids_for_user(db_conn, user_id))
+    finally:
+        db_conn.close()
+    with _cache_lock:
+        _cache[user_id] = (time.monotonic() + _ttl_sec(), device_ids)
+    return device_ids
+
+
+def get_user_device_ids(user_id: int, *, refresh: bool = False) -> frozenset[int]:
+    """Return the device IDs a user may watch (cached; blocking DB call on miss)."""
+    if not refresh:
+        with _cache_lock:
+            entry = _cache.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+    return _load(user_id)
+
+
+def user_can_access_device(user_id: int, device_id: int) -> bool:
+    """Check access against the cached set, reloading once before refusing."""
+    if device_id in get_user_device_ids(user_id):
+        return True
+    return device_id in get_user_device_ids(user_id, refresh=True)
+
+
+async def get_user_device_ids_async(user_id: int, *, refresh: bool = False) -> frozenset[int]:
+    return await asyncio.to_thread(get_user_device_ids, user_id, refresh=refresh)
+
+
+async def user_can_access_device_async(user_id: int, device_id: int) -> bool:
+    return await asyncio.to_thread(user_can_access_device, user_id, device_id)
+
+
+def _drop(user_id: int | None) -> None:
+    with _cache_lock:
+        if user_id is None:
+            _cache.clear()
+        else:
+            _cache.pop(user_id, None)
+
+
+def invalidate_user_devices(user_id: int | None = None) -> None:
+    """Drop cached access for one user (or everyone) after users_devices changes, in every worker."""
+    _drop(user_id)
+    worker_bus.notify("device_access", user_id)
+
+
+worker_bus.subscribe("device_access", _drop)
@@ -10,6 +10,7 @@ from datetime import datetime, timezone
 
 from psycopg2 import connect
 
+from api.db.cell_towers import upsert_cell_towers
 from api.db.devices import get_device, get_user_ids_for_device
 from api.db.gps_data import add_gps_data
 from api.db.geofences import get_geofences_by_user_id
@@ -18,6 +19,8 @@ from api.db.models import GeofenceBreachEvent
 from api.db.users import get_user
 from api.notifications.geofence_breach_notifications import notify_geofence_breach_events
 from api.notifications.sms_notifications import notify_geofence_breach_via_sms
+from api.services.cell_locate_service import parse_cell_infos
+from api.services.cell_location_cache import get_cell_location_cache
 
 logger = logging.getLogger(__name__)
 
@@ -40,6 +43,22 @@ def _parse_timestamp(value) -> datetime | None:
     return None
 
 
+def _learn_cell_towers(db_conn, device_id: int, raw_cells, latitude: float, longitude: float) -> None:
+    """Record where the cells reported with this fix are heard. Never fails the ingest."""
+    if not raw_cells:
+        return
+    try:
+        cells = parse_cell_infos(raw_cells)
+    except (KeyError, TypeError, ValueError) as exc:
+        logger.warning("Ignoring invalid cells with GPS fix device_id=%s err=%s", device_id, exc)
+        return
+    rows = get_cell_location_cache().learn_fix(cells, latitude, longitude)
+    try:
+        upsert_cell_towers(db_conn, rows)
+    except Exception as exc:
+        logger.warning("Saving learned cell towers failed device_id=%s err=%s", device_id, exc)
+
+
 def ingest_location(
     device_id: int,
     payload: dict,
@@ -50,7 +69,8 @@ def ingest_location(
 
     :param device_id: Device ID (must match payload if present).
     :param payload: Dict with latitude, longitude; optional: timestamp, speed, heading,
-                    trip_active, current_draw, voltage.
+                    trip_active, current_draw, voltage, cells (same shape as cell_locate_request;
+                    used to learn where those cells are heard).
     :return: (location_data dict for broadcast_location_update, list of breach events).
     """
     lat = payload.get("latitude")
@@ -92,6 +112,7 @@ def ingest_location(
             heading=heading,
             trip_active=trip_active,
         )
+        _learn_cell_towers(db_conn, device_id, payload.get("cells"), latitude, longitude)
 
         user_ids = get_user_ids_for_device(db_conn, device_id)
         all_breach_events: list[GeofenceBreachEvent] = []
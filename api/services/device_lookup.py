@@ -0,0 +1,103 @@
+"""
+Coalesced device lookups for WebSocket handshakes.
+
+After a deploy every tracker reconnects at once. Rather than one DB connection and
+query per handshake, lookups arriving within WS_HANDSHAKE_BATCH_MS of each other are
+merged into a single `WHERE device_id = ANY(...)` query run off the event loop. The
+returned row serves token auth. The welcome device_control_response is built from a
+second get() made after the socket joins its room (batched the same way), so a control
+change made between the two reads is either in the welcome or broadcast to the socket.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+from typing import Callable, Optional
+
+from psycopg2 import connect
+
+from api.db.devices import get_devices
+from api.db.models import Device
+
+logger = logging.getLogger(__name__)
+
+
+def _load_devices(device_ids: list[int]) -> dict[int, Device]:
+    db_conn = connect(dsn=os.getenv("DATABASE_URI"))
+    try:
+        return get_devices(db_conn, device_ids)
+    finally:
+        db_conn.close()
+
+
+class DeviceLookupBatcher:
+    def __init__(
+        self,
+        loader: Callable[[list[int]], dict[int, Device]] = _load_devices,
+        window_sec: Optional[float] = None,
+        max_batch: Optional[int] = None,
+    ):
+        self.loader = loader
+        self.window_sec = window_sec if window_sec is not None else (
+            float(os.getenv("WS_HANDSHAKE_BATCH_MS", "5")) / 1000.0
+        )
+        self.max_batch = max_batch if max_batch is not None else int(os.getenv("WS_HANDSHAKE_BATCH_MAX", "500"))
+        self._pending: dict[int, list[asyncio.Future]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: set[asyncio.Task] = set()
+        self.lookups = 0
+        self.queries = 0
+        self.largest_batch = 0
+
+    async def get(self, device_id: int) -> Optional[Device]:
+        """Device row for a handshake, or None if it does not exist. Raises if the query fails."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.lookups += 1
+        self._pending.setdefault(device_id, []).append(future)
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_sec, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: dict[int, list[asyncio.Future]]) -> None:
+        self.queries += 1
+        self.largest_batch = max(self.largest_batch, len(batch))
+        try:
+            devices = await asyncio.to_thread(self.loader, sorted(batch))
+        except Exception as e:
+            logger.warning(f"Batched device lookup failed ({len(batch)} devices): {e}")
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+        for device_id, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(devices.get(device_id))
+
+    def stats(self) -> dict:
+        return {
+            "lookups": self.lookups,
+            "queries": self.queries,
+            "largest_batch": self.largest_batch,
+            "window_ms": self.window_sec * 1000.0,
+        }
+
+
+# Shared by the device WebSocket endpoint
+device_lookup = DeviceLookupBatcher()
@@ -0,0 +1,210 @@
+"""
+Process-wide pooled httpx clients for upstream location providers.
+
+A fresh httpx.AsyncClient per call means a new TCP connection and TLS handshake to nRF
+Cloud (or HERE/Google) for every cell lookup and assistance fetch. Instead each provider
+gets one long-lived client with a keepalive pool:
+
+- HTTP_MAX_CONNECTIONS / HTTP_MAX_KEEPALIVE / HTTP_KEEPALIVE_EXPIRY_SEC size the pools.
+- Each provider has a default timeout, overridable with HTTP_TIMEOUT_<PROVIDER>_SEC
+  (e.g. HTTP_TIMEOUT_NRF_CLOUD_SEC). Individual calls may still pass timeout=.
+- HTTP/2 is used when h2 is installed (httpx[http2] in requirements; HTTP2_ENABLED=0
+  to turn off).
+- URLs on other hosts (the P-GPS download host comes from nRF Cloud) get a client per
+  origin via for_url().
+
+Clients are created lazily on the running event loop and closed in the app lifespan.
+stats() reports requests, new connections and TLS handshakes per provider, so
+connection reuse can be checked at /health.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import h2  # noqa: F401
+
+    _H2_AVAILABLE = True
+except ImportError:
+    _H2_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# name -> (origin, default timeout seconds)
+PROVIDERS: dict[str, tuple[str, float]] = {
+    "nrf_cloud": ("https://api.nrfcloud.com", 30.0),
+    "here": ("https://positioning.hereapi.com", 10.0),
+    "google": ("https://www.googleapis.com", 10.0),
+}
+
+_MAX_ADHOC_ORIGINS = 16
+
+
+class _ProviderStats:
+    __slots__ = ("requests", "errors", "connections_opened", "tls_handshakes", "total_ms")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.total_ms = 0.0
+
+
+class _CountingTransport(httpx.AsyncBaseTransport):
+    """Counts requests, and (via httpcore trace events) the connections they had to open."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, stats: _ProviderStats):
+        self._inner = inner
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = self._stats
+        previous = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict) -> None:
+            if event_name == "connection.connect_tcp.complete":
+                stats.connections_opened += 1
+            elif event_name == "connection.start_tls.complete":
+                stats.tls_handshakes += 1
+            if previous is not None:
+                await previous(event_name, info)
+
+        request.extensions["trace"] = trace
+        stats.requests += 1
+        started = time.monotonic()
+        try:
+            return await self._inner.handle_async_request(request)
+        except Exception:
+            stats.errors += 1
+            raise
+        finally:
+            stats.total_ms += (time.monotonic() - started) * 1000.0
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+class HttpClientRegistry:
+    def __init__(
+        self,
+        max_connections: Optional[int] = None,
+        max_keepalive: Optional[int] = None,
+        keepalive_expiry: Optional[float] = None,
+        http2: Optional[bool] = None,
+    ):
+        self.max_connections = max_connections if max_connections is not None else int(
+            os.getenv("HTTP_MAX_CONNECTIONS", "20")
+        )
+        self.max_keepalive = max_keepalive if max_keepalive is not None else int(
+            os.getenv("HTTP_MAX_KEEPALIVE", "10")
+        )
+        self.keepalive_expiry = keepalive_expiry if keepalive_expiry is not None else float(
+            os.getenv("HTTP_KEEPALIVE_EXPIRY_SEC", "60")
+        )
+        if http2 is None:
+            http2 = os.getenv("HTTP2_ENABLED", "1").strip().lower() not in ("0", "false", "no")
+        self.http2 = http2 and _H2_AVAILABLE
+        self._lock = threading.Lock()
+        # name -> (loop the client belongs to, client)
+        self._clients: dict[str, tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = {}
+        # Clients replaced for a new event loop, still to be closed on their own loop
+        self._retired: list[tuple[asyncio.AbstractEventLoop, httpx.AsyncClient]] = []
+        self._stats: dict[str, _ProviderStats] = {}
+
+    def timeout_for(self, name: str) -> float:
+        default = PROVIDERS.get(name, ("", 30.0))[1]
+        raw = os.getenv(f"HTTP_TIMEOUT_{name.upper().replace('-', '_').replace('.', '_')}_SEC")
+        try:
+            return float(raw) if raw else default
+        except ValueError:
+            return default
+
+    def _build(self, name: str) -> httpx.AsyncClient:
+        stats = self._stats.setdefault(name, _ProviderStats())
+        limits = httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        transport = _CountingTransport(httpx.AsyncHTTPTransport(http2=self.http2, limits=limits), stats)
+        return httpx.AsyncClient(transport=transport, timeout=self.timeout_for(name))
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Pooled client for a provider (see PROVIDERS) or any other stable name."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            entry = self._clients.get(name)
+            if entry is not None and entry[0] is loop:
+                return entry[1]
+            if entry is not None:
+                # Pools can't move between event loops; only happens in tests and scripts
+                logger.debug("HTTP client %s recreated for a new event loop", name)
+                self._retire(*entry)
+            client = self._build(name)
+            self._clients[name] = (loop, client)
+            return client
+
+    def for_url(self, url: str) -> httpx.AsyncClient:
+        """Client for the provider whose origin matches url, else one pooled per origin."""
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        for name, (provider_origin, _) in PROVIDERS.items():
+            if provider_origin == origin:
+                return self.get(name)
+        with self._lock:
+            known = origin in self._clients or len(self._clients) < len(PROVIDERS) + _MAX_ADHOC_ORIGINS
+        if not known:
+            logger.warning("HTTP client registry full; origin %s shares the default pool", origin)
+            return self.get("default")
+        return self.get(origin)
+
+    def _retire(self, loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient) -> None:
+        """Close a replaced client on its own loop now if that loop is running, else at aclose()."""
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+        elif not loop.is_closed():
+            self._retired.append((loop, client))
+        # A closed loop took its transports with it; there is nothing left to close them on
+
+    async def aclose(self) -> None:
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+            clients += self._retired
+            self._retired = []
+        loop = asyncio.get_running_loop()
+        for client_loop, client in clients:
+            if client_loop is loop:
+                await client.aclose()
+            elif client_loop.is_running():
+                asyncio.run_coroutine_threadsafe(client.aclose(), client_loop)
+
+    def stats(self) -> dict:
+        with self._lock:
+            open_clients = set(self._clients)
+            out = {}
+            for name, stats in self._stats.items():
+                requests = stats.requests
+                out[name] = {
+                    "open": name in open_clients,
+                    "timeout_sec": self.timeout_for(name),
+                    "requests": requests,
+                    "errors": stats.errors,
+                    "connections_opened": stats.connections_opened,
+                    "tls_handshakes": stats.tls_handshakes,
+                    "reuse_ratio": round(1 - stats.connections_opened / requests, 3) if requests else None,
+                    "avg_ms": round(stats.total_ms / requests, 1) if requests else None,
+                }
+        return {"http2": self.http2, "providers": out}
+
+
+http_clients = HttpClientRegistry()
@@ -0,0 +1,246 @@
+"""
+Offline cell location from an imported tower dataset (OpenCellID / Mozilla Location Service CSV).
+
+tools/import_cell_towers.py turns the CSV dumps into one index file: two .npy arrays back
+to back, the sorted packed keys (uint64) and then one (latitude, longitude, range_m)
+float32 row per key. A key packs the cell ids as
+
+    mcc 10 bits | mnc 10 bits | tac/lac 16 bits | cell id 28 bits
+
+Rows that don't fit the packing (5G NR ids, extended TACs) are skipped at import. Both
+arrays are mapped read-only, so every worker shares one copy through the page cache. A
+lookup is one vectorized searchsorted over the cells in the request. The position is the
+RSRP-weighted centroid of the towers found, and the accuracy is their weighted range.
+
+Enabled by CELL_LOCATION_PROVIDER=local, or as the first stage of auto, when
+CELL_TOWER_DB_PATH points at an imported file. The file is re-opened when it changes on
+disk, checked at most every CELL_TOWER_DB_CHECK_SEC.
+"""
+
+from __future__ import annotations
+
+import gzip
+import logging
+import os
+import threading
+import time
+from typing import Iterable, List, Optional
+
+import numpy as np
+
+from api.endpoints.cell_location import CellInfo, CellLocationResponse
+from api.services.cell_location_cache import tower_key, weighted_centroid
+
+logger = logging.getLogger(__name__)
+
+SOURCE_LOCAL = "local"
+
+KEY_DTYPE = np.dtype("<u8")
+TOWER_DTYPE = np.dtype([("latitude", "<f4"), ("longitude", "<f4"), ("range_m", "<f4")])
+
+# OpenCellID and MLS exports share this header
+CSV_COLUMNS = (
+    "radio", "mcc", "net", "area", "cell", "unit", "lon", "lat", "range",
+    "samples", "changeable", "created", "updated", "averageSignal",
+)
+
+_MCC_BITS, _MNC_BITS, _TAC_BITS, _ECI_BITS = 10, 10, 16, 28
+_DEFAULT_RANGE_M = 1000.0
+
+
+def pack_keys(mcc, mnc, tac, eci) -> np.ndarray:
+    """Packed uint64 keys; works on scalars and arrays. Callers check fits() first."""
+    mcc, mnc, tac, eci = (np.asarray(v, dtype=np.uint64) for v in (mcc, mnc, tac, eci))
+    key = mcc << np.uint64(_MNC_BITS + _TAC_BITS + _ECI_BITS)
+    key |= mnc << np.uint64(_TAC_BITS + _ECI_BITS)
+    key |= tac << np.uint64(_ECI_BITS)
+    return key | eci
+
+
+def fits(mcc, mnc, tac, eci) -> np.ndarray:
+    """Mask of rows whose ids fit the packed key."""
+    mcc, mnc, tac, eci = (np.asarray(v, dtype=np.int64) for v in (mcc, mnc, tac, eci))
+    return (
+        (mcc >= 0) & (mcc < 1 << _MCC_BITS)
+        & (mnc >= 0) & (mnc < 1 << _MNC_BITS)
+        & (tac >= 0) & (tac < 1 << _TAC_BITS)
+        & (eci >= 0) & (eci < 1 << _ECI_BITS)
+    )
+
+
+def _has_header(path: str) -> bool:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        return f.readline().startswith(b"radio")
+
+
+def _write_index(path: str, keys: np.ndarray, towers: np.ndarray) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.lib.format.write_array(f, keys)
+        np.lib.format.write_array(f, towers)
+    os.replace(tmp_path, path)
+
+
+def _map_index(path: str) -> tuple[np.ndarray, np.ndarray]:
+    arrays = []
+    with open(path, "rb") as f:
+        for dtype in (KEY_DTYPE, TOWER_DTYPE):
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, _, found = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, _, found = np.lib.format.read_array_header_2_0(f)
+            if found != dtype or len(shape) != 1:
+                raise ValueError(f"{path} is not a cell tower index")
+            offset = f.tell()
+            if shape[0]:
+                arrays.append(np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape))
+            else:
+                arrays.append(np.empty(0, dtype=dtype))
+            f.seek(offset + shape[0] * dtype.itemsize)
+    if len(arrays[0]) != len(arrays[1]):
+        raise ValueError(f"{path} is not a cell tower index")
+    return arrays[0], arrays[1]
+
+
+def build_tower_index(
+    csv_paths: Iterable[str],
+    out_path: str,
+    mcc_filter: Optional[set[int]] = None,
+    radios: Optional[set[str]] = None,
+    chunk_rows: int = 1_000_000,
+) -> dict:
+    """
+    Import OpenCellID/MLS CSV files (plain or .gz) into a tower index file.
+
+    Later rows win when a cell appears more than once. The output is written next to
+    out_path and renamed into place, so a running server never maps a partial file.
+    :return: Counts of rows read, imported and skipped.
+    """
+    import pandas as pd
+
+    key_parts: list[np.ndarray] = []
+    parts: list[np.ndarray] = []
+    read = skipped = 0
+    for path in csv_paths:
+        reader = pd.read_csv(
+            path,
+            names=list(CSV_COLUMNS),
+            header=0 if _has_header(path) else None,
+            usecols=["radio", "mcc", "net", "area", "cell", "lon", "lat", "range"],
+            chunksize=chunk_rows,
+        )
+        for chunk in reader:
+            read += len(chunk)
+            chunk = chunk.dropna(subset=["mcc", "net", "area", "cell", "lon", "lat"])
+            if radios:
+                chunk = chunk[chunk["radio"].str.upper().isin(radios)]
+            if mcc_filter:
+                chunk = chunk[chunk["mcc"].isin(mcc_filter)]
+            mcc = chunk["mcc"].to_numpy(np.int64)
+            mnc = chunk["net"].to_numpy(np.int64)
+            tac = chunk["area"].to_numpy(np.int64)
+            eci = chunk["cell"].to_numpy(np.int64)
+            ok = fits(mcc, mnc, tac, eci)
+            skipped += len(chunk) - int(ok.sum())
+            key_parts.append(pack_keys(mcc[ok], mnc[ok], tac[ok], eci[ok]))
+            part = np.empty(int(ok.sum()), dtype=TOWER_DTYPE)
+            part["latitude"] = chunk["lat"].to_numpy(np.float32)[ok]
+            part["longitude"] = chunk["lon"].to_numpy(np.float32)[ok]
+            ranges = chunk["range"].to_numpy(np.float32, na_value=0.0)[ok]
+            part["range_m"] = np.where(ranges > 0, ranges, _DEFAULT_RANGE_M)
+            parts.append(part)
+
+    keys = np.concatenate(key_parts) if key_parts else np.empty(0, dtype=KEY_DTYPE)
+    towers = np.concatenate(parts) if parts else np.empty(0, dtype=TOWER_DTYPE)
+    # Stable sort keeps file order among duplicates; keep the last of each key
+    order = np.argsort(keys, kind="stable")
+    keys, towers = keys[order], towers[order]
+    last = np.append(keys[1:] != keys[:-1], True) if len(keys) else np.ones(0, dtype=bool)
+    duplicates = len(keys) - int(last.sum())
+    keys, towers = keys[last], towers[last]
+
+    _write_index(out_path, keys, towers)
+    return {"read": read, "imported": len(towers), "skipped": skipped, "duplicates": duplicates}
+
+
+class LocalCellDatabase:
+    def __init__(self, path: str):
+        self.path = path
+        self._keys, self._towers = _map_index(path)
+        stat = os.stat(path)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        self.lookups = 0
+        self.hits = 0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def locate(self, cells: List[CellInfo]) -> Optional[CellLocationResponse]:
+        """Weighted centroid of the request's cells found in the dataset, else None."""
+        self.lookups += 1
+        ids = np.array([tower_key(c) for c in cells], dtype=np.int64).T
+        ok = fits(*ids)
+        if not ok.any() or not len(self._keys):
+            return None
+        query = pack_keys(*ids[:, ok])
+        index = np.minimum(np.searchsorted(self._keys, query), len(self._keys) - 1)
+        found = self._keys[index] == query
+        if not found.any():
+            return None
+        rows = self._towers[index[found]]
+        signals = np.array([c.signal for c in cells])[ok][found]
+        points = list(
+            zip(
+                rows["latitude"].tolist(),
+                rows["longitude"].tolist(),
+                rows["range_m"].tolist(),
+                signals.tolist(),
+            )
+        )
+        self.hits += 1
+        lat, lon, accuracy = weighted_centroid(points)
+        return CellLocationResponse(latitude=lat, longitude=lon, accuracy=accuracy, source=SOURCE_LOCAL)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "towers": len(self),
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_ratio": round(self.hits / self.lookups, 3) if self.lookups else None,
+        }
+
+
+_lock = threading.Lock()
+_local_db: Optional[LocalCellDatabase] = None
+_checked: tuple[str, float] = ("", float("-inf"))
+
+
+def get_local_cell_db() -> Optional[LocalCellDatabase]:
+    """The tower dataset at CELL_TOWER_DB_PATH, re-opened if the file was replaced; None if absent."""
+    global _local_db, _checked
+    path = os.getenv("CELL_TOWER_DB_PATH", "/app/cell_towers/cell_towers.idx").strip()
+    now = time.monotonic()
+    checked_path, checked_at = _checked
+    if checked_path == path and now - checked_at < float(os.getenv("CELL_TOWER_DB_CHECK_SEC", "60")):
+        return _local_db
+    with _lock:
+        _checked = (path, now)
+        if not path:
+            _local_db = None
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            _local_db = None
+            return None
+        if _local_db is None or _local_db.path != path or _local_db.signature != (stat.st_mtime_ns, stat.st_size):
+            try:
+                _local_db = LocalCellDatabase(path)
+                logger.info("Loaded cell tower dataset path=%s towers=%s", path, len(_local_db))
+            except Exception as exc:
+                logger.warning("Cell tower dataset unusable path=%s err=%s", path, exc)
+                _local_db = None
+        return _local_db
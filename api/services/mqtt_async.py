@@ -0,0 +1,261 @@
+"""
+Asyncio-native MQTT publisher (internal broker, port 1883).
+
+paho is driven by the application's event loop instead of its own network thread:
+the socket is registered with loop.add_reader/add_writer and a small task calls
+loop_misc() for keepalives. Each publish returns once its PUBACK arrives (on_publish
+resolves a future keyed by mid), so no thread is parked in wait_for_publish().
+
+- At most MQTT_ASYNC_MAX_INFLIGHT publishes await an ack at once; further callers wait
+  on a semaphore.
+- Dropped connections are re-established with jittered exponential backoff. paho
+  re-sends unacknowledged QoS 1 messages after the reconnect.
+- A publish that is not acknowledged within MQTT_PUBLISH_TIMEOUT_SEC reports failure.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import paho.mqtt.client as mqtt
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMqttPublisher:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        client_id: str,
+        keepalive: int = 60,
+        max_inflight: Optional[int] = None,
+        publish_timeout: Optional[float] = None,
+        backoff_min: float = 1.0,
+        backoff_max: float = 30.0,
+    ):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.keepalive = keepalive
+        self.max_inflight = max_inflight if max_inflight is not None else int(
+            os.getenv("MQTT_ASYNC_MAX_INFLIGHT", "100")
+        )
+        self.publish_timeout = publish_timeout if publish_timeout is not None else float(
+            os.getenv("MQTT_PUBLISH_TIMEOUT_SEC", "5")
+        )
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._client: Optional[mqtt.Client] = None
+        self._connected = asyncio.Event()
+        self._inflight: Optional[asyncio.Semaphore] = None
+        self._pending: dict[int, asyncio.Future] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._reconnecting = False
+        self._stopping = False
+        self.published = 0
+        self.failed = 0
+        self.reconnects = 0
+        self.ack_latency_ms_total = 0.0
+
+    # -- lifecycle ------------------------------------------------------------------------
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._inflight = asyncio.Semaphore(self.max_inflight)
+        self._stopping = False
+        client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id=self.client_id)
+        client.max_inflight_messages_set(self.max_inflight)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish = self._on_publish
+        client.on_socket_open = self._on_socket_open
+        client.on_socket_close = self._on_socket_close
+        client.on_socket_register_write = self._on_socket_register_write
+        client.on_socket_unregister_write = self._on_socket_unregister_write
+        self._client = client
+        self._spawn(self._misc_loop())
+        self._spawn(self._reconnect(first=True))
+
+    async def stop(self) -> None:
+        self._stopping = True
+        client = self._client
+        if client is not None:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+        for task in list(self._tasks):
+            task.cancel()
+        for task in list(self._tasks):
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        for future in self._pending.values():
+            if not future.done():
+                future.set_result(False)
+        self._pending.clear()
+        self._connected.clear()
+        self._client = None
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def is_connected(self) -> bool:
+        return self._connected.is_set()
+
+    async def wait_connected(self, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._connected.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    # -- publishing -----------------------------------------------------------------------
+
+    async def publish(self, topic: str, payload: str | bytes, qos: int = 1, retain: bool = False) -> bool:
+        """Publish and wait for the broker ack (QoS 1) or the write (QoS 0). False on timeout."""
+        if self._client is None or self._inflight is None:
+            return False
+        started = time.monotonic()
+        async with self._inflight:
+            remaining = self.publish_timeout - (time.monotonic() - started)
+            if not self._connected.is_set() and not await self.wait_connected(max(0.0, remaining)):
+                self.failed += 1
+                return False
+            info = self._client.publish(topic, payload, qos=qos, retain=retain)
+            if info.rc not in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                self.failed += 1
+                logger.warning("MQTT async publish rejected topic=%s rc=%s", topic, info.rc)
+                return False
+            future = self._loop.create_future()
+            if info.is_published():
+                future.set_result(True)
+            else:
+                self._pending[info.mid] = future
+            try:
+                remaining = self.publish_timeout - (time.monotonic() - started)
+                ok = await asyncio.wait_for(future, max(0.0, remaining))
+            except asyncio.TimeoutError:
+                ok = False
+            finally:
+                self._pending.pop(info.mid, None)
+        if ok:
+            self.published += 1
+            self.ack_latency_ms_total += (time.monotonic() - started) * 1000.0
+        else:
+            self.failed += 1
+            logger.warning("MQTT async publish not acknowledged topic=%s", topic)
+        return ok
+
+    async def publish_many(self, messages: list[tuple[str, str | bytes, int, bool]]) -> bool:
+        """Publish several messages concurrently (bounded by the in-flight window)."""
+        results = await asyncio.gather(*(self.publish(t, p, qos=q, retain=r) for t, p, q, r in messages))
+        return all(results)
+
+    # -- paho callbacks (all run on the event loop, except socket_open during connect) ---
+
+    def _on_publish(self, client, userdata, mid, reason_code=None, properties=None):
+        future = self._pending.pop(mid, None)
+        if future is not None and not future.done():
+            future.set_result(True)
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        if reason_code != 0:
+            logger.warning("MQTT async publisher connect refused rc=%s", reason_code)
+            return
+        logger.info("MQTT async publisher connected host=%s port=%s", self.host, self.port)
+        self._connected.set()
+
+    def _on_disconnect(self, client, userdata, flags=None, reason_code=None, properties=None):
+        self._connected.clear()
+        if not self._stopping:
+            logger.warning("MQTT async publisher disconnected rc=%s; reconnecting", reason_code)
+            self._spawn(self._reconnect())
+
+    def _threadsafe(self, fn, *args) -> None:
+        # Socket callbacks fire on the loop, except while connect() runs in a worker thread.
+        # On the loop they must apply immediately: on_socket_close precedes sock.close().
+        if threading.get_ident() == self._loop_thread:
+            fn(*args)
+        else:
+            self._loop.call_soon_threadsafe(fn, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._threadsafe(self._loop.add_reader, sock, self._loop_read)
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._threadsafe(self._loop.remove_reader, sock)
+        self._threadsafe(self._loop.remove_writer, sock)
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._threadsafe(self._loop.add_writer, sock, self._loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._threadsafe(self._loop.remove_writer, sock)
+
+    def _loop_read(self) -> None:
+        if self._client is not None:
+            self._client.loop_read()
+
+    def _loop_write(self) -> None:
+        if self._client is not None:
+            self._client.loop_write()
+
+    async def _misc_loop(self) -> None:
+        while True:
+            await asyncio.sleep(1.0)
+            if self._client is not None:
+                self._client.loop_misc()
+
+    async def _reconnect(self, first: bool = False) -> None:
+        if self._reconnecting:
+            return
+        self._reconnecting = True
+        delay = self.backoff_min
+        try:
+            while not self._stopping:
+                try:
+                    # TCP connect and CONNECT write happen in a thread; the socket then lives on the loop
+                    if first:
+                        await asyncio.to_thread(self._client.connect, self.host, self.port, self.keepalive)
+                    else:
+                        await asyncio.to_thread(self._client.reconnect)
+                        self.reconnects += 1
+                    return
+                except Exception as exc:
+                    logger.warning(
+                        "MQTT async publisher connect failed host=%s port=%s err=%s; retry in %.1fs",
+                        self.host,
+                        self.port,
+                        exc,
+                        delay,
+                    )
+                await asyncio.sleep(delay * random.uniform(0.8, 1.2))
+                delay = min(self.backoff_max, delay * 2)
+        finally:
+            self._reconnecting = False
+
+    def stats(self) -> dict:
+        acked = self.published
+        return {
+            "connected": self.is_connected(),
+            "in_flight": len(self._pending),
+            "max_inflight": self.max_inflight,
+            "published": self.published,
+            "failed": self.failed,
+            "reconnects": self.reconnects,
+            "avg_ack_latency_ms": round(self.ack_latency_ms_total / acked, 2) if acked else None,
+        }
@@ -9,22 +9,26 @@ firmware can reuse controls_parse_json().
 from __future__ import annotations
 
 import asyncio
-import base64
 import json
 import logging
 import os
+import socket
 import threading
 import time
 from typing import Any
 
 import paho.mqtt.client as mqtt
 
+from api.agnss.framing import FORMAT_BINARY, FORMAT_JSON, iter_binary_frames, iter_json_frames
+from api.services.mqtt_async import AsyncMqttPublisher
 from api.services.mqtt_topics import controls_topic, agnss_data_topic, location_topic, cell_locate_response_topic
 
 logger = logging.getLogger(__name__)
 
 _client: mqtt.Client | None = None
 _client_lock = threading.Lock()
+# Event-loop publisher started by the app lifespan (see start_async_publisher)
+_async_publisher: AsyncMqttPublisher | None = None
 
 
 def mqtt_enabled() -> bool:
@@ -32,6 +36,17 @@ def mqtt_enabled() -> bool:
     return flag not in ("0", "false", "no", "off")
 
 
+def replica_client_id(env_name: str, base: str) -> str:
+    """
+    Client id for this process. An explicit env value wins; otherwise base-hostname-pid,
+    so API replicas (and workers) never share an id and kick each other off the broker.
+    """
+    explicit = os.getenv(env_name, "").strip()
+    if explicit:
+        return explicit
+    return f"{base}-{socket.gethostname()}-{os.getpid()}"
+
+
 def control_data_from_device(device: Any) -> dict[str, Any]:
     """Build MQTT/WS control payload fields from a device row or model."""
     control_version_val = int(getattr(device, "control_version", 0) or 0)
@@ -109,7 +124,7 @@ def _connect_client() -> mqtt.Client | None:
 
         client = mqtt.Client(
             callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
-            client_id=os.getenv("MQTT_CLIENT_ID", "gps-tracking-api"),
+            client_id=replica_client_id("MQTT_CLIENT_ID", "gps-tracking-api"),
         )
         keepalive = int(os.getenv("MQTT_KEEPALIVE_SEC", "60"))
         host = _mqtt_host()
@@ -131,6 +146,14 @@ def _connect_client() -> mqtt.Client | None:
             return None
 
 
+def _controls_message(device_id: int, control_data: dict[str, Any]) -> tuple[str, str, int, bool]:
+    topic = controls_topic(device_id)
+    payload = json.dumps(build_controls_payload(device_id, control_data), separators=(",", ":"))
+    qos = int(os.getenv("MQTT_CONTROLS_QOS", "1"))
+    retain = os.getenv("MQTT_CONTROLS_RETAIN", "1").strip().lower() not in ("0", "false", "no")
+    return topic, payload, qos, retain
+
+
 def publish_device_controls(device_id: int, control_data: dict[str, Any]) -> bool:
     """
     Publish current controls to the device topic (QoS 1, retained).
@@ -145,11 +168,7 @@ def publish_device_controls(device_id: int, control_data: dict[str, Any]) -> boo
     if client is None:
         return False
 
-    topic = controls_topic(device_id)
-    payload_obj = build_controls_payload(device_id, control_data)
-    payload = json.dumps(payload_obj, separators=(",", ":"))
-    qos = int(os.getenv("MQTT_CONTROLS_QOS", "1"))
-    retain = os.getenv("MQTT_CONTROLS_RETAIN", "1").strip().lower() not in ("0", "false", "no")
+    topic, payload, qos, retain = _controls_message(device_id, control_data)
 
     try:
         info = client.publish(topic, payload, qos=qos, retain=retain)
@@ -168,14 +187,42 @@ def publish_device_controls(device_id: int, control_data: dict[str, Any]) -> boo
 
 
 async def publish_device_controls_async(device_id: int, control_data: dict[str, Any]) -> bool:
-    return await asyncio.to_thread(publish_device_controls, device_id, control_data)
+    publisher = _async_publisher
+    if publisher is None:
+        return await asyncio.to_thread(publish_device_controls, device_id, control_data)
+    topic, payload, qos, retain = _controls_message(device_id, control_data)
+    ok = await publisher.publish(topic, payload, qos=qos, retain=retain)
+    if ok:
+        logger.info(
+            "MQTT controls published device_id=%s topic=%s bytes=%s retain=%s",
+            device_id,
+            topic,
+            len(payload),
+            retain,
+        )
+    return ok
+
+
+def _agnss_messages(
+    device_id: int, agnss_data: bytes, fmt: str = FORMAT_JSON
+) -> list[tuple[str, str | bytearray, int, bool]]:
+    chunk_size = int(os.getenv("MQTT_AGNSS_CHUNK_BYTES", "768"))
+    topic = agnss_data_topic(device_id)
+    qos = int(os.getenv("MQTT_AGNSS_QOS", "1"))
+    frames = (
+        iter_binary_frames(agnss_data, chunk_size)
+        if fmt == FORMAT_BINARY
+        else iter_json_frames(agnss_data, chunk_size)
+    )
+    return [(topic, frame, qos, False) for frame in frames]
 
 
-def publish_agnss_chunks(device_id: int, agnss_data: bytes) -> bool:
+def publish_agnss_chunks(device_id: int, agnss_data: bytes, fmt: str = FORMAT_JSON) -> bool:
     """
-    Publish A-GNSS binary as chunked JSON on devices/{id}/agnss_data (QoS 1, not retained).
+    Publish A-GNSS binary in chunks on devices/{id}/agnss_data (QoS 1, not retained).
 
-    Each message: {"seq": N, "total": T, "chunk_b64": "..."} with ~768 raw bytes per chunk.
+    Default (json): {"seq": N, "total": T, "chunk_b64": "..."} with ~768 raw bytes per chunk.
+    fmt="binary": 9-byte seq/total/crc32 header + raw bytes per chunk (see api.agnss.framing).
     """
     if not mqtt_enabled() or not agnss_data:
         return False
@@ -184,33 +231,24 @@ def publish_agnss_chunks(device_id: int, agnss_data: bytes) -> bool:
     if client is None:
         return False
 
-    chunk_size = int(os.getenv("MQTT_AGNSS_CHUNK_BYTES", "768"))
     topic = agnss_data_topic(device_id)
-    qos = int(os.getenv("MQTT_AGNSS_QOS", "1"))
-    total = (len(agnss_data) + chunk_size - 1) // chunk_size
 
     try:
+        messages = _agnss_messages(device_id, agnss_data, fmt)
         publishes = []
-        for seq in range(total):
-            start = seq * chunk_size
-            chunk = agnss_data[start : start + chunk_size]
-            payload_obj = {
-                "seq": seq,
-                "total": total,
-                "chunk_b64": base64.b64encode(chunk).decode("ascii"),
-            }
-            payload = json.dumps(payload_obj, separators=(",", ":"))
-            info = client.publish(topic, payload, qos=qos, retain=False)
+        for topic, payload, qos, retain in messages:
+            info = client.publish(topic, payload, qos=qos, retain=retain)
             publishes.append(info)
         timeout = float(os.getenv("MQTT_PUBLISH_TIMEOUT_SEC", "5"))
         for info in publishes:
             info.wait_for_publish(timeout=timeout)
         logger.info(
-            "MQTT A-GNSS published device_id=%s topic=%s bytes=%s chunks=%s",
+            "MQTT A-GNSS published device_id=%s topic=%s bytes=%s chunks=%s format=%s",
             device_id,
             topic,
             len(agnss_data),
-            total,
+            len(messages),
+            fmt,
         )
         return True
     except Exception as exc:
@@ -218,8 +256,31 @@ def publish_agnss_chunks(device_id: int, agnss_data: bytes) -> bool:
         return False
 
 
-async def publish_agnss_chunks_async(device_id: int, agnss_data: bytes) -> bool:
-    return await asyncio.to_thread(publish_agnss_chunks, device_id, agnss_data)
+async def publish_agnss_chunks_async(device_id: int, agnss_data: bytes, fmt: str = FORMAT_JSON) -> bool:
+    publisher = _async_publisher
+    if publisher is None:
+        return await asyncio.to_thread(publish_agnss_chunks, device_id, agnss_data, fmt)
+    if not agnss_data:
+        return False
+    messages = _agnss_messages(device_id, agnss_data, fmt)
+    ok = await publisher.publish_many(messages)
+    if ok:
+        logger.info(
+            "MQTT A-GNSS published device_id=%s topic=%s bytes=%s chunks=%s format=%s",
+            device_id,
+            agnss_data_topic(device_id),
+            len(agnss_data),
+            len(messages),
+            fmt,
+        )
+    return ok
+
+
+def _cell_locate_message(device_id: int, payload: dict[str, Any]) -> tuple[str, str, int, bool]:
+    body = dict(payload)
+    body.setdefault("device_id", device_id)
+    qos = int(os.getenv("MQTT_CELL_LOCATE_QOS", "1"))
+    return cell_locate_response_topic(device_id), json.dumps(body, separators=(",", ":")), qos, False
 
 
 def publish_cell_locate_response(device_id: int, payload: dict[str, Any]) -> bool:
@@ -232,13 +293,10 @@ def publish_cell_locate_response(device_id: int, payload: dict[str, Any]) -> boo
         return False
 
     topic = cell_locate_response_topic(device_id)
-    qos = int(os.getenv("MQTT_CELL_LOCATE_QOS", "1"))
-    body = dict(payload)
-    body.setdefault("device_id", device_id)
 
     try:
-        message = json.dumps(body, separators=(",", ":"))
-        info = client.publish(topic, message, qos=qos, retain=False)
+        topic, message, qos, retain = _cell_locate_message(device_id, payload)
+        info = client.publish(topic, message, qos=qos, retain=retain)
         info.wait_for_publish(timeout=float(os.getenv("MQTT_PUBLISH_TIMEOUT_SEC", "5")))
         logger.info("MQTT cell_locate_response published device_id=%s topic=%s", device_id, topic)
         return True
@@ -253,17 +311,56 @@ def publish_cell_locate_response(device_id: int, payload: dict[str, Any]) -> boo
 
 
 async def publish_cell_locate_response_async(device_id: int, payload: dict[str, Any]) -> bool:
-    return await asyncio.to_thread(publish_cell_locate_response, device_id, payload)
+    publisher = _async_publisher
+    if publisher is None:
+        return await asyncio.to_thread(publish_cell_locate_response, device_id, payload)
+    topic, message, qos, retain = _cell_locate_message(device_id, payload)
+    ok = await publisher.publish(topic, message, qos=qos, retain=retain)
+    if ok:
+        logger.info("MQTT cell_locate_response published device_id=%s topic=%s", device_id, topic)
+    return ok
+
+
+async def start_async_publisher() -> None:
+    """
+    Start the event-loop MQTT publisher (app lifespan). The *_async publish helpers use it
+    from then on; before it starts (scripts, tests) they fall back to the threaded client.
+    """
+    global _async_publisher
+
+    if not mqtt_enabled() or _async_publisher is not None:
+        return
+    publisher = AsyncMqttPublisher(
+        host=_mqtt_host(),
+        port=_mqtt_port(),
+        client_id=replica_client_id("MQTT_CLIENT_ID", "gps-tracking-api"),
+        keepalive=int(os.getenv("MQTT_KEEPALIVE_SEC", "60")),
+    )
+    await publisher.start()
+    _async_publisher = publisher
+
+
+async def stop_async_publisher() -> None:
+    global _async_publisher
+
+    publisher, _async_publisher = _async_publisher, None
+    if publisher is not None:
+        await publisher.stop()
 
 
 def mqtt_status() -> dict[str, Any]:
-    from api.services.mqtt_subscriber import subscriber_running
+    from api.services.mqtt_subscriber import admission_stats, subscriber_running, worker_stats
 
-    connected = _client is not None and _client.is_connected()
+    connected = (_client is not None and _client.is_connected()) or (
+        _async_publisher is not None and _async_publisher.is_connected()
+    )
     return {
         "enabled": mqtt_enabled(),
         "publisher_connected": connected,
+        "async_publisher": _async_publisher.stats() if _async_publisher is not None else None,
         "subscriber_running": subscriber_running(),
+        "subscriber_workers": worker_stats(),
+        "subscriber_admission": admission_stats(),
         "host": _mqtt_host(),
         "port": _mqtt_port(),
         "controls_topic_example": controls_topic(0),
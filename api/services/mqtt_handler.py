@@ -13,6 +13,7 @@ from typing import Any
 
 from psycopg2 import connect
 
+from api.agnss.framing import normalize_format
 from api.db.devices import ack_device_controls_applied, ack_device_reset
 from api.endpoints.realtime_endpoints import (
     broadcast_control_applied_to_users,
@@ -225,13 +226,16 @@ def _handle_agnss_request(device_id: int, payload: dict[str, Any]) -> None:
             logger.warning("MQTT agnss_request unavailable device_id=%s", device_id)
             return
 
-        ok = await publish_agnss_chunks_async(device_id, agnss_data)
+        # Devices opt in to raw binary frames per request; older firmware gets base64 JSON
+        fmt = normalize_format(body.get("format"))
+        ok = await publish_agnss_chunks_async(device_id, agnss_data, fmt)
         if ok:
             logger.info(
-                "MQTT agnss_request fulfilled device_id=%s bytes=%s source=%s",
+                "MQTT agnss_request fulfilled device_id=%s bytes=%s source=%s format=%s",
                 device_id,
                 len(agnss_data),
                 source or "unknown",
+                fmt,
             )
         else:
             logger.warning("MQTT agnss_data publish failed device_id=%s", device_id)
@@ -7,12 +7,17 @@ from __future__ import annotations
 import logging
 import os
 import threading
+from typing import Callable
 
 import paho.mqtt.client as mqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
 
-from api.services.mqtt_client import mqtt_enabled
+from api.services.admission import DeferredQueue, mqtt_uplink_admission
+from api.services.mqtt_client import mqtt_enabled, replica_client_id
 from api.services.mqtt_handler import handle_mqtt_message
-from api.services.mqtt_topics import device_uplink_subscriptions
+from api.services.mqtt_topics import parse_device_id_from_topic, subscriber_subscriptions
+from api.services.mqtt_workers import ShardedWorkerPool
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +25,24 @@ _subscriber: mqtt.Client | None = None
 _subscriber_lock = threading.Lock()
 _subscriber_running = False
 
+# Handlers run here, sharded by device_id, never on paho's network thread.
+# QoS 1 messages are acked only once handled, and the broker sends at most
+# MQTT_RECEIVE_MAXIMUM unacked messages, so a shard sized at least that large
+# does not fill up; if one does anyway the message is left unacked, never dropped
+_workers = ShardedWorkerPool("mqtt-uplink")
+_RECEIVE_MAXIMUM = int(os.getenv("MQTT_RECEIVE_MAXIMUM", "100"))
+_overflow_unacked = 0
+_counter_lock = threading.Lock()
+
+# Uplink refused by admission control is set aside unacked, together with every later
+# message from the same device, and resubmitted after the jittered delay: device order
+# holds and no worker waits. Unacked messages count against the broker's in-flight
+# window, so that is what bounds how much is held here.
+_held: dict[int, list[tuple[str, bytes, Callable[[], None] | None]]] = {}
+_held_lock = threading.Lock()
+_deferred = DeferredQueue("mqtt-uplink", maxsize=int(os.getenv("MQTT_WORKER_QUEUE_MAX", "1000")))
+_deferrals = 0
+
 
 def _mqtt_host() -> str:
     return os.getenv("MQTT_HOST", "mosquitto").strip()
@@ -33,16 +56,97 @@ def _on_connect(client, userdata, flags, reason_code, properties=None):
     if reason_code != 0:
         logger.error("MQTT subscriber connect failed rc=%s", reason_code)
         return
-    for topic, qos in device_uplink_subscriptions():
+    for topic, qos in subscriber_subscriptions():
         client.subscribe(topic, qos=qos)
         logger.info("MQTT subscriber subscribed topic=%s qos=%s", topic, qos)
 
 
-def _on_message(client, userdata, msg):
+def _receive_maximum() -> int:
+    """Broker in-flight window for this client, capped so one shard can take all of it."""
+    return max(1, min(_RECEIVE_MAXIMUM, _workers.queue_max, 65535))
+
+
+def _connect_properties() -> Properties:
+    properties = Properties(PacketTypes.CONNECT)
+    properties.ReceiveMaximum = _receive_maximum()
+    return properties
+
+
+def _submit(topic: str, payload: bytes, ack: Callable[[], None] | None = None) -> bool:
+    """
+    Queue a message on its device's worker without blocking. If the shard is full
+    the message is not acked: it keeps its broker in-flight slot and is redelivered
+    after a reconnect. Returns False in that case.
+    """
+    global _overflow_unacked
+
+    device_id = parse_device_id_from_topic(topic) or 0
+    with _held_lock:
+        held = _held.get(device_id)
+        if held is not None:
+            held.append((topic, payload, ack))
+            return True
+        if _workers.submit(device_id, lambda: _dispatch(device_id, topic, payload, ack)):
+            return True
+    with _counter_lock:
+        _overflow_unacked += 1
+    logger.warning("MQTT uplink worker queue full; leaving unacked topic=%s", topic)
+    return False
+
+
+def _hold(device_id: int, messages: list, delay: float) -> None:
+    """Set a device's messages aside (caller holds _held_lock) and resubmit them after delay."""
+    global _deferrals
+
+    if not _deferred.push(delay, lambda: _resume(device_id)):
+        logger.warning("MQTT uplink deferral queue full; leaving %s unacked device_id=%s", len(messages), device_id)
+        return
+    _held[device_id] = messages
+    _deferrals += 1
+
+
+def _resume(device_id: int) -> None:
+    """Hand a device's held messages back to its worker, in arrival order."""
+    with _held_lock:
+        messages = _held.pop(device_id, [])
+        for i, (topic, payload, ack) in enumerate(messages):
+            if not _workers.submit(device_id, lambda t=topic, p=payload, a=ack: _dispatch(device_id, t, p, a)):
+                _hold(device_id, messages[i:], mqtt_uplink_admission.retry_min_sec)
+                return
+
+
+def _dispatch(device_id: int, topic: str, payload: bytes, ack: Callable[[], None] | None = None) -> None:
+    with _held_lock:
+        held = _held.get(device_id)
+        if held is not None:  # an earlier message from this device is waiting
+            held.append((topic, payload, ack))
+            return
+        retry_after = mqtt_uplink_admission.try_acquire()
+        if retry_after is not None:
+            _hold(device_id, [(topic, payload, ack)], retry_after)
+            return
+    try:
+        handle_mqtt_message(topic, payload)
+    except Exception as exc:
+        logger.exception("MQTT subscriber handler error topic=%s err=%s", topic, exc)
+    finally:
+        mqtt_uplink_admission.release()
+        _ack(ack)
+
+
+def _ack(ack: Callable[[], None] | None) -> None:
+    if ack is None:
+        return
     try:
-        handle_mqtt_message(msg.topic, msg.payload)
+        ack()
     except Exception as exc:
-        logger.exception("MQTT subscriber handler error topic=%s err=%s", msg.topic, exc)
+        logger.warning("MQTT uplink ack failed err=%s", exc)
+
+
+def _on_message(client, userdata, msg):
+    # Runs on paho's network thread: only hand off, never block. PUBACK is sent once a worker is done.
+    ack = (lambda: client.ack(msg.mid, msg.qos)) if msg.qos > 0 else None
+    _submit(msg.topic, msg.payload, ack=ack)
 
 
 def start_mqtt_subscriber() -> None:
@@ -58,13 +162,21 @@ def start_mqtt_subscriber() -> None:
 
         client = mqtt.Client(
             callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
-            client_id=os.getenv("MQTT_SUBSCRIBER_CLIENT_ID", "gps-tracking-api-sub"),
+            client_id=replica_client_id("MQTT_SUBSCRIBER_CLIENT_ID", "gps-tracking-api-sub"),
+            protocol=mqtt.MQTTv5,
+            manual_ack=True,
         )
         client.on_connect = _on_connect
         client.on_message = _on_message
 
+        _workers.start()
         try:
-            client.connect(_mqtt_host(), _mqtt_port(), keepalive=int(os.getenv("MQTT_KEEPALIVE_SEC", "60")))
+            client.connect(
+                _mqtt_host(),
+                _mqtt_port(),
+                keepalive=int(os.getenv("MQTT_KEEPALIVE_SEC", "60")),
+                properties=_connect_properties(),
+            )
             client.loop_start()
             _subscriber = client
             _subscriber_running = True
@@ -75,6 +187,7 @@ def start_mqtt_subscriber() -> None:
                 client.loop_stop()
             except Exception:
                 pass
+            _workers.stop()
 
 
 def stop_mqtt_subscriber() -> None:
@@ -88,6 +201,10 @@ def stop_mqtt_subscriber() -> None:
             _subscriber.disconnect()
         except Exception as exc:
             logger.warning("MQTT subscriber stop err=%s", exc)
+        _deferred.stop()
+        with _held_lock:
+            _held.clear()  # never acked: the broker redelivers them
+        _workers.stop()
         _subscriber = None
         _subscriber_running = False
         logger.info("MQTT subscriber stopped")
@@ -95,3 +212,13 @@ def stop_mqtt_subscriber() -> None:
 
 def subscriber_running() -> bool:
     return _subscriber_running
+
+
+def worker_stats() -> dict:
+    return {**_workers.stats(), "overflow_unacked": _overflow_unacked, "receive_maximum": _receive_maximum()}
+
+
+def admission_stats() -> dict:
+    with _held_lock:
+        held = {"deferred_devices": len(_held), "deferred_messages": sum(len(m) for m in _held.values())}
+    return {**mqtt_uplink_admission.stats(), "deferrals": _deferrals, **held}
@@ -59,6 +59,24 @@ def device_uplink_subscriptions() -> list[tuple[str, int]]:
     ]
 
 
+def uplink_share_group() -> str:
+    """MQTT v5 shared-subscription group for API replicas ("" = plain subscriptions)."""
+    return os.getenv("MQTT_SHARED_GROUP", "gps-api").strip().strip("/")
+
+
+def shared_subscription(topic: str, group: str) -> str:
+    return f"$share/{group}/{topic}" if group else topic
+
+
+def subscriber_subscriptions() -> list[tuple[str, int]]:
+    """
+    Uplink subscriptions as the API subscriber makes them: shared across replicas so
+    the broker delivers each message to exactly one API task in the group.
+    """
+    group = uplink_share_group()
+    return [(shared_subscription(topic, group), qos) for topic, qos in device_uplink_subscriptions()]
+
+
 def parse_device_id_from_topic(topic: str) -> int | None:
     parts = topic.split("/")
     if len(parts) < 3:
@@ -0,0 +1,119 @@
+"""
+Sharded worker threads for MQTT uplink handling.
+
+paho runs callbacks on its single network thread. Handling a location there (DB writes,
+geofence checks, SMTP/SMS) would stall every other device and the broker keepalive.
+Instead each message is queued to one of MQTT_WORKERS threads, chosen by device_id so
+messages from one device are still handled in order.
+
+Each shard queue holds at most MQTT_WORKER_QUEUE_MAX messages. The subscriber
+acknowledges QoS 1 messages only after they are handled, so under load the broker's
+in-flight window fills and it stops sending. When a shard is full, submit() refuses
+rather than blocking the caller.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+
+class ShardedWorkerPool:
+    def __init__(self, name: str, workers: Optional[int] = None, queue_max: Optional[int] = None):
+        self.name = name
+        self.workers = max(1, workers if workers is not None else int(os.getenv("MQTT_WORKERS", "4")))
+        self.queue_max = queue_max if queue_max is not None else int(os.getenv("MQTT_WORKER_QUEUE_MAX", "1000"))
+        self._queues: list[queue.Queue] = []
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self.busy = 0
+        self.max_depth_seen = 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            self._queues = [queue.Queue(maxsize=self.queue_max) for _ in range(self.workers)]
+            for shard, q in enumerate(self._queues):
+                thread = threading.Thread(target=self._run, args=(q,), name=f"{self.name}-{shard}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Let queued work finish (up to timeout), then drop the threads."""
+        with self._lock:
+            threads, queues = self._threads, self._queues
+            self._threads, self._queues = [], []
+        for q in queues:
+            try:
+                q.put(_STOP, timeout=timeout)
+            except queue.Full:
+                logger.warning("%s shard still full at shutdown; abandoning %s queued", self.name, q.qsize())
+        for thread in threads:
+            thread.join(timeout)
+
+    def running(self) -> bool:
+        return bool(self._threads)
+
+    def submit(self, key: int, fn: Callable[[], None]) -> bool:
+        """Queue fn on the shard for key. False (without blocking) when not running or the shard is full."""
+        queues = self._queues
+        if not queues:
+            return False
+        q = queues[key % len(queues)]
+        try:
+            q.put_nowait(fn)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.submitted += 1
+            self.max_depth_seen = max(self.max_depth_seen, q.qsize())
+        return True
+
+    def _run(self, q: queue.Queue) -> None:
+        while True:
+            fn = q.get()
+            if fn is _STOP:
+                return
+            with self._lock:
+                self.busy += 1
+            try:
+                fn()
+            except Exception as exc:
+                with self._lock:
+                    self.failed += 1
+                logger.exception("%s worker error err=%s", self.name, exc)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                    self.processed += 1
+
+    def stats(self) -> dict:
+        depths = [q.qsize() for q in self._queues]
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "running": bool(self._threads),
+                "queue_max_per_worker": self.queue_max,
+                "queue_depths": depths,
+                "queued": sum(depths),
+                "max_depth_seen": self.max_depth_seen,
+                "busy": self.busy,
+                "submitted": self.submitted,
+                "processed": self.processed,
+                "rejected": self.rejected,
+                "failed": self.failed,
+            }
@@ -0,0 +1,172 @@
+"""
+Per-provider latency tracking and circuit breakers for upstream location providers.
+
+Each provider keeps its last <PREFIX>_LATENCY_WINDOW call latencies, which give the
+percentiles used to time hedged requests and a bucketed histogram for /health. Its breaker
+opens after <PREFIX>_BREAKER_FAILURES consecutive failures and rejects calls for
+<PREFIX>_BREAKER_COOLDOWN_SEC. After that one probe call is let through (half-open): success
+closes the breaker, failure opens it again.
+
+Only failures that say something about the provider's health count toward the breaker
+(timeouts, connection errors, 5xx, 429). A 4xx such as "cell not found" is an answer.
+"""
+
+from __future__ import annotations
+
+import bisect
+import os
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import httpx
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Histogram bucket upper bounds (ms); the last bucket is everything slower
+BUCKETS_MS = (25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def trips_breaker(exc: BaseException) -> bool:
+    """True if the error means the provider is unhealthy rather than that it had no answer."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        return status >= 500 or status == 429
+    return True
+
+
+class ProviderHealth:
+    def __init__(
+        self,
+        name: str,
+        window: int = 200,
+        failure_threshold: int = 5,
+        cooldown_sec: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_sec = cooldown_sec
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._latencies: deque[float] = deque(maxlen=max(1, window))
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. In half-open state only one probe is allowed."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self._clock() - self.opened_at >= self.cooldown_sec:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, latency_ms: float, ok: bool) -> None:
+        """Record a finished call. ok=False counts toward opening the breaker."""
+        with self._lock:
+            self.calls += 1
+            self._latencies.append(latency_ms)
+            if ok:
+                self.consecutive_failures = 0
+                self.state = CLOSED
+                self._probing = False
+                return
+            self.failures += 1
+            self.consecutive_failures += 1
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                self.state = OPEN
+                self.opened_at = self._clock()
+                self._probing = False
+
+    def release(self) -> None:
+        """A call was cancelled before finishing; let the next half-open probe through."""
+        with self._lock:
+            self._probing = False
+
+    def record_cancelled(self, latency_ms: float) -> None:
+        """
+        A call was cancelled after latency_ms (e.g. a hedge that lost). Kept as a latency
+        sample, a lower bound on the real one, so cancellations don't drag the percentile
+        down; not counted as a call or a failure.
+        """
+        with self._lock:
+            self._latencies.append(latency_ms)
+            self._probing = False
+
+    def percentile(self, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def samples(self) -> int:
+        with self._lock:
+            return len(self._latencies)
+
+    def stats(self) -> dict:
+        with self._lock:
+            samples = sorted(self._latencies)
+            histogram = [0] * (len(BUCKETS_MS) + 1)
+            for latency in samples:
+                histogram[bisect.bisect_left(BUCKETS_MS, latency)] += 1
+            labels = [f"le_{b}" for b in BUCKETS_MS] + ["inf"]
+
+            def pct(q: float) -> Optional[float]:
+                return round(samples[min(len(samples) - 1, int(q * len(samples)))], 1) if samples else None
+
+            return {
+                "state": self.state,
+                "calls": self.calls,
+                "failures": self.failures,
+                "consecutive_failures": self.consecutive_failures,
+                "rejected": self.rejected,
+                "times_opened": self.times_opened,
+                "p50_ms": pct(0.5),
+                "p95_ms": pct(0.95),
+                "latency_ms": dict(zip(labels, histogram)),
+            }
+
+
+class ProviderHealthRegistry:
+    def __init__(self, prefix: str, clock: Callable[[], float] = time.monotonic):
+        self.prefix = prefix
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._providers: dict[str, ProviderHealth] = {}
+
+    def get(self, name: str) -> ProviderHealth:
+        with self._lock:
+            health = self._providers.get(name)
+            if health is None:
+                health = ProviderHealth(
+                    name,
+                    window=int(os.getenv(f"{self.prefix}_LATENCY_WINDOW", "200")),
+                    failure_threshold=int(os.getenv(f"{self.prefix}_BREAKER_FAILURES", "5")),
+                    cooldown_sec=float(os.getenv(f"{self.prefix}_BREAKER_COOLDOWN_SEC", "30")),
+                    clock=self._clock,
+                )
+                self._providers[name] = health
+            return health
+
+    def stats(self) -> dict:
+        with self._lock:
+            providers = dict(self._providers)
+        return {name: health.stats() for name, health in providers.items()}
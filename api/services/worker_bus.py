@@ -0,0 +1,294 @@
+"""
+WebSocket broadcasts across the gunicorn workers of one container.
+
+A device's socket and the viewers watching it can be connected to different workers. The
+leader worker (api.services.worker_leader) runs a hub on the Unix socket WORKER_BUS_PATH,
+and every other worker connects to it. A broadcast from any worker goes through the hub:
+
+- the hub stamps the replay seq (ConnectionManager.prepare), so seqs stay unique and
+  increasing per device whichever worker the message came from, and encodes the frame once;
+- it writes the frame to every connected worker and delivers it to its own sockets;
+- each worker records the frame in its replay log and delivers it to its sockets. The
+  sender gets its per-room counts back when its own copy arrives.
+
+The bus also carries notices: small messages for per-process state that the other
+workers must update, such as the cached device access sets (api.services.device_access).
+notify() may be called from any thread; the hub passes a notice to every worker but the
+one that sent it, which has already applied it.
+
+Lines are newline-delimited JSON. A worker that has lost the hub (the leader is being
+replaced) delivers its broadcasts to its own sockets only until it reconnects, and its
+notices reach no one; a hub write buffer over WORKER_BUS_MAX_BUFFER drops that worker,
+which then reconnects.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import logging
+import os
+from typing import Any, Callable, Optional
+
+from api.websocket_manager import ConnectionManager, encode_message, manager
+
+logger = logging.getLogger(__name__)
+
+_LINE_LIMIT = 16 * 1024 * 1024
+
+
+def _line(envelope: dict) -> bytes:
+    return (encode_message(envelope) + "\n").encode("utf-8")
+
+
+class WorkerBus:
+    def __init__(
+        self,
+        manager: ConnectionManager,
+        path: Optional[str] = None,
+        timeout_sec: Optional[float] = None,
+        retry_sec: Optional[float] = None,
+    ):
+        self.manager = manager
+        self.path = path or os.getenv("WORKER_BUS_PATH", "/tmp/gps-api-bus.sock")
+        self.timeout_sec = timeout_sec if timeout_sec is not None else float(os.getenv("WORKER_BUS_TIMEOUT_SEC", "2"))
+        self.retry_sec = retry_sec if retry_sec is not None else float(os.getenv("WORKER_LEADER_RETRY_SEC", "2"))
+        self.max_buffer = int(os.getenv("WORKER_BUS_MAX_BUFFER", str(4 * 1024 * 1024)))
+        self.is_hub = False
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._peers: set[asyncio.StreamWriter] = set()
+        self._peer_tasks: set[asyncio.Task] = set()
+        self._hub: Optional[asyncio.StreamWriter] = None
+        self._follow_task: Optional[asyncio.Task] = None
+        self._pending: dict[str, asyncio.Future] = {}
+        self._ids = itertools.count(1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._handlers: dict[str, Callable[[Any], None]] = {}
+        self.relayed = 0
+        self.received = 0
+        self.local_only = 0
+        self.timeouts = 0
+        self.peers_dropped = 0
+        self.notices_sent = 0
+        self.notices_received = 0
+        self.notices_lost = 0
+
+    @property
+    def connected(self) -> bool:
+        return self.is_hub or self._hub is not None
+
+    # -- lifecycle ------------------------------------------------------------------------
+
+    def start(self) -> None:
+        """Follow the hub (reconnecting as leaders come and go) until serve() is called."""
+        self._loop = asyncio.get_running_loop()
+        if self._follow_task is None and not self.is_hub:
+            self._follow_task = asyncio.ensure_future(self._follow())
+
+    async def serve(self) -> None:
+        """Become the hub (this worker has just been elected leader)."""
+        if self.is_hub:
+            return
+        await self._stop_following()
+        try:
+            os.unlink(self.path)  # left behind by the previous leader
+        except FileNotFoundError:
+            pass
+        self._server = await asyncio.start_unix_server(self._serve_peer, path=self.path, limit=_LINE_LIMIT)
+        self._loop = asyncio.get_running_loop()
+        self.is_hub = True
+        logger.info("Worker bus hub listening path=%s", self.path)
+
+    async def stop(self) -> None:
+        await self._stop_following()
+        if self._server is not None:
+            self._server.close()
+            for peer in list(self._peers):
+                peer.close()
+            for task in list(self._peer_tasks):
+                task.cancel()
+            await asyncio.gather(*self._peer_tasks, return_exceptions=True)
+            await self._server.wait_closed()
+            self._server = None
+        self.is_hub = False
+        self._loop = None
+
+    async def _stop_following(self) -> None:
+        if self._follow_task is not None:
+            self._follow_task.cancel()
+            try:
+                await self._follow_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._follow_task = None
+
+    # -- publishing -----------------------------------------------------------------------
+
+    async def publish(self, rooms: list, message: dict, repeat_after: float = 0.0) -> list:
+        """Broadcast to `rooms` in every worker; returns this worker's send count per room."""
+        if self.is_hub:
+            return await self._relay(rooms, message, repeat_after)
+        hub = self._hub
+        if hub is None:
+            self.local_only += 1
+            return await self.manager.publish_local(rooms, message, repeat_after)
+
+        request_id = f"{os.getpid()}:{next(self._ids)}"
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            hub.write(_line({"id": request_id, "rooms": rooms, "message": message, "repeat_after": repeat_after}))
+            return await asyncio.wait_for(future, self.timeout_sec)
+        except asyncio.TimeoutError:
+            # The hub may still deliver it; sending it locally as well would duplicate it
+            self.timeouts += 1
+            return [0] * len(rooms)
+        finally:
+            self._pending.pop(request_id, None)
+
+    async def _relay(self, rooms: list, message: dict, repeat_after: float, request_id: Any = None) -> list:
+        frame, position, seq = self.manager.prepare(rooms, message)
+        line = _line(
+            {
+                "id": request_id,
+                "rooms": rooms,
+                "frame": frame,
+                "device_id": message.get("device_id") if seq is not None else None,
+                "seq": seq,
+                "position": position,
+                "repeat_after": repeat_after,
+            }
+        )
+        self._write_peers(line)
+        self.relayed += 1
+        return await self.manager.deliver(rooms, frame, position, repeat_after)
+
+    # -- notices --------------------------------------------------------------------------
+
+    def subscribe(self, topic: str, handler: Callable[[Any], None]) -> None:
+        """Call handler(payload) for notices on topic sent by other workers."""
+        self._handlers[topic] = handler
+
+    def notify(self, topic: str, payload: Any = None) -> None:
+        """Send a notice to the other workers (any thread; no-op while the bus isn't running)."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        loop.call_soon_threadsafe(self._send_notice, topic, payload)
+
+    def _send_notice(self, topic: str, payload: Any) -> None:
+        line = _line({"notice": topic, "payload": payload})
+        if self.is_hub:
+            self._write_peers(line)
+        elif self._hub is not None:
+            self._hub.write(line)
+        else:
+            self.notices_lost += 1
+            return
+        self.notices_sent += 1
+
+    def _apply_notice(self, envelope: dict) -> None:
+        self.notices_received += 1
+        handler = self._handlers.get(envelope["notice"])
+        if handler is None:
+            return
+        try:
+            handler(envelope.get("payload"))
+        except Exception as exc:
+            logger.warning("Worker bus notice handler failed topic=%s err=%s", envelope["notice"], exc)
+
+    # -- hub side -------------------------------------------------------------------------
+
+    def _write_peers(self, line: bytes, skip: Optional[asyncio.StreamWriter] = None) -> None:
+        for peer in list(self._peers):
+            if peer is skip:
+                continue
+            if peer.transport.get_write_buffer_size() > self.max_buffer:
+                logger.warning("Worker bus peer too slow; dropping it")
+                self.peers_dropped += 1
+                self._peers.discard(peer)
+                peer.close()
+                continue
+            peer.write(line)
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._peer_tasks.add(task)
+        self._peers.add(writer)
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    if "notice" in request:
+                        self._write_peers(line, skip=writer)
+                        self._apply_notice(request)
+                        continue
+                    await self._relay(
+                        request["rooms"], request["message"], request.get("repeat_after", 0.0), request.get("id")
+                    )
+                except (ValueError, KeyError, TypeError) as exc:
+                    logger.warning("Worker bus dropped a bad request err=%s", exc)
+        except (ConnectionError, ValueError) as exc:
+            logger.warning("Worker bus peer failed err=%s", exc)
+        finally:
+            self._peers.discard(writer)
+            self._peer_tasks.discard(task)
+            writer.close()
+
+    # -- follower side --------------------------------------------------------------------
+
+    async def _follow(self) -> None:
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path, limit=_LINE_LIMIT)
+            except OSError:
+                await asyncio.sleep(self.retry_sec)
+                continue
+            self._hub = writer
+            logger.info("Worker bus connected to hub path=%s", self.path)
+            try:
+                while line := await reader.readline():
+                    try:
+                        await self._receive(json.loads(line))
+                    except (ValueError, KeyError, TypeError) as exc:
+                        logger.warning("Worker bus dropped a bad frame err=%s", exc)
+            except (ConnectionError, ValueError) as exc:
+                logger.warning("Worker bus lost the hub err=%s", exc)
+            finally:
+                self._hub = None
+                writer.close()
+            await asyncio.sleep(self.retry_sec)
+
+    async def _receive(self, envelope: dict) -> None:
+        if "notice" in envelope:
+            self._apply_notice(envelope)
+            return
+        self.received += 1
+        rooms, frame = envelope["rooms"], envelope["frame"]
+        if envelope.get("seq") is not None:
+            self.manager.replay.record(envelope["device_id"], envelope["seq"], rooms, frame)
+        position = tuple(envelope["position"]) if envelope.get("position") else None
+        counts = await self.manager.deliver(rooms, frame, position, envelope.get("repeat_after", 0.0))
+        future = self._pending.get(envelope.get("id"))
+        if future is not None and not future.done():
+            future.set_result(counts)
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "role": "hub" if self.is_hub else "follower",
+            "connected": self.connected,
+            "peers": len(self._peers),
+            "relayed": self.relayed,
+            "received": self.received,
+            "local_only": self.local_only,
+            "timeouts": self.timeouts,
+            "peers_dropped": self.peers_dropped,
+            "notices_sent": self.notices_sent,
+            "notices_received": self.notices_received,
+            "notices_lost": self.notices_lost,
+        }
+
+
+worker_bus = WorkerBus(manager)
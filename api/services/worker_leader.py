@@ -0,0 +1,104 @@
+"""
+Leader election between the gunicorn workers of one container.
+
+Some jobs must run in exactly one worker: the MQTT uplink subscriber (so one process
+handles each device's messages in order) and the WebSocket broadcast hub
+(api.services.worker_bus). Workers compete for an exclusive flock on WORKER_LOCK_PATH;
+the holder is the leader. The kernel drops the lock when its holder exits, so a worker
+that retries every WORKER_LEADER_RETRY_SEC takes over from a crashed or recycled leader.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import fcntl
+import logging
+import os
+from typing import Awaitable, Callable, IO, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def worker_count() -> int:
+    """Workers serving this container (gunicorn and uvicorn both read WEB_CONCURRENCY)."""
+    try:
+        return max(1, int(os.getenv("WEB_CONCURRENCY", "1") or 1))
+    except ValueError:
+        return 1
+
+
+class LeaderElection:
+    def __init__(self, path: Optional[str] = None, retry_sec: Optional[float] = None):
+        self.path = path or os.getenv("WORKER_LOCK_PATH", "/tmp/gps-api-leader.lock")
+        self.retry_sec = retry_sec if retry_sec is not None else float(os.getenv("WORKER_LEADER_RETRY_SEC", "2"))
+        self._handle: Optional[IO] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._handle is not None
+
+    def try_acquire(self) -> bool:
+        """Take the lock if no other worker holds it (never blocks)."""
+        if self._handle is not None:
+            return True
+        handle = open(self.path, "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        self._handle = handle
+        return True
+
+    def release(self) -> None:
+        if self._handle is None:
+            return
+        try:
+            fcntl.flock(self._handle, fcntl.LOCK_UN)
+        finally:
+            self._handle.close()
+            self._handle = None
+
+    async def _campaign(self, on_elected: Callable[[], Awaitable[None]]) -> None:
+        while True:
+            while not self.try_acquire():
+                await asyncio.sleep(self.retry_sec)
+            logger.info("Worker pid=%s is the leader lock=%s", os.getpid(), self.path)
+            try:
+                await on_elected()
+                return
+            except Exception as exc:
+                # A leader that can't do the leader's jobs must not keep others from doing them
+                logger.exception("Leader startup failed; releasing the lock err=%s", exc)
+                self.release()
+            await asyncio.sleep(self.retry_sec)
+
+    def start(self, on_elected: Callable[[], Awaitable[None]]) -> None:
+        """
+        Run on_elected once this worker becomes leader (now, or when the leader goes away).
+        If on_elected raises, the lock is released and the campaign starts over.
+        """
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._campaign(on_elected))
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+        self.release()
+
+    def stats(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "workers": worker_count(),
+            "leader": self.is_leader,
+            "lock": self.path,
+        }
+
+
+leader = LeaderElection()
@@ -0,0 +1,116 @@
+"""
+Per-subscription delivery policies for WebSocket location updates.
+
+A viewer declares at subscribe time how often it can use updates (max_hz), how far the
+device must move before another one is worth sending (min_distance_m) and whether
+updates arriving faster than max_hz should be coalesced (latest value wins, sent when
+the rate window reopens) or dropped. Only location_update messages are shaped; control
+responses, telemetry and geofence alerts are always delivered immediately.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from api.db.geofence_breaches import haversine_distance
+
+SEND = "send"
+DROP = "drop"
+DEFER = "defer"
+
+
+@dataclass(frozen=True)
+class DeliveryPolicy:
+    max_hz: Optional[float] = None
+    min_distance_m: Optional[float] = None
+    coalesce: bool = True
+
+    @property
+    def min_interval_sec(self) -> float:
+        return 1.0 / self.max_hz if self.max_hz else 0.0
+
+    @property
+    def active(self) -> bool:
+        return bool(self.max_hz or self.min_distance_m)
+
+    @classmethod
+    def from_dict(cls, raw: Optional[dict[str, Any]]) -> Optional["DeliveryPolicy"]:
+        """Build a policy from subscribe/query fields; None when nothing is requested."""
+        if not raw:
+            return None
+        if not isinstance(raw, dict):
+            raise ValueError("policy must be an object")
+        try:
+            max_hz = float(raw["max_hz"]) if raw.get("max_hz") is not None else None
+            min_distance_m = (
+                float(raw["min_distance_m"]) if raw.get("min_distance_m") is not None else None
+            )
+        except (TypeError, ValueError):
+            raise ValueError("max_hz and min_distance_m must be numbers")
+        if max_hz is not None and max_hz <= 0:
+            raise ValueError("max_hz must be > 0")
+        if min_distance_m is not None and min_distance_m < 0:
+            raise ValueError("min_distance_m must be >= 0")
+        coalesce = raw.get("coalesce", True)
+        if isinstance(coalesce, str):
+            coalesce = coalesce.strip().lower() not in ("0", "false", "no", "off")
+        policy = cls(max_hz=max_hz, min_distance_m=min_distance_m, coalesce=bool(coalesce))
+        return policy if policy.active else None
+
+
+class DeliveryState:
+    """Shaping state for one socket in one room."""
+
+    def __init__(self, policy: DeliveryPolicy):
+        self.policy = policy
+        self.last_sent_at: Optional[float] = None
+        self.last_position: Optional[tuple[float, float]] = None
+        self.pending_frame: Optional[str] = None
+        self.pending_position: Optional[tuple[float, float]] = None
+        self.flush_handle = None  # asyncio.TimerHandle while a coalesced frame waits
+
+    def offer(self, frame: str, position: tuple[float, float], now: float) -> str:
+        """Decide what to do with a location frame: SEND now, DROP it, or DEFER (coalesce)."""
+        policy = self.policy
+        if policy.min_distance_m and self.last_position is not None:
+            moved = haversine_distance(*self.last_position, *position)
+            if moved < policy.min_distance_m:
+                return DROP
+
+        if self.last_sent_at is None or now - self.last_sent_at >= policy.min_interval_sec:
+            self.mark_sent(position, now)
+            return SEND
+
+        if not policy.coalesce:
+            return DROP
+        self.pending_frame = frame
+        self.pending_position = position
+        return DEFER
+
+    def next_send_at(self) -> float:
+        return (self.last_sent_at or 0.0) + self.policy.min_interval_sec
+
+    def mark_sent(self, position: tuple[float, float], now: float) -> None:
+        self.last_sent_at = now
+        self.last_position = position
+        self.pending_frame = None
+        self.pending_position = None
+
+    def cancel(self) -> None:
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        self.pending_frame = None
+        self.pending_position = None
+
+
+def location_position(message: dict) -> Optional[tuple[float, float]]:
+    """(lat, lon) of a location_update message, or None for anything else."""
+    if message.get("type") != "location_update":
+        return None
+    data = message.get("data") or {}
+    try:
+        return float(data["latitude"]), float(data["longitude"])
+    except (KeyError, TypeError, ValueError):
+        return None
@@ -0,0 +1,105 @@
+"""
+Bounded per-device replay log for WebSocket broadcasts.
+
+Every broadcast about a device gets a sequence number that only grows for that device;
+the encoded frame is kept in a ring buffer together with the rooms it went to. A viewer
+reconnecting with since_seq gets the frames it missed straight from memory instead of
+re-querying /v1/GPSData.
+
+Sequence numbers start from the wall clock in milliseconds (then +1 per message), so
+they keep increasing across restarts. History from before this process, or evicted
+from the ring, is reported as incomplete so the client knows to backfill from the API.
+
+A device's ring is dropped once it has had no new frame for WS_REPLAY_IDLE_SEC, so
+devices that stopped publishing (or that nobody came back for) don't keep their frames.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Iterable
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class ReplayLog:
+    def __init__(self, maxlen: int | None = None, idle_sec: float | None = None):
+        if maxlen is None:
+            maxlen = int(os.getenv("WS_REPLAY_BUFFER_SIZE", "100"))
+        if idle_sec is None:
+            idle_sec = float(os.getenv("WS_REPLAY_IDLE_SEC", "900"))
+        self.maxlen = maxlen
+        self.idle_sec = idle_sec
+        self._last_sweep = _now_ms()
+        self.expired = 0
+        self._entries: dict[int, deque] = {}
+        self._last_seq: dict[int, int] = {}
+        # Highest seq whose frame is no longer available (before this process, or evicted)
+        self._floor_default = _now_ms() - 1
+        self._floor: dict[int, int] = {}
+        self._lock = threading.Lock()
+
+    def next_seq(self, device_id: int) -> int:
+        with self._lock:
+            seq = max(self._last_seq.get(device_id, 0) + 1, _now_ms())
+            self._last_seq[device_id] = seq
+            return seq
+
+    def last_seq(self, device_id: int) -> int | None:
+        with self._lock:
+            return self._last_seq.get(device_id)
+
+    def record(self, device_id: int, seq: int, rooms: Iterable[str], frame: str) -> None:
+        """Keep a frame; seq may come from another worker (api.services.worker_bus)."""
+        with self._lock:
+            if seq > self._last_seq.get(device_id, 0):
+                self._last_seq[device_id] = seq
+            if self.maxlen <= 0:
+                return
+            entries = self._entries.get(device_id)
+            if entries is None:
+                entries = self._entries[device_id] = deque()
+            entries.append((seq, frozenset(rooms), frame))
+            while len(entries) > self.maxlen:
+                evicted_seq = entries.popleft()[0]
+                self._floor[device_id] = evicted_seq
+            now = _now_ms()
+            if now - self._last_sweep >= min(self.idle_sec, 60.0) * 1000:
+                self._sweep(now)
+
+    def _sweep(self, now: int) -> None:
+        """Drop rings whose newest frame is older than idle_sec (seqs track the wall clock)."""
+        self._last_sweep = now
+        cutoff = now - self.idle_sec * 1000
+        for device_id, entries in list(self._entries.items()):
+            if entries[-1][0] < cutoff:
+                self._floor[device_id] = entries[-1][0]
+                del self._entries[device_id]
+                self.expired += 1
+
+    def since(self, device_id: int, since_seq: int, rooms: Iterable[str]) -> tuple[list[str], bool]:
+        """
+        Frames for `rooms` with seq > since_seq, oldest first, and whether that history
+        is complete (nothing after since_seq was evicted or predates this process).
+        """
+        wanted = set(rooms)
+        with self._lock:
+            floor = max(self._floor_default, self._floor.get(device_id, 0))
+            entries = list(self._entries.get(device_id, ()))
+        frames = [frame for seq, entry_rooms, frame in entries if seq > since_seq and entry_rooms & wanted]
+        return frames, since_seq >= floor
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "devices": len(self._entries),
+                "buffered_messages": sum(len(e) for e in self._entries.values()),
+                "buffer_size_per_device": self.maxlen,
+                "idle_sec": self.idle_sec,
+                "expired_devices": self.expired,
+            }
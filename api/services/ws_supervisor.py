@@ -0,0 +1,184 @@
+"""
+One supervisor task for every WebSocket: heartbeats idle viewers and reaps dead sockets.
+
+Endpoints call touch() whenever a frame arrives (O(1): it only updates last_seen). A
+min-heap holds one entry per socket for the next time it needs attention; when an entry
+comes due the supervisor checks last_seen and either re-arms it, sends a heartbeat, or
+reaps the socket. There is no per-socket timer or wait_for.
+
+ASGI gives applications no way to send protocol-level ping frames (uvicorn's
+--ws-ping-interval covers the transport and closes dead peers). The heartbeat here is an
+application {"type": "ping"} frame. Viewers need not reply: a heartbeat that is sent
+counts as liveness, so a quiet viewer is only reaped once a send to it fails. Sockets
+without heartbeats (trackers) are reaped after idle_timeout with no inbound traffic.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Watch:
+    websocket: Any
+    label: str
+    heartbeat: bool
+    idle_timeout: float
+    on_reap: Optional[Callable[[Any], Awaitable[None]]]
+    last_seen: float
+    last_ping: float = 0.0
+    token: int = field(default=0)
+
+
+class ConnectionSupervisor:
+    def __init__(
+        self,
+        idle_timeout: Optional[float] = None,
+        heartbeat_interval: Optional[float] = None,
+        max_tick: float = 1.0,
+    ):
+        self.idle_timeout = idle_timeout if idle_timeout is not None else float(
+            os.getenv("WS_IDLE_TIMEOUT_SEC", "120")
+        )
+        self.heartbeat_interval = heartbeat_interval if heartbeat_interval is not None else float(
+            os.getenv("WS_HEARTBEAT_INTERVAL_SEC", "30")
+        )
+        self.max_tick = max_tick
+        self._watches: dict[int, _Watch] = {}
+        self._heap: list[tuple[float, int, int]] = []
+        self._tokens = itertools.count(1)
+        self._task: Optional[asyncio.Task] = None
+        self.reaped_total = 0
+        self.heartbeats_sent = 0
+
+    # -- registration (called from endpoint coroutines) --------------------------------
+
+    def register(
+        self,
+        websocket: Any,
+        *,
+        label: str = "",
+        heartbeat: bool = True,
+        idle_timeout: Optional[float] = None,
+        on_reap: Optional[Callable[[Any], Awaitable[None]]] = None,
+    ) -> None:
+        """Start watching a socket. heartbeat=False for peers that ping us (trackers)."""
+        watch = _Watch(
+            websocket=websocket,
+            label=label,
+            heartbeat=heartbeat,
+            idle_timeout=idle_timeout if idle_timeout is not None else self.idle_timeout,
+            on_reap=on_reap,
+            last_seen=time.monotonic(),
+            token=next(self._tokens),
+        )
+        self._watches[id(websocket)] = watch
+        self._push(watch)
+
+    def touch(self, websocket: Any) -> None:
+        watch = self._watches.get(id(websocket))
+        if watch is not None:
+            watch.last_seen = time.monotonic()
+
+    def unregister(self, websocket: Any) -> None:
+        # Heap entry stays behind and is discarded when it comes due (token no longer matches)
+        self._watches.pop(id(websocket), None)
+
+    # -- scheduling ---------------------------------------------------------------------
+
+    def _next_due(self, watch: _Watch) -> float:
+        due = watch.last_seen + watch.idle_timeout
+        if watch.heartbeat and self.heartbeat_interval > 0:
+            due = min(due, max(watch.last_seen, watch.last_ping) + self.heartbeat_interval)
+        return due
+
+    def _push(self, watch: _Watch) -> None:
+        heapq.heappush(self._heap, (self._next_due(watch), watch.token, id(watch.websocket)))
+
+    async def check(self, now: Optional[float] = None) -> None:
+        """Handle every heap entry that is due; the run loop calls this each tick."""
+        now = time.monotonic() if now is None else now
+        while self._heap and self._heap[0][0] <= now:
+            _, token, key = heapq.heappop(self._heap)
+            watch = self._watches.get(key)
+            if watch is None or watch.token != token:
+                continue
+            if now - watch.last_seen >= watch.idle_timeout:
+                await self._reap(watch)
+                continue
+            if (
+                watch.heartbeat
+                and self.heartbeat_interval > 0
+                and now - max(watch.last_seen, watch.last_ping) >= self.heartbeat_interval
+            ):
+                watch.last_ping = now
+                try:
+                    await watch.websocket.send_json({"type": "ping", "timestamp": int(time.time() * 1000)})
+                    self.heartbeats_sent += 1
+                    # A delivered heartbeat is enough: viewers are not required to answer it
+                    watch.last_seen = now
+                except Exception as e:
+                    logger.info(f"Heartbeat failed ({watch.label}): {e}")
+                    await self._reap(watch)
+                    continue
+            # Touched since it was scheduled, or heartbeat just sent: re-arm
+            self._push(watch)
+
+    async def _reap(self, watch: _Watch) -> None:
+        self._watches.pop(id(watch.websocket), None)
+        self.reaped_total += 1
+        logger.warning(f"WebSocket idle for {watch.idle_timeout:.0f}s, reaping ({watch.label})")
+        if watch.on_reap is not None:
+            try:
+                await watch.on_reap(watch.websocket)
+            except Exception as e:
+                logger.warning(f"Reap cleanup failed ({watch.label}): {e}")
+        try:
+            await watch.websocket.close(code=1000, reason="Idle timeout")
+        except Exception:
+            pass
+
+    # -- lifecycle ------------------------------------------------------------------------
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"WebSocket supervisor error: {e}")
+            delay = self.max_tick
+            if self._heap:
+                delay = min(delay, max(0.0, self._heap[0][0] - time.monotonic()))
+            await asyncio.sleep(delay)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "watched": len(self._watches),
+            "heap_entries": len(self._heap),
+            "reaped_total": self.reaped_total,
+            "heartbeats_sent": self.heartbeats_sent,
+            "idle_timeout_sec": self.idle_timeout,
+            "heartbeat_interval_sec": self.heartbeat_interval,
+        }
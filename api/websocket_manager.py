@@ -1,60 +1,409 @@
 """
 WebSocket real-time GPS tracking server.
 Handles live position updates, device status changes, and notifications.
+
+One ConnectionManager holds every socket. Sockets join rooms named
+`<type>_<device_id>` (device_67, user_device_67, geofence_67); the registry keeps
+secondary indexes by socket, device, user and room type so membership changes and
+stats are O(1). Mutations take an RLock so the event loop and the paho thread can both
+read it; sends always happen outside the lock on a snapshot of the room.
 """
 
-import logging
+import asyncio
 import json
-from typing import Set, Dict, Any, Optional
-from datetime import datetime
+import logging
 import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional, Set, Tuple
+
+from api.services.ws_delivery import DEFER, DROP, DeliveryPolicy, DeliveryState, location_position
+from api.services.ws_replay import ReplayLog
+
+try:
+    import orjson
+except ImportError:  # optional speedup; stdlib json produces an equivalent frame
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
 
+def encode_message(message: dict) -> str:
+    """
+    Serialize a broadcast message into a WebSocket text frame.
+    Done once per broadcast so every subscriber receives the same pre-encoded buffer.
+    """
+    if orjson is not None:
+        return orjson.dumps(message).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def parse_room(room: str) -> Tuple[str, Optional[int]]:
+    """Split 'user_device_67' into ('user_device', 67); rooms without an id give (room, None)."""
+    room_type, _, suffix = room.rpartition("_")
+    if room_type and suffix.isdigit():
+        return room_type, int(suffix)
+    return room, None
+
+
 class ConnectionManager:
-    """Manages WebSocket connections per user."""
-    
+    """Registry of WebSocket connections grouped by room, indexed by device, user and room type."""
+
     def __init__(self):
-        # user_id -> set of socket.io client IDs
-        self.active_connections: Dict[int, Set[str]] = {}
         self.lock = threading.RLock()
-    
-    def add_connection(self, user_id: int, client_id: str) -> None:
-        """Register a new WebSocket connection for a user."""
+        self.active_connections: Dict[str, Set[Any]] = {}
+        self.room_metadata: Dict[str, dict] = {}
+        # socket -> rooms it is in, so a dead socket can be removed everywhere without a scan
+        self.socket_rooms: Dict[Any, Set[str]] = {}
+        # secondary indexes (kept in step with active_connections under self.lock)
+        self.device_rooms: Dict[int, Set[str]] = {}
+        self.type_rooms: Dict[str, Set[str]] = {}
+        self.type_memberships: Dict[str, int] = {}
+        self.user_sockets: Dict[int, Set[Any]] = {}
+        self.socket_user: Dict[Any, int] = {}
+        self.memberships = 0
+        # room -> socket -> shaping state, only for sockets that declared a delivery policy
+        self.delivery: Dict[str, Dict[Any, DeliveryState]] = {}
+        self._flush_tasks: Set[asyncio.Task] = set()
+        self.replay = ReplayLog()
+        # api.services.worker_bus.WorkerBus when several workers share the rooms
+        self.bus = None
+
+    async def connect(
+        self,
+        room: str,
+        websocket: Any,
+        metadata: Optional[dict] = None,
+        policy: Optional[DeliveryPolicy] = None,
+    ):
+        """Accept a new WebSocket connection and add it to a room."""
+        self.join(room, websocket, metadata, policy)
+        await websocket.accept()
+        logger.info(f"Client connected to room '{room}'. Total connections: {self.room_size(room)}")
+
+    def join(
+        self,
+        room: str,
+        websocket: Any,
+        metadata: Optional[dict] = None,
+        policy: Optional[DeliveryPolicy] = None,
+    ):
+        """
+        Add an already-accepted WebSocket to a room (one socket may be in many rooms).
+        Joining again replaces the socket's delivery policy for that room.
+        metadata["user_id"], when present, indexes the socket under that user.
+        """
         with self.lock:
-            if user_id not in self.active_connections:
-                self.active_connections[user_id] = set()
-            self.active_connections[user_id].add(client_id)
-            logger.info(f"User {user_id} connected (client: {client_id})")
-    
-    def remove_connection(self, user_id: int, client_id: str) -> None:
-        """Unregister a WebSocket connection."""
+            members = self.active_connections.get(room)
+            if members is None:
+                members = self.active_connections[room] = set()
+                self.room_metadata[room] = metadata or {}
+                room_type, device_id = parse_room(room)
+                self.type_rooms.setdefault(room_type, set()).add(room)
+                if device_id is not None:
+                    self.device_rooms.setdefault(device_id, set()).add(room)
+
+            if websocket not in members:
+                members.add(websocket)
+                self.socket_rooms.setdefault(websocket, set()).add(room)
+                room_type, _ = parse_room(room)
+                self.type_memberships[room_type] = self.type_memberships.get(room_type, 0) + 1
+                self.memberships += 1
+
+            user_id = (metadata or {}).get("user_id")
+            if user_id is not None and websocket not in self.socket_user:
+                self.socket_user[websocket] = user_id
+                self.user_sockets.setdefault(user_id, set()).add(websocket)
+
+            self._set_policy(room, websocket, policy)
+
+    def _set_policy(self, room: str, websocket: Any, policy: Optional[DeliveryPolicy]):
+        states = self.delivery.get(room)
+        previous = states.pop(websocket, None) if states is not None else None
+        if previous is not None:
+            previous.cancel()
+        if policy is not None:
+            self.delivery.setdefault(room, {})[websocket] = DeliveryState(policy)
+        elif states is not None and not states:
+            del self.delivery[room]
+
+    async def disconnect(self, room: str, websocket: Any):
+        """Remove a WebSocket connection from a room."""
         with self.lock:
-            if user_id in self.active_connections:
-                self.active_connections[user_id].discard(client_id)
-                if not self.active_connections[user_id]:
-                    del self.active_connections[user_id]
-            logger.info(f"User {user_id} disconnected (client: {client_id})")
-    
-    def get_user_clients(self, user_id: int) -> Set[str]:
-        """Get all client IDs connected for a user."""
+            members = self.active_connections.get(room)
+            if members is None:
+                return
+            self._set_policy(room, websocket, None)
+            room_type, device_id = parse_room(room)
+            if websocket in members:
+                members.discard(websocket)
+                self.type_memberships[room_type] -= 1
+                self.memberships -= 1
+                rooms = self.socket_rooms.get(websocket)
+                if rooms is not None:
+                    rooms.discard(room)
+                    if not rooms:
+                        del self.socket_rooms[websocket]
+                        self._forget_user(websocket)
+            remaining = len(members)
+
+            # Cleanup empty rooms
+            if not members:
+                del self.active_connections[room]
+                del self.room_metadata[room]
+                self._discard_index(self.type_rooms, room_type, room)
+                if not self.type_memberships.get(room_type):
+                    self.type_memberships.pop(room_type, None)
+                if device_id is not None:
+                    self._discard_index(self.device_rooms, device_id, room)
+
+        logger.info(f"Client disconnected from room '{room}'. Remaining: {remaining}")
+
+    def _forget_user(self, websocket: Any):
+        user_id = self.socket_user.pop(websocket, None)
+        if user_id is not None:
+            self._discard_index(self.user_sockets, user_id, websocket)
+
+    @staticmethod
+    def _discard_index(index: dict, key, value):
+        values = index.get(key)
+        if values is not None:
+            values.discard(value)
+            if not values:
+                del index[key]
+
+    async def disconnect_all(self, websocket: Any):
+        """Remove a socket from every room it joined (used when the supervisor reaps it)."""
         with self.lock:
-            return self.active_connections.get(user_id, set()).copy()
-    
+            rooms = list(self.socket_rooms.get(websocket, ()))
+        for room in rooms:
+            await self.disconnect(room, websocket)
+
+    def members(self, room: str) -> list:
+        """Snapshot of a room's sockets, safe to iterate across awaits."""
+        with self.lock:
+            return list(self.active_connections.get(room, ()))
+
+    def room_size(self, room: str) -> int:
+        with self.lock:
+            return len(self.active_connections.get(room, ()))
+
+    def rooms_for_device(self, device_id: int) -> Set[str]:
+        with self.lock:
+            return set(self.device_rooms.get(device_id, ()))
+
+    def sockets_for_user(self, user_id: int) -> Set[Any]:
+        with self.lock:
+            return set(self.user_sockets.get(user_id, ()))
+
     def has_active_connection(self, user_id: int) -> bool:
         """Check if user has any active connections."""
         with self.lock:
-            return user_id in self.active_connections and len(self.active_connections[user_id]) > 0
-    
+            return bool(self.user_sockets.get(user_id))
+
     def get_connected_users(self) -> Set[int]:
         """Get all user IDs with active connections."""
         with self.lock:
-            return set(self.active_connections.keys())
+            return set(self.user_sockets.keys())
+
+    async def broadcast_to_room(self, room: str, message: dict) -> int:
+        """
+        Send message to all connections in a room.
+        Location updates are shaped by each socket's delivery policy (if any).
+        Returns number of successful sends.
+        """
+        return (await self.publish([room], message))[0]
+
+    async def publish(self, rooms: list, message: dict, repeat_after: float = 0.0) -> list:
+        """
+        Send one message to several rooms, in order, encoding it once.
+        Messages about a device get the next replay seq and are kept in the replay log,
+        even when nobody is listening (that is when a reconnecting viewer needs them).
+        repeat_after > 0 sends the same frame to the first room again after that many
+        seconds, if it reached anyone there the first time.
+        With a worker bus the message reaches the rooms' sockets in every worker.
+        Returns the number of successful sends per room (in this worker).
+        """
+        if self.bus is not None:
+            return await self.bus.publish(rooms, message, repeat_after)
+        return await self.publish_local(rooms, message, repeat_after)
+
+    async def publish_local(self, rooms: list, message: dict, repeat_after: float = 0.0) -> list:
+        """publish, to this worker's sockets only."""
+        frame, position, _ = self.prepare(rooms, message)
+        return await self.deliver(rooms, frame, position, repeat_after)
+
+    def prepare(self, rooms: list, message: dict) -> tuple:
+        """
+        Stamp seq, encode and record a message for `rooms`.
+        Returns (frame, location position, seq); seq is None for messages not about a device.
+        """
+        device_id = message.get("device_id")
+        seq = None
+        if isinstance(device_id, int):
+            seq = self.replay.next_seq(device_id)
+            message = {**message, "seq": seq}
+        frame = encode_message(message)
+        if seq is not None:
+            self.replay.record(device_id, seq, rooms, frame)
+        return frame, location_position(message), seq
+
+    async def deliver(
+        self,
+        rooms: list,
+        frame: str,
+        position: Optional[tuple] = None,
+        repeat_after: float = 0.0,
+    ) -> list:
+        """Send a prepared frame to this worker's sockets in `rooms`; see publish for repeat_after."""
+        counts = [await self.broadcast_frame_to_room(room, frame, position=position) for room in rooms]
+        if repeat_after > 0 and counts and counts[0] > 0:
+            asyncio.get_running_loop().call_later(repeat_after, self._start_repeat, rooms[0], frame)
+        return counts
+
+    def _start_repeat(self, room: str, frame: str):
+        task = asyncio.ensure_future(self.broadcast_frame_to_room(room, frame))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def replay_since(self, websocket: Any, device_id: int, rooms: list, since_seq: int) -> dict:
+        """
+        Send a reconnecting socket the frames it missed for `rooms`, then a replay_complete marker.
+        complete=False means part of the gap is no longer buffered; backfill via /v1/GPSData.
+        Live broadcasts may interleave with the replay; clients order and de-duplicate by seq.
+        """
+        frames, complete = self.replay.since(device_id, since_seq, rooms)
+        for frame in frames:
+            await websocket.send_text(frame)
+        summary = {
+            "type": "replay_complete",
+            "device_id": device_id,
+            "since_seq": since_seq,
+            "replayed": len(frames),
+            "last_seq": self.replay.last_seq(device_id),
+            "complete": complete,
+        }
+        await websocket.send_json(summary)
+        return summary
+
+    async def broadcast_frame_to_room(
+        self,
+        room: str,
+        frame: str,
+        position: Optional[tuple] = None,
+    ) -> int:
+        """
+        Send an already-encoded frame (see encode_message) to all connections in a room.
+        position is the (lat, lon) of a location_update frame; only those are rate/distance shaped.
+        Returns number of successful (immediate) sends.
+        """
+        # Snapshot: disconnects during the awaits below must not mutate the set being iterated
+        with self.lock:
+            connections = list(self.active_connections.get(room, ()))
+            states = self.delivery.get(room) if position is not None else None
+            states = dict(states) if states else None
+        if not connections:
+            return 0
+
+        now = time.monotonic()
+        disconnected = set()
+        success_count = 0
+
+        for connection in connections:
+            state = states.get(connection) if states else None
+            if state is not None:
+                decision = state.offer(frame, position, now)
+                if decision == DROP:
+                    continue
+                if decision == DEFER:
+                    self._schedule_flush(room, connection, state)
+                    continue
+            try:
+                await connection.send_text(frame)
+                success_count += 1
+            except Exception as e:
+                logger.warning(f"Error sending to room '{room}': {e}")
+                disconnected.add(connection)
+
+        # Cleanup disconnected clients
+        for conn in disconnected:
+            await self.disconnect(room, conn)
+
+        return success_count
+
+    def _schedule_flush(self, room: str, websocket: Any, state: DeliveryState):
+        """Send the coalesced (latest) frame when the socket's rate window reopens."""
+        if state.flush_handle is not None:
+            return
+        delay = max(0.0, state.next_send_at() - time.monotonic())
+
+        def _start_flush():
+            task = asyncio.ensure_future(self._flush(room, websocket, state))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+        state.flush_handle = asyncio.get_running_loop().call_later(delay, _start_flush)
+
+    async def _flush(self, room: str, websocket: Any, state: DeliveryState):
+        state.flush_handle = None
+        frame, position = state.pending_frame, state.pending_position
+        if frame is None or self.delivery.get(room, {}).get(websocket) is not state:
+            return
+        state.mark_sent(position, time.monotonic())
+        try:
+            await websocket.send_text(frame)
+        except Exception as e:
+            logger.warning(f"Error sending coalesced update to room '{room}': {e}")
+            await self.disconnect(room, websocket)
+
+    async def broadcast_except(self, room: str, message: dict, exclude_ws: Any) -> int:
+        """Send message to all connections in a room except one."""
+        connections = self.members(room)
+        if not connections:
+            return 0
+
+        frame = encode_message(message)
+        success_count = 0
+        for connection in connections:
+            if connection != exclude_ws:
+                try:
+                    await connection.send_text(frame)
+                    success_count += 1
+                except Exception as e:
+                    logger.warning(f"Error sending to room '{room}': {e}")
+
+        return success_count
+
+    def get_room_stats(self, room: str) -> dict:
+        """Get connection statistics for a room."""
+        with self.lock:
+            return {
+                "room": room,
+                "active_connections": len(self.active_connections.get(room, ())),
+                "metadata": self.room_metadata.get(room, {}),
+            }
+
+    def stats(self) -> dict:
+        """Totals across all rooms, read from the counters (no per-room walk)."""
+        with self.lock:
+            return {
+                "sockets": len(self.socket_rooms),
+                "rooms": len(self.active_connections),
+                "memberships": self.memberships,
+                "devices": len(self.device_rooms),
+                "users": len(self.user_sockets),
+                "by_room_type": {
+                    room_type: {
+                        "rooms": len(rooms),
+                        "connections": self.type_memberships.get(room_type, 0),
+                    }
+                    for room_type, rooms in self.type_rooms.items()
+                },
+            }
 
 
 # Global connection manager instance
-connection_manager = ConnectionManager()
+manager = ConnectionManager()
 
 
 def format_gps_update(
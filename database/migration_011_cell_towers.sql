@@ -0,0 +1,21 @@
+-- Migration 011: Learned cell tower positions for local cell location lookups
+
+CREATE TABLE IF NOT EXISTS cell_towers (
+    mcc INTEGER NOT NULL,
+    mnc INTEGER NOT NULL,
+    tac INTEGER NOT NULL,
+    eci BIGINT NOT NULL,
+    latitude DOUBLE PRECISION NOT NULL,
+    longitude DOUBLE PRECISION NOT NULL,
+    accuracy_m REAL NOT NULL,
+    samples INTEGER NOT NULL DEFAULT 1,
+    source VARCHAR(16) NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (mcc, mnc, tac, eci)
+);
+
+CREATE INDEX IF NOT EXISTS idx_cell_towers_updated_at ON cell_towers (updated_at DESC);
+
+COMMENT ON TABLE cell_towers IS 'Where each cell is heard: GPS fixes reported with cell metadata, else the last provider answer';
+COMMENT ON COLUMN cell_towers.accuracy_m IS 'RMS distance of the observations from the mean position (meters)';
+COMMENT ON COLUMN cell_towers.source IS 'gps, or the cell location provider (nrf_cloud, google, here)';
@@ -0,0 +1,125 @@
+"""Unit tests for reconnect-storm admission control (no server, DB or broker)."""
+
+from __future__ import annotations
+
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from api.endpoints import realtime_endpoints
+from api.services import mqtt_subscriber
+from api.services.admission import AdmissionController, DeferredQueue
+from api.services.mqtt_workers import ShardedWorkerPool
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def _controller(clock, **overrides):
+    params = dict(rate=2, burst=2, max_concurrent=0, retry_min_sec=0.5, retry_spread_sec=1.0)
+    params.update(overrides)
+    return AdmissionController("test", clock=clock, **params)
+
+
+def test_token_bucket_admits_burst_then_defers_with_jitter():
+    clock = _Clock()
+    ctl = _controller(clock)
+    assert ctl.try_acquire() is None
+    assert ctl.try_acquire() is None
+    retry = ctl.try_acquire()
+    # next token in 0.5s, plus up to 1s of spread
+    assert 0.5 <= retry <= 1.5
+    clock.now += 0.5
+    assert ctl.try_acquire() is None
+    stats = ctl.stats()
+    assert stats["admitted"] == 3 and stats["deferred_rate"] == 1
+
+
+def test_concurrency_limit_is_released():
+    clock = _Clock()
+    ctl = _controller(clock, rate=0, max_concurrent=1)
+    assert ctl.try_acquire() is None
+    assert ctl.try_acquire() is not None
+    ctl.release()
+    assert ctl.try_acquire() is None
+    assert ctl.stats()["deferred_concurrency"] == 1 and ctl.stats()["in_flight"] == 1
+
+
+def test_deferred_queue_runs_in_delay_order():
+    queue = DeferredQueue("test", maxsize=2)
+    ran: list[str] = []
+    done = threading.Event()
+
+    def record(name):
+        ran.append(name)
+        if len(ran) == 2:
+            done.set()
+
+    assert queue.push(0.05, lambda: record("late"))
+    assert queue.push(0.0, lambda: record("early"))
+    assert not queue.push(0.0, lambda: record("overflow"))
+    assert done.wait(2)
+    assert ran == ["early", "late"]
+    queue.stop()
+
+
+def test_mqtt_uplink_refused_message_keeps_device_order(monkeypatch):
+    clock = _Clock()
+    ctl = _controller(clock, rate=1, burst=3)
+    assert all(ctl.try_acquire() is None for _ in range(3))  # bucket empty
+    monkeypatch.setattr(mqtt_subscriber, "mqtt_uplink_admission", ctl)
+    monkeypatch.setattr(ctl, "_retry_after", lambda wait: 0.02)
+    monkeypatch.setattr(mqtt_subscriber, "_held", {})
+    pool = ShardedWorkerPool("test", workers=1, queue_max=10)
+    pool.start()
+    monkeypatch.setattr(mqtt_subscriber, "_workers", pool)
+    handled: list[bytes] = []
+    acked: list[bytes] = []
+    done = threading.Event()
+
+    def fake_handle(topic, payload):
+        handled.append(payload)
+        if len(handled) == 3:
+            done.set()
+
+    monkeypatch.setattr(mqtt_subscriber, "handle_mqtt_message", fake_handle)
+
+    def submit(device_id, payload):
+        return mqtt_subscriber._submit(f"devices/{device_id}/location", payload, ack=lambda: acked.append(payload))
+
+    assert submit(1, b"first")
+    assert submit(1, b"second")
+    assert not done.wait(0.1) and handled == [] and acked == []  # refused, held, not acked
+    stats = mqtt_subscriber.admission_stats()
+    assert stats["deferred_devices"] == 1 and stats["deferred_messages"] == 2
+    assert pool.stats()["busy"] == 0  # no worker is parked on the refusal
+
+    clock.now += 3.0  # tokens for all three
+    assert submit(1, b"third")
+    assert done.wait(2)
+    assert handled == [b"first", b"second", b"third"]
+    assert acked == handled
+    pool.stop()
+
+
+def test_device_socket_told_to_retry_when_refused(monkeypatch):
+    clock = _Clock()
+    ctl = _controller(clock, rate=1, burst=0)
+    monkeypatch.setattr(realtime_endpoints, "device_ws_admission", ctl)
+    app = FastAPI()
+    app.include_router(realtime_endpoints.router, prefix="/v1")
+
+    with TestClient(app).websocket_connect("/v1/ws/devices/67?token=t") as ws:
+        hint = ws.receive_json()
+        assert hint["type"] == "retry_later" and hint["retry_after_ms"] >= 500
+        with pytest.raises(WebSocketDisconnect) as exc:
+            ws.receive_json()
+        assert exc.value.code == 1013
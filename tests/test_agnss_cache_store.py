@@ -0,0 +1,92 @@
+"""Tests for the mmap-backed A-GNSS blob store."""
+
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+
+from fastapi.responses import Response
+
+from api.agnss.cache_store import BlobStore
+
+
+def _no_temp_files(root) -> bool:
+    return not [name for _, _, files in os.walk(root) for name in files if name.endswith(".tmp")]
+
+
+def test_get_returns_readonly_mapped_view(tmp_path):
+    store = BlobStore(str(tmp_path))
+    blob = os.urandom(4096)
+    digest = store.set("nrf|cell:505-1-100|1", blob, ttl_sec=60)
+    view = store.get("nrf|cell:505-1-100|1")
+    assert isinstance(view, memoryview) and view.readonly
+    assert view == blob
+    assert os.path.exists(os.path.join(tmp_path, "blobs", digest))
+
+    # Starlette sends a memoryview body as-is
+    response = Response(content=view, media_type="application/octet-stream")
+    assert response.body is view and response.headers["content-length"] == "4096"
+
+
+def test_identical_blobs_share_storage_and_ttl_is_per_key(tmp_path):
+    store = BlobStore(str(tmp_path))
+    store.set("a", b"same", ttl_sec=60)
+    store.set("b", b"same", ttl_sec=0.05)
+    assert store.stats()["blobs"] == 1 and store.stats()["keys"] == 2
+
+    time.sleep(0.1)
+    assert store.get("b") is None
+    assert store.get("a") == b"same"
+    store.evict()
+    # "b" is gone, the blob stays because "a" still references it
+    assert store.stats()["keys"] == 1 and store.stats()["blobs"] == 1
+
+    store.set("a", b"different", ttl_sec=60)
+    assert store.get("a") == b"different"
+    assert store.stats()["blobs"] == 1
+
+
+def test_size_bound_evicts_soonest_expiring_first(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=2500)
+    store.set("long", b"L" * 1000, ttl_sec=600)
+    store.set("short", b"S" * 1000, ttl_sec=60)
+    store.set("medium", b"M" * 1000, ttl_sec=300)
+    assert store.get("short") is None
+    assert store.get("long") == b"L" * 1000 and store.get("medium") == b"M" * 1000
+    stats = store.stats()
+    assert stats["bytes"] <= 2500 and stats["evictions"] == 1
+
+
+def test_view_survives_overwrite_and_eviction(tmp_path):
+    store = BlobStore(str(tmp_path), max_bytes=1500)
+    store.set("k", b"first" * 200, ttl_sec=60)
+    view = store.get("k")
+    store.set("k", b"second" * 200, ttl_sec=60)
+    assert bytes(view) == b"first" * 200
+    assert store.get("k") == b"second" * 200
+
+
+def _writer(directory, worker, rounds):
+    store = BlobStore(directory)
+    for n in range(rounds):
+        store.set(f"shared|{n % 5}", f"worker-{worker}-{n}".encode() * 50, ttl_sec=60)
+        store.set(f"own|{worker}|{n}", f"own-{worker}-{n}".encode(), ttl_sec=60)
+        assert store.get(f"own|{worker}|{n}") == f"own-{worker}-{n}".encode()
+
+
+def test_concurrent_writers_in_separate_processes(tmp_path):
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_writer, args=(str(tmp_path), worker, 40)) for worker in range(4)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(30)
+    assert all(proc.exitcode == 0 for proc in procs)
+
+    store = BlobStore(str(tmp_path))
+    for slot in range(5):
+        written = {f"worker-{w}-{n}".encode() * 50 for w in range(4) for n in range(slot, 40, 5)}
+        assert bytes(store.get(f"shared|{slot}")) in written
+    assert all(store.get(f"own|{w}|{n}") is not None for w in range(4) for n in range(40))
+    assert _no_temp_files(tmp_path)
@@ -0,0 +1,148 @@
+"""Tests for the shared A-GNSS fan-out cache and its use in fetch_agnss_bytes."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from api.agnss import fanout_cache
+from api.agnss.cache_store import BlobStore
+from api.agnss.fanout_cache import AgnssFanoutCache, area_bucket, cache_key
+from api.services import agnss_fetch
+
+
+def test_keys_bucket_by_area_and_window():
+    assert area_bucket(mcc=505, mnc=1, tac=12345, lat=1.0, lon=2.0) == "cell:505-1-12345"
+    assert area_bucket(lat=-27.47, lon=153.02, grid_deg=1.0) == area_bucket(lat=-27.9, lon=153.6, grid_deg=1.0)
+    assert area_bucket(lat=-27.47, lon=153.02, grid_deg=1.0) != area_bucket(lat=-26.9, lon=153.02, grid_deg=1.0)
+    assert area_bucket() == "global"
+
+    assert cache_key("SUPL", "global", now=3599, window_sec=3600) == cache_key("SUPL", "global", now=0, window_sec=3600)
+    assert cache_key("SUPL", "global", now=3600, window_sec=3600) != cache_key("SUPL", "global", now=0, window_sec=3600)
+    assert cache_key("SUPL", "global", now=0) != cache_key("NRF_CLOUD", "global", now=0)
+
+
+def test_memory_lru_and_disk_tier(tmp_path):
+    cache = AgnssFanoutCache(BlobStore(str(tmp_path)), memory_entries=2, ttl_sec=60)
+    cache.set("a", b"A")
+    cache.set("b", b"B")
+    assert cache.get("a") == (b"A", "memory")
+    cache.set("c", b"C")  # evicts "b", the least recently used
+    assert cache.stats()["evictions"] == 1
+    assert cache.get("b") == (b"B", "disk")
+
+    # A second process (fresh memory) still sees the disk tier
+    other = AgnssFanoutCache(BlobStore(str(tmp_path)), memory_entries=2, ttl_sec=60)
+    assert other.get("c") == (b"C", "disk")
+    assert other.get("missing") == (None, None)
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = AgnssFanoutCache(BlobStore(str(tmp_path)), memory_entries=4, ttl_sec=0.05)
+    cache.set("old", b"x")
+    time.sleep(0.1)
+    assert cache.get("old") == (None, None)
+    assert cache.stats()["misses"] == 1
+
+
+def test_concurrent_misses_share_one_fetch(tmp_path):
+    cache = AgnssFanoutCache(BlobStore(str(tmp_path)), ttl_sec=60)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return b"blob"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_fetch("k", fetch) for _ in range(50)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(data == b"blob" for data, _ in results)
+    assert sum(1 for _, cached in results if not cached) == 1
+    stats = cache.stats()
+    assert stats["coalesced"] == 49 and stats["upstream_fetches"] == 1 and stats["in_flight"] == 0
+
+    assert asyncio.run(cache.get_or_fetch("k", fetch)) == (b"blob", True)
+    assert len(calls) == 1
+
+
+def test_failed_fetch_is_shared_and_not_cached(tmp_path):
+    cache = AgnssFanoutCache(BlobStore(str(tmp_path)), ttl_sec=60)
+
+    async def boom():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def empty():
+        return None
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_fetch("k", boom) for _ in range(3)), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(run()))
+    assert asyncio.run(cache.get_or_fetch("k", empty)) == (None, False)
+    assert cache.get("k") == (None, None)
+
+
+@pytest.fixture
+def shared_cache(monkeypatch, tmp_path):
+    cache = AgnssFanoutCache(BlobStore(str(tmp_path)), ttl_sec=60)
+    monkeypatch.setattr(fanout_cache, "_fanout_cache", cache)
+    monkeypatch.setenv("AGNSS_PROVIDER", "NRF_CLOUD")
+    monkeypatch.setattr(agnss_fetch, "auth_bearer_token", lambda: "key")
+    return cache
+
+
+def test_fetch_agnss_bytes_fans_out_per_cell_area(monkeypatch, shared_cache):
+    upstream = []
+
+    async def fake_fetch(device_id, api_key, body, sink=None):
+        upstream.append((device_id, body.get("tac")))
+        await asyncio.sleep(0.02)
+        return b"eph-" + str(body.get("tac")).encode()
+
+    monkeypatch.setattr(agnss_fetch, "_fetch_nrf_cloud", fake_fetch)
+
+    async def run():
+        same_area = [
+            agnss_fetch.fetch_agnss_bytes(device_id, mcc=505, mnc=1, tac=100, eci=device_id)
+            for device_id in range(1, 21)
+        ]
+        other_area = agnss_fetch.fetch_agnss_bytes(99, mcc=505, mnc=1, tac=200, eci=1)
+        return await asyncio.gather(*same_area, other_area)
+
+    results = asyncio.run(run())
+    assert len(upstream) == 2
+    assert {data for data, _ in results[:20]} == {b"eph-100"}
+    assert results[20][0] == b"eph-200"
+    assert sorted({source for _, source in results}) == ["nRF Cloud", "nRF Cloud cache"]
+
+
+def test_store_write_runs_off_the_event_loop(tmp_path):
+    store = BlobStore(str(tmp_path))
+    cache = AgnssFanoutCache(store, ttl_sec=60)
+    writers = []
+    real_set = store.set
+
+    def recording_set(key, data, ttl_sec):
+        writers.append(threading.get_ident())
+        return real_set(key, data, ttl_sec)
+
+    store.set = recording_set
+
+    async def fetch():
+        return b"blob"
+
+    async def run():
+        await cache.get_or_fetch("k", fetch)
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(run())
+    assert len(writers) == 1 and writers[0] != loop_thread
+    assert bytes(store.get("k")) == b"blob"
+    assert cache.stats(include_disk=False)["disk"] is None
@@ -0,0 +1,82 @@
+"""Tests for A-GNSS chunk framing (json and binary)."""
+
+from __future__ import annotations
+
+import base64
+import json
+import os
+
+import pytest
+
+from api.agnss.framing import (
+    BINARY_HEADER,
+    FORMAT_BINARY,
+    FORMAT_JSON,
+    chunk_views,
+    iter_binary_frames,
+    iter_json_frames,
+    normalize_format,
+    parse_binary_frame,
+)
+from api.services import mqtt_client
+
+
+def test_binary_frames_roundtrip():
+    blob = os.urandom(2000)
+    frames = list(iter_binary_frames(blob, 768))
+    assert len(frames) == 3
+    assert [len(f) for f in frames] == [BINARY_HEADER.size + n for n in (768, 768, 464)]
+
+    parsed = [parse_binary_frame(f) for f in frames]
+    assert [(seq, total) for seq, total, _ in parsed] == [(0, 3), (1, 3), (2, 3)]
+    assert b"".join(bytes(payload) for _, _, payload in parsed) == blob
+
+
+def test_binary_frame_rejects_corruption():
+    frame = next(iter_binary_frames(b"\x01" * 100, 768))
+    frame[-1] ^= 0xFF
+    with pytest.raises(ValueError, match="crc"):
+        parse_binary_frame(frame)
+    with pytest.raises(ValueError):
+        parse_binary_frame(b"\x01\x00")
+    bad_version = bytearray(next(iter_binary_frames(b"\x01" * 10, 768)))
+    bad_version[0] = 9
+    with pytest.raises(ValueError, match="version"):
+        parse_binary_frame(bad_version)
+
+
+def test_json_frames_keep_existing_shape():
+    blob = bytes(range(256)) * 4
+    frames = [json.loads(f) for f in iter_json_frames(blob, 768)]
+    assert [(f["seq"], f["total"]) for f in frames] == [(0, 2), (1, 2)]
+    assert b"".join(base64.b64decode(f["chunk_b64"]) for f in frames) == blob
+
+
+def test_chunk_views_do_not_copy():
+    blob = bytearray(b"abcdefgh")
+    views = list(chunk_views(blob, 3))
+    blob[0:1] = b"z"
+    assert [bytes(v) for v in views] == [b"zbc", b"def", b"gh"]
+    with pytest.raises(ValueError):
+        list(chunk_views(blob, 0))
+
+
+def test_normalize_format():
+    assert normalize_format("binary") == FORMAT_BINARY
+    assert normalize_format(" BINARY ") == FORMAT_BINARY
+    assert normalize_format(None) == FORMAT_JSON
+    assert normalize_format("cbor") == FORMAT_JSON
+    assert normalize_format(1) == FORMAT_JSON
+
+
+def test_agnss_messages_use_requested_format(monkeypatch):
+    monkeypatch.setenv("MQTT_AGNSS_CHUNK_BYTES", "768")
+    blob = os.urandom(1000)
+
+    binary = mqtt_client._agnss_messages(67, blob, FORMAT_BINARY)
+    assert [m[0] for m in binary] == ["devices/67/agnss_data"] * 2
+    assert b"".join(bytes(parse_binary_frame(m[1])[2]) for m in binary) == blob
+
+    legacy = mqtt_client._agnss_messages(67, blob)
+    assert all(isinstance(m[1], str) for m in legacy)
+    assert sum(len(m[1]) for m in legacy) > sum(len(m[1]) for m in binary)
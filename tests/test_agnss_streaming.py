@@ -0,0 +1,174 @@
+"""Tests for streamed A-GNSS downloads and Range resume for devices."""
+
+from __future__ import annotations
+
+import asyncio
+
+import httpx
+import pytest
+from fastapi import FastAPI, Header
+from fastapi.testclient import TestClient
+
+from api.agnss import fanout_cache
+from api.agnss.fanout_cache import AgnssFanoutCache
+from api.agnss.streaming import ProgressiveBlob
+from api.endpoints.buffer_response import RangeNotSatisfiable, assistance_response, byte_range, etag
+from api.services import agnss_fetch
+from api.services.assistance_prefetch import AssistancePrefetcher
+
+BLOB = bytes(range(256)) * 80  # 20 KiB: two upstream ranges
+
+
+def test_byte_range_parsing():
+    assert byte_range(None, 100) is None
+    assert byte_range("bytes=10-19", 100) == (10, 20)
+    assert byte_range("bytes=90-", 100) == (90, 100)
+    assert byte_range("bytes=90-500", 100) == (90, 100)
+    assert byte_range("bytes=-30", 100) == (70, 100)
+    assert byte_range("bytes=0-1,5-6", 100) is None and byte_range("items=0-1", 100) is None
+    assert byte_range("bytes=abc", 100) is None
+    with pytest.raises(RangeNotSatisfiable):
+        byte_range("bytes=100-", 100)
+
+
+def _app(payload_factory):
+    app = FastAPI()
+
+    @app.get("/blob")
+    async def endpoint(
+        range_header: str | None = Header(None, alias="Range"),
+        if_range: str | None = Header(None, alias="If-Range"),
+    ):
+        return assistance_response(payload_factory(), range_header=range_header, if_range=if_range)
+
+    return TestClient(app)
+
+
+def test_cached_blobs_resume_with_range():
+    client = _app(lambda: [BLOB[:10], memoryview(BLOB)[10:]])
+    full = client.get("/blob")
+    assert full.status_code == 200 and full.content == BLOB and full.headers["accept-ranges"] == "bytes"
+    tag = full.headers["etag"]
+    assert tag == etag([BLOB])
+
+    part = client.get("/blob", headers={"Range": "bytes=5-", "If-Range": tag})
+    assert part.status_code == 206 and part.content == BLOB[5:]
+    assert part.headers["content-range"] == f"bytes 5-{len(BLOB) - 1}/{len(BLOB)}"
+
+    # The data changed since the first part: send it all again
+    stale = client.get("/blob", headers={"Range": "bytes=5-", "If-Range": '"00000000-1"'})
+    assert stale.status_code == 200 and stale.content == BLOB
+    assert client.get("/blob", headers={"Range": f"bytes={len(BLOB)}-"}).status_code == 416
+
+
+def test_progressive_blob_range_streams():
+    def payload():
+        blob = ProgressiveBlob()
+        blob.total = len(BLOB)
+        for i in range(0, len(BLOB), 4096):
+            blob.append(BLOB[i : i + 4096])
+        blob.finish()
+        return blob
+
+    client = _app(payload)
+    assert client.get("/blob").content == BLOB
+    part = client.get("/blob", headers={"Range": "bytes=5000-9000"})
+    assert part.status_code == 206 and part.content == BLOB[5000:9001]
+    assert part.headers["content-length"] == "4001"
+
+
+@pytest.fixture
+def nrf_cloud(monkeypatch):
+    """Fake nRF Cloud serving BLOB in 16 KiB ranges; the second range waits for release."""
+    monkeypatch.setattr(fanout_cache, "_fanout_cache", AgnssFanoutCache(store=None, ttl_sec=60))
+    monkeypatch.setattr("api.services.assistance_prefetch.prefetcher", AssistancePrefetcher(region_loader=None))
+    monkeypatch.setenv("AGNSS_PROVIDER", "NRF_CLOUD")
+    monkeypatch.setattr(agnss_fetch, "auth_bearer_token", lambda: "key")
+    ranges = []
+    state = {}
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        first, _, last = request.headers["Range"][len("bytes="):].partition("-")
+        start, end = int(first), min(len(BLOB), int(last) + 1 if last else len(BLOB))
+        ranges.append(request.headers["Range"])
+        if start > 0 and state.get("fail_later_ranges"):
+            return httpx.Response(500)
+
+        async def body():
+            if start > 0:
+                await state["release"].wait()
+            yield BLOB[start:end]
+
+        return httpx.Response(206, headers={"Content-Range": f"bytes {start}-{end - 1}/{len(BLOB)}"}, content=body())
+
+    class Clients:
+        def get(self, name):
+            return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    monkeypatch.setattr(agnss_fetch, "http_clients", Clients())
+    return ranges, state
+
+
+def test_upstream_ranges_reach_the_device_as_they_arrive(nrf_cloud):
+    ranges, state = nrf_cloud
+
+    async def run():
+        state["release"] = asyncio.Event()
+        first, source = await agnss_fetch.fetch_agnss_bytes(1, mcc=505, mnc=1, tac=100, eci=7, stream=True)
+        # Handed over after the first range, while the second is still pending
+        assert isinstance(first, ProgressiveBlob) and source == "nRF Cloud"
+        assert not first.done and first.size == 16384 and first.total == len(BLOB)
+
+        # A second device joins the same download
+        second, _ = await agnss_fetch.fetch_agnss_bytes(2, mcc=505, mnc=1, tac=100, eci=8, stream=True)
+        assert second is first
+
+        reader = first.iter_range()
+        head = await reader.__anext__()
+        state["release"].set()
+        rest = [bytes(chunk) async for chunk in reader]
+        await asyncio.gather(*agnss_fetch._download_tasks)
+        return bytes(head) + b"".join(rest)
+
+    assert asyncio.run(run()) == BLOB
+    assert ranges == ["bytes=0-16383", "bytes=16384-"]
+
+    # The finished download is in the cache for everyone else
+    async def again():
+        return await agnss_fetch.fetch_agnss_bytes(3, mcc=505, mnc=1, tac=100, eci=9, stream=True)
+
+    data, source = asyncio.run(again())
+    assert bytes(data) == BLOB and source == "nRF Cloud cache" and len(ranges) == 2
+
+
+def test_non_streaming_callers_get_the_whole_blob(nrf_cloud):
+    ranges, state = nrf_cloud
+
+    async def run():
+        state["release"] = asyncio.Event()
+        state["release"].set()
+        return await agnss_fetch.fetch_agnss_bytes(1, mcc=505, mnc=1, tac=100, eci=7)
+
+    data, source = asyncio.run(run())
+    assert data == BLOB and source == "nRF Cloud" and len(ranges) == 2
+
+
+def test_failed_later_range_is_not_cached(nrf_cloud):
+    ranges, state = nrf_cloud
+    state["fail_later_ranges"] = True
+
+    async def run():
+        state["release"] = asyncio.Event()
+        first, _ = await agnss_fetch.fetch_agnss_bytes(1, mcc=505, mnc=1, tac=100, eci=7, stream=True)
+        assert isinstance(first, ProgressiveBlob)
+        # The device reading the stream is cut off rather than handed a short blob as complete
+        with pytest.raises(agnss_fetch.IncompleteDownload):
+            async for _ in first.iter_range():
+                pass
+        await asyncio.gather(*agnss_fetch._download_tasks)
+        # Nothing was cached: a non-streaming caller downloads again and gets nothing usable
+        return await agnss_fetch.fetch_agnss_bytes(2, mcc=505, mnc=1, tac=100, eci=8)
+
+    assert asyncio.run(run()) == (None, None)
+    assert ranges == ["bytes=0-16383", "bytes=16384-"] * 2
+    assert fanout_cache.get_agnss_fanout_cache().get(agnss_fetch.cache_key("NRF_CLOUD", "cell:505-1-100"))[0] is None
@@ -0,0 +1,114 @@
+"""Tests for the A-GNSS provider engine and the binary POST /agnss."""
+
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.agnss import fanout_cache
+from api.agnss.fanout_cache import AgnssFanoutCache
+from api.services import agnss_fetch
+from api.services.agnss_fetch import AssistanceEngine, AssistanceProvider, AssistanceRequest
+from api.services.assistance_prefetch import AssistancePrefetcher
+
+
+class FakeProvider(AssistanceProvider):
+    def __init__(self, name, data=b"", error=None):
+        self.name = self.source = name
+        self.data = data
+        self.error = error
+        self.calls = 0
+
+    async def fetch(self, request, sink=None):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.data
+
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    monkeypatch.setattr(fanout_cache, "_fanout_cache", AgnssFanoutCache(store=None, ttl_sec=60))
+    monkeypatch.setattr("api.services.assistance_prefetch.prefetcher", AssistancePrefetcher(region_loader=None))
+    monkeypatch.delenv("AGNSS_PROVIDER", raising=False)
+
+
+def test_providers_are_tried_in_order_behind_the_cache():
+    failing = FakeProvider("BROKEN", error=RuntimeError("down"))
+    empty = FakeProvider("EMPTY")
+    good = FakeProvider("LOCAL", b"eph")
+    engine = AssistanceEngine([failing, empty, good])
+
+    async def run():
+        first = await engine.fetch(AssistanceRequest(1, lat=1.0, lon=2.0))
+        second = await engine.fetch(AssistanceRequest(2, lat=1.0, lon=2.0))
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == (b"eph", "LOCAL") and second == (b"eph", "LOCAL cache")
+    assert good.calls == 1
+    assert engine.stats() == {
+        "providers": ["BROKEN", "EMPTY", "LOCAL"],
+        "served": {"LOCAL": 1, "LOCAL cache": 1},
+        "unavailable": 0,
+    }
+
+
+def test_register_and_agnss_provider_selection(monkeypatch):
+    engine = AssistanceEngine([FakeProvider("NRF_CLOUD", b"nrf")])
+    engine.register(FakeProvider("LOCAL", b"local"), index=0)
+    assert [p.name for p in engine.providers] == ["LOCAL", "NRF_CLOUD"]
+    # Same name replaces the existing provider
+    engine.register(FakeProvider("LOCAL", b"newer"))
+    assert [p.name for p in engine.providers] == ["NRF_CLOUD", "LOCAL"]
+
+    monkeypatch.setenv("AGNSS_PROVIDER", "local")
+    assert asyncio.run(engine.fetch(AssistanceRequest(1))) == (b"newer", "LOCAL")
+
+    monkeypatch.setenv("AGNSS_PROVIDER", "NONE")
+    assert asyncio.run(engine.fetch(AssistanceRequest(1))) == (None, None)
+    assert engine.unavailable == 1
+
+    class NoFetch(AssistanceProvider):
+        name = source = "NO_FETCH"
+
+    with pytest.raises(TypeError):
+        NoFetch()
+
+
+def test_post_agnss_returns_binary(monkeypatch):
+    from api.endpoints import device_data_endpoints
+
+    provider = FakeProvider("LOCAL", bytes(range(200)))
+    monkeypatch.setattr(agnss_fetch, "assistance_engine", AssistanceEngine([provider]))
+    device = SimpleNamespace(access_token="secret")
+    app = FastAPI()
+    app.include_router(device_data_endpoints.router, prefix="/v1")
+    client = TestClient(app)
+
+    with patch.object(device_data_endpoints, "connect", MagicMock()), patch.object(
+        device_data_endpoints, "get_device", MagicMock(return_value=device)
+    ):
+        response = client.post(
+            "/v1/agnss",
+            json={"device_id": 7, "cell_hint": {"latitude": -27.5, "longitude": 153.0}},
+            headers={"Access-Token": "secret"},
+        )
+        assert response.status_code == 200
+        assert response.content == bytes(range(200))
+        assert response.headers["content-type"] == "application/octet-stream"
+        assert response.headers["x-agnss-source"] == "LOCAL"
+
+        part = client.post(
+            "/v1/agnss", json={"device_id": 7}, headers={"Access-Token": "secret", "Range": "bytes=100-"}
+        )
+        assert part.status_code == 206 and part.content == bytes(range(100, 200))
+
+        denied = client.post("/v1/agnss", json={"device_id": 7}, headers={"Access-Token": "wrong"})
+        assert denied.status_code == 401
+    assert provider.calls == 1  # one shared download for both device requests
@@ -0,0 +1,166 @@
+"""Tests for the background A-GNSS / P-GPS prefetcher."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from api.agnss import fanout_cache, pgps
+from api.agnss.cache_store import BlobStore
+from api.agnss.fanout_cache import AgnssFanoutCache, window_end
+from api.services import agnss_fetch
+from api.services.assistance_prefetch import AssistancePrefetcher
+
+
+@pytest.fixture
+def upstream(monkeypatch, tmp_path):
+    """Real fetch path and fan-out cache, fake nRF Cloud."""
+    monkeypatch.setattr(fanout_cache, "_fanout_cache", AgnssFanoutCache(BlobStore(str(tmp_path)), ttl_sec=60))
+    monkeypatch.setenv("AGNSS_PROVIDER", "NRF_CLOUD")
+    monkeypatch.setattr(agnss_fetch, "auth_bearer_token", lambda: "key")
+    calls = []
+
+    async def fake_agnss(device_id, api_key, body, sink=None):
+        calls.append(("agnss", body.get("tac")))
+        return b"eph"
+
+    async def fake_pgps(count, period, gps_day, gps_time_of_day):
+        calls.append(("pgps", count))
+        return pgps.HEADER.pack(1, 0, 1, count, period, gps_day, gps_time_of_day) + bytes(count * 4)
+
+    monkeypatch.setattr(agnss_fetch, "_fetch_nrf_cloud", fake_agnss)
+    monkeypatch.setattr(agnss_fetch, "request_pgps_from_nrf_cloud", fake_pgps)
+    return calls
+
+
+def test_requests_become_targets_and_are_kept_warm(monkeypatch, upstream):
+    monkeypatch.setenv("AGNSS_CACHE_WINDOW_SEC", "3600")
+    prefetcher = AssistancePrefetcher(region_loader=None, lead_sec=0)
+    monkeypatch.setattr("api.services.assistance_prefetch.prefetcher", prefetcher)
+
+    async def run():
+        assert (await agnss_fetch.fetch_agnss_bytes(1, mcc=505, mnc=1, tac=100, eci=7))[1] == "nRF Cloud"
+        assert (await agnss_fetch.fetch_pgps_bytes(42, 240))[1] == "nRF Cloud"
+        assert prefetcher.stats()["agnss_targets"] == 1 and prefetcher.stats()["pgps_targets"] == 1
+
+        # Already fetched by the device requests: nothing to do upstream
+        assert await prefetcher.tick() == {"refreshed": 0, "warm": 2, "failed": 0}
+        assert len(upstream) == 2
+
+    asyncio.run(run())
+    stats = prefetcher.stats()
+    assert stats["cold_targets"] == 0 and stats["already_warm"] == 2
+    assert stats["device_hit_ratio"] == 0.0
+
+
+def test_next_window_is_fetched_before_it_opens(monkeypatch, upstream):
+    monkeypatch.setenv("AGNSS_CACHE_WINDOW_SEC", "1")
+    prefetcher = AssistancePrefetcher(region_loader=None, lead_sec=1)
+    monkeypatch.setattr("api.services.assistance_prefetch.prefetcher", prefetcher)
+    prefetcher.note_agnss_request(mcc=505, mnc=1, tac=100, eci=7)
+
+    async def run():
+        counts = await prefetcher.tick()
+        assert counts["refreshed"] == 2  # current and next window
+        await asyncio.sleep(window_end() - time.time() + 0.05)
+        return await agnss_fetch.fetch_agnss_bytes(1, mcc=505, mnc=1, tac=100, eci=7)
+
+    data, source = asyncio.run(run())
+    assert data == b"eph" and source == "nRF Cloud cache"
+    assert upstream == [("agnss", 100), ("agnss", 100)]
+    stats = fanout_cache.get_agnss_fanout_cache().stats()
+    assert stats["prefetched"] == 2 and stats["upstream_fetches"] == 0 and stats["hit_ratio"] == 1.0
+
+
+def test_db_regions_and_expiry():
+    clock = [1_000_000.0]
+    fetched = []
+
+    async def fake_agnss(device_id, *, at, **params):
+        fetched.append(params)
+        return b"x", "SUPL"
+
+    async def fake_pgps(**params):
+        return None, None
+
+    prefetcher = AssistancePrefetcher(
+        lead_sec=0,
+        active_sec=100,
+        db_interval_sec=50,
+        region_loader=lambda since, grid, limit: [{"lat": -27.5, "lon": 153.0, "devices": 12}],
+        region_area=lambda lat, lon: f"grid:{int(lat)}:{int(lon)}",
+        agnss_fetch=fake_agnss,
+        pgps_fetch=fake_pgps,
+        clock=lambda: clock[0],
+    )
+    prefetcher.note_pgps_request(42, 240)
+
+    counts = asyncio.run(prefetcher.tick())
+    assert counts == {"refreshed": 1, "warm": 0, "failed": 1}
+    assert fetched == [{"lat": -27.5, "lon": 153.0}]
+    stats = prefetcher.stats()
+    assert stats["db_regions"] == 1 and stats["data_age_sec"]["max"] == 0.0
+
+    # The region query is throttled, and targets nobody asked for lately are dropped
+    prefetcher._region_loader = lambda since, grid, limit: []
+    clock[0] += 150
+    asyncio.run(prefetcher.tick())
+    stats = prefetcher.stats()
+    assert stats["agnss_targets"] == 0 and stats["pgps_targets"] == 0 and stats["db_regions"] == 0
+
+
+def test_db_regions_collapse_to_the_answering_providers_buckets():
+    fetched = []
+
+    async def fake_agnss(device_id, *, at, **params):
+        fetched.append(params)
+        return b"x", "nRF Cloud"
+
+    regions = [{"lat": -27.5, "lon": 153.0}, {"lat": -33.9, "lon": 151.2}, {"lat": 51.5, "lon": -0.1}]
+    prefetcher = AssistancePrefetcher(
+        lead_sec=0,
+        region_loader=lambda since, grid, limit: regions,
+        region_area=lambda lat, lon: "global",  # nRF Cloud ignores lat/lon
+        agnss_fetch=fake_agnss,
+    )
+    asyncio.run(prefetcher.tick())
+    assert fetched == [{}]
+    assert prefetcher.stats()["db_regions"] == 1 and prefetcher.stats()["agnss_targets"] == 1
+
+    # A device asking with or without a location is the same target
+    prefetcher.note_agnss_request(lat=-27.5, lon=153.0)
+    prefetcher.note_agnss_request()
+    assert prefetcher.stats()["agnss_targets"] == 1
+
+
+def test_region_area_follows_the_provider_order(monkeypatch):
+    monkeypatch.setattr(agnss_fetch, "auth_bearer_token", lambda: "key")
+    request = agnss_fetch.AssistanceRequest(0, lat=-27.5, lon=153.0)
+    assert agnss_fetch.assistance_engine.area_for(request) == "global"
+    monkeypatch.setenv("AGNSS_PROVIDER", "SUPL")
+    assert agnss_fetch.assistance_engine.area_for(request).startswith("grid:")
+
+
+def test_target_table_is_bounded():
+    prefetcher = AssistancePrefetcher(region_loader=None, max_targets=3)
+    for tac in range(10):
+        prefetcher.note_agnss_request(mcc=505, mnc=1, tac=tac, eci=1)
+    assert prefetcher.stats()["agnss_targets"] == 3
+
+
+def test_follower_demand_reaches_the_leader(monkeypatch):
+    from api.services import assistance_prefetch
+
+    sent = []
+    monkeypatch.setattr(assistance_prefetch.worker_bus, "notify", lambda topic, payload=None: sent.append((topic, payload)))
+    follower = AssistancePrefetcher(region_loader=None)
+    follower.note_pgps_request(42, 240)
+    assert sent == [("assistance_demand", ["pgps:240", "pgps", {"prediction_count": 42, "prediction_period_min": 240}])]
+
+    # On the leader the notice becomes a target, and is not sent on again
+    leader = AssistancePrefetcher(region_loader=None)
+    monkeypatch.setattr(assistance_prefetch, "prefetcher", leader)
+    assistance_prefetch.worker_bus._handlers["assistance_demand"](sent[0][1])
+    assert leader.stats()["pgps_targets"] == 1 and len(sent) == 1
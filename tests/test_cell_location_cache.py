@@ -0,0 +1,127 @@
+"""Tests for the cell location cache and learned tower table."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from api.endpoints.cell_location import CellInfo, CellLocationResponse
+from api.services import cell_locate_service, cell_location_cache, device_ingest
+from api.services.cell_location_cache import CellLocationCache, cell_set_key
+
+
+def _cell(eci: int, signal: int = -90, tac: int = 100) -> CellInfo:
+    return CellInfo(cellId=eci, mcc=505, mnc=1, lac=tac, tac=tac, signal=signal)
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.delenv("DATABASE_URI", raising=False)
+    cache = CellLocationCache(ttl_sec=60, max_entries=100, bucket_db=10, min_accuracy_m=100)
+    monkeypatch.setattr(cell_location_cache, "_cell_location_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    calls = []
+
+    async def fake_query(cells):
+        calls.append([c.cellId for c in cells])
+        return CellLocationResponse(latitude=-27.47, longitude=153.02, accuracy=800, source="nrf_cloud")
+
+    monkeypatch.setattr(cell_locate_service, "_query_providers", fake_query)
+    return calls
+
+
+def test_cell_set_key_is_order_independent_and_bucketed():
+    a = cell_set_key([_cell(1, -91), _cell(2, -75)])
+    assert a == cell_set_key([_cell(2, -79), _cell(1, -99)])
+    assert a != cell_set_key([_cell(1, -89), _cell(2, -75)])
+    # LAC stands in for a missing TAC
+    assert cell_set_key([CellInfo(cellId=1, mcc=505, mnc=1, lac=100, signal=-90)]) == cell_set_key([_cell(1)])
+
+
+def test_repeat_lookups_skip_the_provider(cache, provider):
+    async def run():
+        first = await cell_locate_service.resolve_cell_location([_cell(1, -91), _cell(2)])
+        again = await cell_locate_service.resolve_cell_location([_cell(2), _cell(1, -95)])
+        # Same serving cell, unseen neighbour: estimated from the tower table
+        nearby = await cell_locate_service.resolve_cell_location([_cell(1, -80), _cell(3)])
+        return first, again, nearby
+
+    first, again, nearby = asyncio.run(run())
+    assert provider == [[1, 2]]
+    assert again == first and first.source == "nrf_cloud"
+    assert nearby.source == "cell_db" and nearby.latitude == pytest.approx(-27.47)
+    stats = cache.stats()
+    assert stats["answer_hits"] == 1 and stats["tower_hits"] == 1 and stats["misses"] == 1
+    assert stats["learned_from_provider"] == 1 and stats["hit_ratio"] == 0.667
+
+
+def test_answers_expire():
+    clock = [0.0]
+    cache = CellLocationCache(ttl_sec=10, max_entries=10, bucket_db=10, clock=lambda: clock[0])
+    answer = CellLocationResponse(latitude=1.0, longitude=2.0, accuracy=500, source="here")
+    cache.remember([_cell(1), _cell(2)], answer)
+    assert cache.lookup([_cell(1), _cell(2)]) is answer
+    clock[0] = 11.0
+    assert cache.lookup([_cell(1), _cell(2)]).source == "cell_db"
+    assert cache.stats()["answers"] == 0
+
+
+def test_gps_fixes_place_towers_and_outrank_providers():
+    cache = CellLocationCache(ttl_sec=0, min_accuracy_m=50)
+    cache.remember([_cell(1)], CellLocationResponse(latitude=0.0, longitude=0.0, accuracy=2000, source="google"))
+
+    for lat in (-27.0, -27.002, -27.004):
+        rows = cache.learn_fix([_cell(1), _cell(2)], lat, 153.0)
+    assert [r["eci"] for r in rows] == [1, 2] and rows[0]["samples"] == 3 and rows[0]["source"] == "gps"
+    assert rows[0]["latitude"] == pytest.approx(-27.002)
+    # RMS spread of fixes 0, 222 and 222 m from the mean
+    assert rows[0]["accuracy_m"] == pytest.approx(181.8, abs=0.5)
+
+    # A later provider answer does not move a GPS-placed cell
+    assert cache.remember([_cell(1)], CellLocationResponse(latitude=0.0, longitude=0.0, accuracy=9, source="here")) == []
+    estimate = cache.lookup([_cell(1, -70), _cell(2, -100)])
+    assert estimate.latitude == pytest.approx(-27.002) and estimate.source == "cell_db"
+    assert cache.stats()["towers_from_gps"] == 2
+
+
+def test_weighted_centroid_favours_the_strongest_cell():
+    cache = CellLocationCache(ttl_sec=0, min_accuracy_m=100)
+    cache.learn_fix([_cell(1)], 0.0, 0.0)
+    cache.learn_fix([_cell(2)], 1.0, 0.0)
+    estimate = cache.lookup([_cell(1, -70), _cell(2, -90)])
+    assert estimate.latitude == pytest.approx(1 / 101)
+
+
+def test_loaded_towers_answer_without_network():
+    cache = CellLocationCache(ttl_sec=0, max_towers=2)
+    rows = [
+        {"mcc": 505, "mnc": 1, "tac": 100, "eci": eci, "latitude": -27.0, "longitude": 153.0,
+         "accuracy_m": 400.0, "samples": 8, "source": "gps"}
+        for eci in (3, 2, 1)
+    ]
+    assert cache.load_towers(rows) == 3
+    # Most recent rows come first and win the bounded table
+    assert cache.lookup([_cell(3)]) is not None and cache.lookup([_cell(1)]) is None
+
+    started = time.perf_counter()
+    for _ in range(1000):
+        cache.lookup([_cell(3), _cell(2)])
+    assert (time.perf_counter() - started) / 1000 < 0.001
+
+
+def test_ingest_learns_from_cells_reported_with_a_fix(monkeypatch, cache):
+    saved = []
+    monkeypatch.setattr(device_ingest, "upsert_cell_towers", lambda conn, rows: saved.extend(rows))
+
+    raw = [{"cellId": 7, "mcc": 505, "mnc": 1, "tac": 100, "signal": -85}]
+    device_ingest._learn_cell_towers(object(), 67, raw, -33.86, 151.2)
+    device_ingest._learn_cell_towers(object(), 67, [{"cellId": "x"}], -33.86, 151.2)
+
+    assert [(r["eci"], r["source"]) for r in saved] == [(7, "gps")]
+    assert cache.lookup([CellInfo(cellId=7, mcc=505, mnc=1, lac=100, tac=100, signal=-85)]).latitude == -33.86
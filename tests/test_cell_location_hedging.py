@@ -0,0 +1,153 @@
+"""Tests for hedged cell location requests, latency tracking and circuit breakers."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from api.endpoints.cell_location import CellInfo, CellLocationResponse
+from api.services import cell_locate_service
+from api.services.provider_health import OPEN, HALF_OPEN, ProviderHealth, ProviderHealthRegistry, trips_breaker
+
+CELLS = [CellInfo(cellId=1, mcc=505, mnc=1, lac=100, tac=100, signal=-90)]
+
+
+def _http_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("POST", "https://example.invalid")
+    return httpx.HTTPStatusError("err", request=request, response=httpx.Response(status, request=request))
+
+
+@pytest.fixture
+def providers(monkeypatch):
+    """Fake nrf_cloud/google/here; behaviour per provider is (delay_sec, exception or None)."""
+    monkeypatch.setenv("CELL_LOCATION_PROVIDER", "auto")
+    monkeypatch.setenv("CELL_TOWER_DB_PATH", "")
+    monkeypatch.setenv("GOOGLE_GEOLOCATION_API_KEY", "g")
+    monkeypatch.setenv("HERE_API_KEY", "h")
+    monkeypatch.setenv("CELL_LOCATION_HEDGE_DELAY_MS", "50")
+    monkeypatch.setattr(cell_locate_service, "auth_bearer_token", lambda: "n")
+    monkeypatch.setattr(cell_locate_service, "cell_location_health", ProviderHealthRegistry("CELL_LOCATION"))
+    monkeypatch.setattr(cell_locate_service, "_hedge_stats", {"hedged": 0, "hedge_wins": 0, "primary_wins": 0})
+    behaviour = {"nrf_cloud": (0.0, None), "google": (0.0, None), "here": (0.0, None)}
+    started, cancelled = [], []
+
+    def fake(name):
+        async def call(cells, api_key):
+            started.append(name)
+            delay, exc = behaviour[name]
+            try:
+                await asyncio.sleep(delay)
+            except asyncio.CancelledError:
+                cancelled.append(name)
+                raise
+            if exc is not None:
+                raise exc
+            return CellLocationResponse(latitude=1.0, longitude=2.0, accuracy=100, source=name)
+
+        return call
+
+    monkeypatch.setattr(cell_locate_service, "get_nrf_cloud_location", fake("nrf_cloud"))
+    monkeypatch.setattr(cell_locate_service, "get_google_location", fake("google"))
+    monkeypatch.setattr(cell_locate_service, "get_here_location", fake("here"))
+    return behaviour, started, cancelled
+
+
+def _query():
+    return asyncio.run(cell_locate_service._query_providers(CELLS))
+
+
+def test_slow_primary_is_hedged_and_cancelled(providers):
+    behaviour, started, cancelled = providers
+    behaviour["nrf_cloud"] = (5.0, None)
+
+    began = time.monotonic()
+    result = _query()
+    assert time.monotonic() - began < 1.0
+    assert result.source == "google"
+    assert started == ["nrf_cloud", "google"] and cancelled == ["nrf_cloud"]
+    stats = cell_locate_service.provider_stats()
+    assert stats["hedged"] == 1 and stats["hedge_wins"] == 1
+    # A cancelled call is not a failure, but still a latency sample of at least the hedge delay
+    assert stats["providers"]["nrf_cloud"]["calls"] == 0
+    health = cell_locate_service.cell_location_health.get("nrf_cloud")
+    assert health.samples() == 1 and health.percentile(0.5) >= 50
+
+
+def test_fast_primary_is_not_hedged(providers):
+    _, started, _ = providers
+    assert _query().source == "nrf_cloud"
+    assert started == ["nrf_cloud"]
+
+
+def test_failure_moves_on_immediately(providers, monkeypatch):
+    behaviour, started, _ = providers
+    monkeypatch.setenv("CELL_LOCATION_HEDGE_DELAY_MS", "5000")
+    behaviour["nrf_cloud"] = (0.0, httpx.ConnectError("down"))
+    behaviour["google"] = (0.0, _http_error(404))
+
+    began = time.monotonic()
+    assert _query().source == "here"
+    assert time.monotonic() - began < 1.0
+    assert started == ["nrf_cloud", "google", "here"]
+
+
+def test_all_failing_reports_every_error(providers):
+    behaviour, _, _ = providers
+    for name in behaviour:
+        behaviour[name] = (0.0, _http_error(503))
+    with pytest.raises(cell_locate_service.CellLocateUnavailable) as info:
+        _query()
+    assert str(info.value).endswith("nrf_cloud HTTP 503, google HTTP 503, here HTTP 503")
+
+
+def test_breaker_skips_a_failing_provider(providers, monkeypatch):
+    monkeypatch.setenv("CELL_LOCATION_BREAKER_FAILURES", "3")
+    behaviour, started, _ = providers
+    behaviour["nrf_cloud"] = (0.0, _http_error(502))
+    for _ in range(3):
+        assert _query().source == "google"
+    started.clear()
+
+    assert _query().source == "google"
+    assert started == ["google"]
+    nrf = cell_locate_service.provider_stats()["providers"]["nrf_cloud"]
+    assert nrf["state"] == OPEN and nrf["rejected"] == 1 and nrf["times_opened"] == 1
+
+
+def test_hedge_delay_follows_the_latency_percentile(providers, monkeypatch):
+    monkeypatch.setenv("CELL_LOCATION_HEDGE_MIN_SAMPLES", "10")
+    health = cell_locate_service.cell_location_health.get("nrf_cloud")
+    assert cell_locate_service.hedge_delay_sec("nrf_cloud") == 0.05
+    for latency in range(100, 1100, 100):
+        health.record(latency, ok=True)
+    assert cell_locate_service.hedge_delay_sec("nrf_cloud") == 1.0
+    assert health.stats()["p50_ms"] == 600 and health.stats()["latency_ms"]["le_1000"] == 5
+
+
+def test_breaker_half_open_probe():
+    clock = [0.0]
+    health = ProviderHealth("x", failure_threshold=2, cooldown_sec=10, clock=lambda: clock[0])
+    health.record(10, ok=False)
+    assert health.allow()
+    health.record(10, ok=False)
+    assert health.state == OPEN and not health.allow()
+
+    clock[0] = 10.0
+    assert health.allow() and health.state == HALF_OPEN
+    assert not health.allow()  # one probe at a time
+    health.record(10, ok=False)
+    assert health.state == OPEN and not health.allow()
+
+    clock[0] = 20.0
+    assert health.allow()
+    health.record(10, ok=True)
+    assert health.state == "closed" and health.allow() and health.allow()
+
+
+def test_only_health_failures_trip_the_breaker():
+    assert trips_breaker(httpx.ReadTimeout("slow"))
+    assert trips_breaker(_http_error(500)) and trips_breaker(_http_error(429))
+    assert not trips_breaker(_http_error(404))
@@ -0,0 +1,84 @@
+"""Unit tests for coalesced WebSocket handshake lookups (no server or DB)."""
+
+from __future__ import annotations
+
+import asyncio
+from types import SimpleNamespace
+
+from api.services.device_lookup import DeviceLookupBatcher
+
+
+def test_concurrent_handshakes_share_one_query():
+    calls: list[list[int]] = []
+
+    def loader(ids):
+        calls.append(ids)
+        return {i: SimpleNamespace(device_id=i, access_token=f"t{i}") for i in ids if i != 99}
+
+    async def run():
+        batcher = DeviceLookupBatcher(loader=loader, window_sec=0.01)
+        results = await asyncio.gather(*(batcher.get(i) for i in (3, 1, 2, 1, 99)))
+        assert [r.device_id if r else None for r in results] == [3, 1, 2, 1, None]
+        assert calls == [[1, 2, 3, 99]]
+        assert batcher.stats()["lookups"] == 5 and batcher.stats()["queries"] == 1
+
+        # A later handshake starts a new batch
+        assert (await batcher.get(4)).access_token == "t4"
+        assert calls[-1] == [4]
+
+    asyncio.run(run())
+
+
+def test_max_batch_flushes_early():
+    calls: list[list[int]] = []
+
+    def loader(ids):
+        calls.append(ids)
+        return {i: SimpleNamespace(device_id=i) for i in ids}
+
+    async def run():
+        batcher = DeviceLookupBatcher(loader=loader, window_sec=10, max_batch=2)
+        results = await asyncio.wait_for(asyncio.gather(batcher.get(1), batcher.get(2)), timeout=1)
+        assert [r.device_id for r in results] == [1, 2]
+        assert calls == [[1, 2]]
+
+    asyncio.run(run())
+
+
+def test_query_failure_reaches_every_waiter():
+    def loader(ids):
+        raise RuntimeError("db down")
+
+    async def run():
+        batcher = DeviceLookupBatcher(loader=loader, window_sec=0.001)
+        results = await asyncio.gather(batcher.get(1), batcher.get(2), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    asyncio.run(run())
+
+
+def test_post_join_reads_share_a_later_batch():
+    calls: list[list[int]] = []
+    version = {"v": 1}
+
+    def loader(ids):
+        calls.append(ids)
+        return {i: SimpleNamespace(device_id=i, control_version=version["v"]) for i in ids}
+
+    async def handshake(batcher, device_id):
+        await batcher.get(device_id)  # auth
+        return await batcher.get(device_id)  # welcome, read after joining the room
+
+    async def run():
+        batcher = DeviceLookupBatcher(loader=loader, window_sec=0.01)
+        first = asyncio.ensure_future(batcher.get(5))
+        await asyncio.sleep(0)
+        version["v"] = 2  # controls change while the auth batch is still open
+        latest = await asyncio.wait_for(asyncio.gather(handshake(batcher, 6), first), timeout=1)
+        assert [r.control_version for r in latest] == [2, 2]
+        welcomes = await asyncio.wait_for(asyncio.gather(handshake(batcher, 5), handshake(batcher, 6)), timeout=1)
+        assert [r.device_id for r in welcomes] == [5, 6]
+        assert calls[-2:] == [[5, 6], [5, 6]]  # each round is one query for both sockets
+        assert not batcher._tasks  # finished queries are not kept
+
+    asyncio.run(run())
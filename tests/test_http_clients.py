@@ -0,0 +1,109 @@
+"""Tests for the pooled upstream HTTP client registry."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from api.services.http_clients import HttpClientRegistry
+
+
+class _KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), _KeepAliveHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_connections_are_reused_across_calls(server):
+    registry = HttpClientRegistry(http2=False)
+
+    async def run():
+        for n in range(5):
+            client = registry.for_url(f"{server}/cell")
+            response = await client.post(f"{server}/cell", json={"n": n})
+            assert response.json() == {"n": n}
+        assert registry.for_url(server) is registry.for_url(f"{server}/other")
+        await registry.aclose()
+
+    asyncio.run(run())
+    stats = registry.stats()["providers"][server]
+    assert stats["requests"] == 5 and stats["connections_opened"] == 1
+    assert stats["reuse_ratio"] == 0.8 and stats["errors"] == 0 and not stats["open"]
+
+
+def test_errors_are_counted(server):
+    registry = HttpClientRegistry(http2=False)
+    dead = "http://127.0.0.1:1"
+
+    async def run():
+        with pytest.raises(Exception):
+            await registry.for_url(dead).post(dead, json={})
+        await registry.aclose()
+
+    asyncio.run(run())
+    assert registry.stats()["providers"][dead]["errors"] == 1
+
+
+def test_provider_timeouts_and_loop_binding(monkeypatch):
+    monkeypatch.setenv("HTTP_TIMEOUT_NRF_CLOUD_SEC", "7.5")
+    registry = HttpClientRegistry(http2=False)
+    assert registry.timeout_for("nrf_cloud") == 7.5
+    assert registry.timeout_for("here") == 10.0
+
+    async def get():
+        client = registry.get("nrf_cloud")
+        assert client is registry.get("nrf_cloud")
+        assert registry.for_url("https://api.nrfcloud.com/v1/location/agnss") is client
+        return client
+
+    first = asyncio.run(get())
+    assert first.timeout.read == 7.5
+    # A new event loop cannot share the old loop's pool
+    assert asyncio.run(get()) is not first
+
+
+def test_client_replaced_for_a_new_loop_is_closed_on_its_own_loop():
+    registry = HttpClientRegistry(http2=False)
+    other_loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=other_loop.run_forever, daemon=True)
+    thread.start()
+
+    async def get():
+        return registry.get("here")
+
+    old = asyncio.run_coroutine_threadsafe(get(), other_loop).result(2)
+
+    async def replace():
+        client = registry.get("here")
+        await registry.aclose()
+        return client
+
+    new = asyncio.run(replace())
+    asyncio.run_coroutine_threadsafe(asyncio.sleep(0.05), other_loop).result(2)  # let the close run there
+    other_loop.call_soon_threadsafe(other_loop.stop)
+    thread.join(2)
+    other_loop.close()
+    assert new is not old and new.is_closed and old.is_closed
@@ -0,0 +1,118 @@
+"""Tests for the offline cell tower index and the local cell location provider."""
+
+from __future__ import annotations
+
+import asyncio
+import gzip
+
+import pytest
+
+from api.endpoints.cell_location import CellInfo, CellLocationResponse
+from api.services import cell_locate_service, cell_location_cache, local_cell_db
+from api.services.cell_location_cache import CellLocationCache
+from api.services.local_cell_db import LocalCellDatabase, build_tower_index
+
+HEADER = "radio,mcc,net,area,cell,unit,lon,lat,range,samples,changeable,created,updated,averageSignal\n"
+ROWS = [
+    "LTE,505,1,100,1001,0,153.00,-27.00,800,10,1,0,0,0",
+    "LTE,505,1,100,1002,0,153.00,-27.10,0,3,1,0,0,0",
+    "LTE,505,1,100,1001,0,153.02,-27.00,500,12,1,0,0,0",  # newer row for the same cell
+    "GSM,505,1,100,9,0,150.00,-30.00,3000,1,1,0,0,0",
+    "NR,505,1,100,68719476735,0,151.00,-33.00,100,1,1,0,0,0",  # NR cell id doesn't fit
+    "LTE,530,5,7,42,0,174.76,-36.85,1200,4,1,0,0,0",
+]
+
+
+def _cell(eci: int, signal: int = -90, mcc: int = 505, mnc: int = 1, tac: int = 100) -> CellInfo:
+    return CellInfo(cellId=eci, mcc=mcc, mnc=mnc, lac=tac, tac=tac, signal=signal)
+
+
+@pytest.fixture
+def index(tmp_path):
+    csv_path = tmp_path / "towers.csv.gz"
+    with gzip.open(csv_path, "wt") as f:
+        f.write(HEADER + "\n".join(ROWS) + "\n")
+    out = tmp_path / "cell_towers.idx"
+    counts = build_tower_index([str(csv_path)], str(out), radios={"LTE", "NR"}, chunk_rows=2)
+    return str(out), counts
+
+
+def test_import_filters_packs_and_deduplicates(index, tmp_path):
+    path, counts = index
+    assert counts == {"read": 6, "imported": 3, "skipped": 1, "duplicates": 1}
+
+    db = LocalCellDatabase(path)
+    assert len(db) == 3
+    found = db.locate([_cell(1001)])
+    assert found.source == "local"
+    assert (found.latitude, found.longitude, found.accuracy) == pytest.approx((-27.0, 153.02, 500.0), abs=1e-4)
+    # Missing range falls back to the default; unknown cells are ignored, not fatal
+    assert db.locate([_cell(1002), _cell(77)]).accuracy == pytest.approx(1000.0)
+    assert db.locate([_cell(9)]) is None and db.locate([_cell(1 << 40)]) is None
+
+    # Headerless plain CSV with an MCC filter
+    plain = tmp_path / "mls.csv"
+    plain.write_text("\n".join(ROWS) + "\n")
+    counts = build_tower_index([str(plain)], str(tmp_path / "nz.idx"), mcc_filter={530}, radios={"LTE"})
+    assert counts["imported"] == 1
+    assert LocalCellDatabase(str(tmp_path / "nz.idx")).locate([_cell(42, mcc=530, mnc=5, tac=7)]) is not None
+
+
+def test_weighted_centroid_uses_rsrp(index):
+    db = LocalCellDatabase(index[0])
+    estimate = db.locate([_cell(1001, -70), _cell(1002, -90)])
+    assert estimate.latitude == pytest.approx(-27.0 - 0.1 / 101, abs=1e-5)
+
+
+@pytest.fixture
+def local_only(monkeypatch, index):
+    monkeypatch.delenv("DATABASE_URI", raising=False)
+    monkeypatch.setenv("CELL_TOWER_DB_PATH", index[0])
+    monkeypatch.setattr(local_cell_db, "_checked", ("", float("-inf")))
+    monkeypatch.setattr(cell_location_cache, "_cell_location_cache", CellLocationCache(ttl_sec=60))
+
+    calls = []
+
+    async def fake_nrf_cloud(cells, api_key):
+        calls.append([c.cellId for c in cells])
+        return CellLocationResponse(latitude=1.0, longitude=2.0, accuracy=900, source="nrf_cloud")
+
+    monkeypatch.setattr(cell_locate_service, "get_nrf_cloud_location", fake_nrf_cloud)
+    monkeypatch.setattr(cell_locate_service, "auth_bearer_token", lambda: "key")
+    return calls
+
+
+@pytest.mark.parametrize("provider", ["local", "auto"])
+def test_local_provider_answers_without_network(monkeypatch, local_only, provider):
+    monkeypatch.setenv("CELL_LOCATION_PROVIDER", provider)
+    result = asyncio.run(cell_locate_service.resolve_cell_location([_cell(1001)]))
+    assert result.source == "local" and local_only == []
+    # Dataset answers are not copied into the learned tower table
+    assert cell_location_cache.get_cell_location_cache().stats()["towers"] == 0
+    assert local_cell_db.get_local_cell_db().stats()["hits"] == 1
+
+
+def test_auto_falls_through_when_the_index_misses(monkeypatch, local_only):
+    monkeypatch.setenv("CELL_LOCATION_PROVIDER", "auto")
+    result = asyncio.run(cell_locate_service.resolve_cell_location([_cell(55)]))
+    assert result.source == "nrf_cloud" and local_only == [[55]]
+
+    monkeypatch.setenv("CELL_LOCATION_PROVIDER", "local")
+    with pytest.raises(cell_locate_service.CellLocateUnavailable, match="not in tower index"):
+        asyncio.run(cell_locate_service.resolve_cell_location([_cell(56)]))
+
+
+def test_index_is_reopened_when_replaced(monkeypatch, index, tmp_path):
+    monkeypatch.setenv("CELL_TOWER_DB_PATH", index[0])
+    monkeypatch.setenv("CELL_TOWER_DB_CHECK_SEC", "0")
+    monkeypatch.setattr(local_cell_db, "_checked", ("", float("-inf")))
+    first = local_cell_db.get_local_cell_db()
+    assert first is local_cell_db.get_local_cell_db()
+
+    csv_path = tmp_path / "more.csv"
+    csv_path.write_text(HEADER + "\n".join(ROWS + ["LTE,505,1,100,2000,0,1,1,1,1,1,0,0,0"]) + "\n")
+    build_tower_index([str(csv_path)], index[0], radios={"LTE"})
+    assert len(local_cell_db.get_local_cell_db()) == 4
+
+    monkeypatch.setenv("CELL_TOWER_DB_PATH", str(tmp_path / "missing.idx"))
+    assert local_cell_db.get_local_cell_db() is None
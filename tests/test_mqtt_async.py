@@ -0,0 +1,153 @@
+"""Tests for the asyncio-native MQTT publisher against a minimal in-process broker."""
+
+from __future__ import annotations
+
+import asyncio
+
+from api.services.mqtt_async import AsyncMqttPublisher
+
+
+class _FakeBroker:
+    """Just enough MQTT 3.1.1: CONNACK, PUBACK (optionally held back), PINGRESP."""
+
+    def __init__(self, hold_acks: bool = False):
+        self.hold_acks = hold_acks
+        self.published: list[tuple[str, bytes]] = []
+        self.held: list[tuple[asyncio.StreamWriter, bytes]] = []
+        self.writers: list[asyncio.StreamWriter] = []
+        self.connects = 0
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for writer in self.writers:
+            writer.close()
+        self.server.close()
+        await self.server.wait_closed()
+
+    def release_acks(self):
+        for writer, packet in self.held:
+            writer.write(packet)
+        self.held.clear()
+
+    def drop_clients(self):
+        for writer in self.writers:
+            writer.close()
+        self.writers.clear()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.writers.append(writer)
+        try:
+            while True:
+                header = (await reader.readexactly(1))[0]
+                length, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    length += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(length)
+                kind = header & 0xF0
+                if kind == 0x10:  # CONNECT
+                    self.connects += 1
+                    writer.write(b"\x20\x02\x00\x00")
+                elif kind == 0x30:  # PUBLISH
+                    qos = (header >> 1) & 0x03
+                    topic_len = int.from_bytes(body[:2], "big")
+                    topic = body[2 : 2 + topic_len].decode()
+                    offset = 2 + topic_len
+                    if qos:
+                        packet_id = body[offset : offset + 2]
+                        offset += 2
+                        ack = b"\x40\x02" + packet_id
+                        if self.hold_acks:
+                            self.held.append((writer, ack))
+                        else:
+                            writer.write(ack)
+                    self.published.append((topic, body[offset:]))
+                elif kind == 0xC0:  # PINGREQ
+                    writer.write(b"\xd0\x00")
+                elif kind == 0xE0:  # DISCONNECT
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def test_publish_resolves_on_puback():
+    async def run():
+        broker = _FakeBroker()
+        port = await broker.start()
+        publisher = AsyncMqttPublisher("127.0.0.1", port, "pytest-async", publish_timeout=3)
+        await publisher.start()
+        assert await publisher.wait_connected(3)
+
+        ok = await publisher.publish_many(
+            [("devices/67/agnss_data", f"chunk-{n}", 1, False) for n in range(20)]
+        )
+        assert ok
+        assert [payload for _, payload in broker.published] == [f"chunk-{n}".encode() for n in range(20)]
+        stats = publisher.stats()
+        assert stats["published"] == 20 and stats["failed"] == 0 and stats["in_flight"] == 0
+
+        await publisher.stop()
+        await broker.stop()
+
+    asyncio.run(run())
+
+
+def test_inflight_window_bounds_unacked_publishes():
+    async def run():
+        broker = _FakeBroker(hold_acks=True)
+        port = await broker.start()
+        publisher = AsyncMqttPublisher("127.0.0.1", port, "pytest-async", max_inflight=3, publish_timeout=3)
+        await publisher.start()
+        assert await publisher.wait_connected(3)
+
+        tasks = [asyncio.ensure_future(publisher.publish("devices/1/controls", str(n), qos=1)) for n in range(5)]
+        await asyncio.sleep(0.3)
+        assert len(broker.published) == 3 and publisher.stats()["in_flight"] == 3
+        assert not any(t.done() for t in tasks)
+
+        broker.release_acks()
+        await asyncio.sleep(0.3)
+        broker.release_acks()
+        assert all(await asyncio.gather(*tasks))
+        assert len(broker.published) == 5
+
+        await publisher.stop()
+        await broker.stop()
+
+    asyncio.run(run())
+
+
+def test_unacked_publish_times_out_and_reconnect_recovers():
+    async def run():
+        broker = _FakeBroker(hold_acks=True)
+        port = await broker.start()
+        publisher = AsyncMqttPublisher(
+            "127.0.0.1", port, "pytest-async", publish_timeout=0.3, backoff_min=0.05
+        )
+        await publisher.start()
+        assert await publisher.wait_connected(3)
+        assert not await publisher.publish("devices/1/controls", "lost", qos=1)
+        assert publisher.stats()["failed"] == 1
+
+        broker.hold_acks = False
+        broker.drop_clients()
+        await asyncio.sleep(0.5)
+        assert await publisher.wait_connected(3)
+        assert broker.connects >= 2
+        publisher.publish_timeout = 3
+        assert await publisher.publish("devices/1/controls", "after-reconnect", qos=1)
+
+        await publisher.stop()
+        await broker.stop()
+
+    asyncio.run(run())
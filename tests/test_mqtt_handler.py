@@ -79,7 +79,20 @@ def test_handle_agnss_request(mock_schedule, mock_fetch, mock_publish):
     asyncio.run(coro)
     mock_fetch.assert_awaited_once()
     assert mock_fetch.call_args.kwargs["mcc"] == 505
-    mock_publish.assert_awaited_once_with(67, b"\x01\x02")
+    mock_publish.assert_awaited_once_with(67, b"\x01\x02", "json")
+
+
+@patch("api.services.mqtt_handler.publish_agnss_chunks_async", new_callable=AsyncMock, return_value=True)
+@patch("api.services.mqtt_handler.fetch_agnss_bytes", new_callable=AsyncMock, return_value=(b"\x01\x02", "nRF Cloud"))
+@patch("api.services.mqtt_handler._schedule")
+def test_handle_agnss_request_binary_format(mock_schedule, mock_fetch, mock_publish):
+    handle_mqtt_message(
+        "devices/67/agnss_request",
+        b'{"mcc":505,"mnc":1,"tac":12345,"eci":67890,"format":"binary"}',
+    )
+
+    asyncio.run(mock_schedule.call_args[0][0])
+    mock_publish.assert_awaited_once_with(67, b"\x01\x02", "binary")
 
 
 @patch("api.services.mqtt_handler.publish_cell_locate_response_async", new_callable=AsyncMock, return_value=True)
@@ -0,0 +1,145 @@
+"""
+MQTT shared-subscription integration test (requires a broker on the internal listener).
+
+The API subscribes with $share/<group>/devices/+/<suffix>, so with several replicas
+each uplink message goes to exactly one of them. Two API subscribers are started the
+way the app starts them (start_mqtt_subscriber in separate processes, so each gets its
+own replica_client_id), with ingest_location replaced by a line on stdout. Run against
+the compose broker with the internal port reachable, e.g.:
+  docker compose run --rm -p 1883:1883 ...   (or MQTT_TEST_INTERNAL_HOST=<broker>)
+  pytest tests/test_mqtt_shared_subscription.py -q
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import paho.mqtt.client as mqtt
+import pytest
+
+from api.services.mqtt_topics import device_uplink_subscriptions
+
+HOST = os.getenv("MQTT_TEST_INTERNAL_HOST", "127.0.0.1")
+PORT = int(os.getenv("MQTT_TEST_INTERNAL_PORT", "1883"))
+MESSAGES = 40
+
+# One API replica: the app's subscriber with ingest_location reporting to stdout
+_REPLICA = """
+import sys
+from api.services import mqtt_handler, mqtt_subscriber
+
+def ingest_location(device_id, body):
+    print("ingest", body["fix"], flush=True)
+    return {"latitude": 0.0, "longitude": 0.0}, []
+
+def on_connect(client, *args, _app_on_connect=mqtt_subscriber._on_connect):
+    client.on_subscribe = lambda *args: print("subscribed", flush=True)
+    _app_on_connect(client, *args)
+
+mqtt_handler.ingest_location = ingest_location
+mqtt_subscriber._on_connect = on_connect
+mqtt_subscriber.start_mqtt_subscriber()
+if not mqtt_subscriber.subscriber_running():
+    sys.exit(1)
+sys.stdin.read()
+mqtt_subscriber.stop_mqtt_subscriber()
+"""
+
+
+def _broker_available() -> bool:
+    try:
+        with socket.create_connection((HOST, PORT), timeout=2):
+            return True
+    except OSError:
+        return False
+
+
+def _start_replica(env: dict[str, str], lines: list[str], lock: threading.Lock) -> subprocess.Popen:
+    proc = subprocess.Popen(
+        [sys.executable, "-c", _REPLICA],
+        cwd=str(Path(__file__).resolve().parents[1]),
+        env=env,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+
+    def read():
+        for line in proc.stdout:
+            with lock:
+                lines.append(line.strip())
+
+    threading.Thread(target=read, daemon=True).start()
+    return proc
+
+
+def _wait(predicate, timeout: float) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+@pytest.mark.skipif(not _broker_available(), reason="MQTT internal listener not reachable")
+def test_shared_subscription_ingests_each_uplink_once():
+    run = uuid.uuid4().hex[:8]
+    prefix = f"pytest-{run}"
+    env = {
+        **os.environ,
+        "MQTT_ENABLED": "1",
+        "MQTT_HOST": HOST,
+        "MQTT_PORT": str(PORT),
+        "MQTT_TOPIC_PREFIX": prefix,
+        "MQTT_SHARED_GROUP": f"pytest-{run}",
+        "MQTT_SUBSCRIBER_CLIENT_ID": "",
+    }
+    lock = threading.Lock()
+    output: dict[str, list[str]] = {"replica-a": [], "replica-b": []}
+    replicas = [_start_replica(env, lines, lock) for lines in output.values()]
+    subscriptions = len(device_uplink_subscriptions())
+
+    def ingested() -> dict[str, list[str]]:
+        with lock:
+            return {name: [line.split()[1] for line in lines if line.startswith("ingest ")] for name, lines in output.items()}
+
+    try:
+        for name, lines in output.items():
+            assert _wait(lambda lines=lines: lines.count("subscribed") >= subscriptions, 15), f"{name} did not subscribe"
+
+        pub = mqtt.Client(
+            callback_api_version=mqtt.CallbackAPIVersion.VERSION2,
+            client_id=f"{prefix}-device",
+            protocol=mqtt.MQTTv5,
+        )
+        pub.connect(HOST, PORT, keepalive=30)
+        pub.loop_start()
+        for n in range(MESSAGES):
+            payload = json.dumps({"latitude": 0.0, "longitude": 0.0, "fix": f"fix-{n}"})
+            pub.publish(f"{prefix}/{n % 5 + 1}/location", payload, qos=1).wait_for_publish(timeout=5)
+        pub.loop_stop()
+        pub.disconnect()
+
+        _wait(lambda: sum(len(v) for v in ingested().values()) >= MESSAGES, 10)
+        time.sleep(0.5)  # catch late duplicates
+    finally:
+        for proc in replicas:
+            proc.stdin.close()  # the replica stops its subscriber and exits
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    per_replica = ingested()
+    everything = [fix for fixes in per_replica.values() for fix in fixes]
+    assert sorted(everything) == sorted(f"fix-{n}" for n in range(MESSAGES)), "lost or duplicated ingest"
+    assert all(per_replica.values()), "broker did not spread the group across both replicas"
@@ -1,5 +1,7 @@
 """Unit tests for MQTT topic helpers."""
 
+import os
+
 from api.services.mqtt_topics import (
     agnss_data_topic,
     agnss_request_topic,
@@ -11,7 +13,9 @@ from api.services.mqtt_topics import (
     location_topic,
     parse_device_id_from_topic,
     reset_ack_topic,
+    subscriber_subscriptions,
 )
+from api.services.mqtt_client import replica_client_id
 
 
 def test_device_topics_default():
@@ -40,3 +44,22 @@ def test_parse_device_id_from_topic():
     assert parse_device_id_from_topic("devices/67/location") == 67
     assert parse_device_id_from_topic("devices/abc/location") is None
     assert parse_device_id_from_topic("bad") is None
+
+
+def test_subscriber_uses_shared_subscriptions(monkeypatch):
+    monkeypatch.delenv("MQTT_SHARED_GROUP", raising=False)
+    topics = {t for t, _ in subscriber_subscriptions()}
+    assert "$share/gps-api/devices/+/location" in topics
+    assert len(topics) == len(device_uplink_subscriptions())
+
+    monkeypatch.setenv("MQTT_SHARED_GROUP", "")
+    assert {t for t, _ in subscriber_subscriptions()} == {t for t, _ in device_uplink_subscriptions()}
+
+
+def test_replica_client_id_is_unique_per_process(monkeypatch):
+    monkeypatch.delenv("MQTT_SUBSCRIBER_CLIENT_ID", raising=False)
+    client_id = replica_client_id("MQTT_SUBSCRIBER_CLIENT_ID", "gps-tracking-api-sub")
+    assert client_id.startswith("gps-tracking-api-sub-") and client_id.endswith(f"-{os.getpid()}")
+
+    monkeypatch.setenv("MQTT_SUBSCRIBER_CLIENT_ID", "fixed")
+    assert replica_client_id("MQTT_SUBSCRIBER_CLIENT_ID", "gps-tracking-api-sub") == "fixed"
@@ -0,0 +1,119 @@
+"""Unit tests for the sharded MQTT uplink worker pool (no broker or DB)."""
+
+from __future__ import annotations
+
+import threading
+import time
+from types import SimpleNamespace
+
+from api.services import mqtt_subscriber
+from api.services.admission import AdmissionController
+from api.services.mqtt_workers import ShardedWorkerPool
+
+
+def test_per_device_order_is_kept_across_workers():
+    pool = ShardedWorkerPool("test", workers=4, queue_max=100)
+    pool.start()
+    seen: dict[int, list[int]] = {}
+    lock = threading.Lock()
+
+    def handle(device_id, n):
+        time.sleep(0.001 * (n % 3))
+        with lock:
+            seen.setdefault(device_id, []).append(n)
+
+    for n in range(30):
+        for device_id in (1, 2, 3, 7):
+            assert pool.submit(device_id, lambda d=device_id, n=n: handle(d, n))
+    pool.stop()
+
+    assert all(order == list(range(30)) for order in seen.values())
+    stats = pool.stats()
+    assert stats["processed"] == 120 and stats["failed"] == 0 and stats["queued"] == 0
+
+
+def test_full_shard_rejects_without_blocking():
+    pool = ShardedWorkerPool("test", workers=1, queue_max=1)
+    pool.start()
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(2)
+
+    assert pool.submit(1, slow)
+    assert started.wait(2)
+    assert pool.submit(1, lambda: None)  # fills the queue
+    assert not pool.submit(1, lambda: None)
+    assert pool.stats()["rejected"] == 1 and pool.stats()["busy"] == 1
+    release.set()
+    pool.stop()
+
+
+def test_qos1_message_acked_only_after_handling(monkeypatch):
+    pool = ShardedWorkerPool("test", workers=2, queue_max=10)
+    pool.start()
+    monkeypatch.setattr(mqtt_subscriber, "_workers", pool)
+    monkeypatch.setattr(
+        mqtt_subscriber,
+        "mqtt_uplink_admission",
+        AdmissionController("test", rate=0, burst=0, max_concurrent=0, retry_min_sec=0, retry_spread_sec=0),
+    )
+    events: list[str] = []
+    acked = threading.Event()
+
+    def fake_handle(topic, payload):
+        events.append("handled")
+
+    class FakeClient:
+        def ack(self, mid, qos):
+            events.append(f"ack {mid}")
+            acked.set()
+
+    monkeypatch.setattr(mqtt_subscriber, "handle_mqtt_message", fake_handle)
+    msg = SimpleNamespace(topic="devices/67/location", payload=b"{}", mid=42, qos=1)
+    mqtt_subscriber._on_message(FakeClient(), None, msg)
+
+    assert acked.wait(2)
+    assert events == ["handled", "ack 42"]
+    pool.stop()
+
+
+def test_message_for_a_full_shard_is_left_unacked_without_blocking(monkeypatch):
+    pool = ShardedWorkerPool("test", workers=1, queue_max=1)
+    pool.start()
+    monkeypatch.setattr(mqtt_subscriber, "_workers", pool)
+    unacked_before = mqtt_subscriber.worker_stats()["overflow_unacked"]
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(2)
+
+    assert pool.submit(1, slow)
+    assert started.wait(2)
+    assert pool.submit(1, lambda: None)  # fills the queue
+    acked: list[int] = []
+
+    class FakeClient:
+        def ack(self, mid, qos):
+            acked.append(mid)
+
+    msg = SimpleNamespace(topic="devices/1/location", payload=b"{}", mid=7, qos=1)
+    began = time.monotonic()
+    mqtt_subscriber._on_message(FakeClient(), None, msg)
+    assert time.monotonic() - began < 0.5  # the network thread is never held
+    assert mqtt_subscriber.worker_stats()["overflow_unacked"] == unacked_before + 1
+    release.set()
+    pool.stop()
+    assert acked == []  # the broker keeps it in flight instead of losing it
+
+
+def test_receive_maximum_fits_in_one_shard(monkeypatch):
+    monkeypatch.setattr(mqtt_subscriber, "_workers", ShardedWorkerPool("test", workers=2, queue_max=50))
+    monkeypatch.setattr(mqtt_subscriber, "_RECEIVE_MAXIMUM", 100)
+    assert mqtt_subscriber._connect_properties().ReceiveMaximum == 50
+    monkeypatch.setattr(mqtt_subscriber, "_RECEIVE_MAXIMUM", 20)
+    assert mqtt_subscriber._connect_properties().ReceiveMaximum == 20
@@ -0,0 +1,129 @@
+"""Tests for the P-GPS prediction set cache and per-request slicing."""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.agnss import fanout_cache, pgps
+from api.agnss.cache_store import BlobStore
+from api.agnss.fanout_cache import AgnssFanoutCache
+from api.endpoints.buffer_response import BufferListResponse
+from api.services import agnss_fetch
+from api.services.assistance_prefetch import AssistancePrefetcher
+
+PREDICTION_SIZE = 16
+
+
+def _pgps_file(count: int, period: int, gps_day: int, gps_time_of_day: int) -> bytes:
+    predictions = b"".join(bytes([i]) * PREDICTION_SIZE for i in range(count))
+    return pgps.HEADER.pack(1, 0, 1, count, period, gps_day, gps_time_of_day) + predictions
+
+
+def _join(buffers) -> bytes:
+    return b"".join(bytes(b) for b in buffers)
+
+
+@pytest.fixture
+def upstream(monkeypatch, tmp_path):
+    monkeypatch.setattr(fanout_cache, "_fanout_cache", AgnssFanoutCache(BlobStore(str(tmp_path)), ttl_sec=60))
+    monkeypatch.setattr("api.services.assistance_prefetch.prefetcher", AssistancePrefetcher(region_loader=None))
+    calls = []
+
+    async def fake_pgps(count, period, gps_day, gps_time_of_day):
+        calls.append((count, period, gps_day, gps_time_of_day))
+        return _pgps_file(count, period, gps_day, gps_time_of_day)
+
+    monkeypatch.setattr(agnss_fetch, "request_pgps_from_nrf_cloud", fake_pgps)
+    return calls
+
+
+def test_slice_rewrites_the_header_and_views_the_stored_set():
+    data = _pgps_file(8, 120, 2300, 7200)
+    header = pgps.parse_header(data)
+    assert header.prediction_count == 8 and header.start_gps_sec == 2300 * 86400 + 7200
+
+    head, body = pgps.slice_predictions(data, header, 6, 2)
+    assert pgps.parse_header(head + bytes(body)) == header._replace(prediction_count=2, gps_day=2300, gps_time_of_day=50400)
+    assert bytes(body) == bytes([6]) * PREDICTION_SIZE + bytes([7]) * PREDICTION_SIZE
+    assert body.obj is data  # not copied
+    assert pgps.slice_predictions(data, header, 7, 2) is None
+
+    # Crossing midnight moves the GPS day on
+    late = _pgps_file(4, 240, 10, 72000)
+    head, _ = pgps.slice_predictions(late, pgps.parse_header(late), 1, 2)
+    assert pgps.HEADER.unpack(head)[5:] == (11, 0)
+    assert pgps.parse_header(b"\x01" * 20) is None and pgps.full_set_count(240) == 42 and pgps.full_set_count(150) == 66
+
+
+def test_every_count_is_cut_from_one_download(upstream):
+    async def run():
+        return [await agnss_fetch.fetch_pgps_bytes(count, 120) for count in (8, 42, 84, 8)]
+
+    results = asyncio.run(run())
+    assert len(upstream) == 1
+    count, period, gps_day, gps_time_of_day = upstream[0]
+    assert (count, period) == (84, 120) and (gps_day * 86400 + gps_time_of_day) % 7200 == 0
+    assert [source for _, source in results] == ["nRF Cloud", "nRF Cloud cache", "nRF Cloud cache", "nRF Cloud cache"]
+    for (buffers, _), count in zip(results, (8, 42, 84, 8)):
+        header = pgps.parse_header(_join(buffers))
+        assert header.prediction_count == count and (header.gps_day, header.gps_time_of_day) == (gps_day, gps_time_of_day)
+    assert _join(results[0][0]) == _pgps_file(8, 120, gps_day, gps_time_of_day)
+
+
+def test_explicit_starts(upstream):
+    set_day, set_tod = 2300, 14400
+
+    async def run():
+        aligned, _ = await agnss_fetch.fetch_pgps_bytes(4, 240, set_day, set_tod)
+        # Not on a 4 h boundary: fetched as asked
+        odd, _ = await agnss_fetch.fetch_pgps_bytes(4, 240, set_day, set_tod + 60)
+        return aligned, odd
+
+    aligned, odd = asyncio.run(run())
+    assert upstream == [(42, 240, set_day, set_tod), (4, 240, set_day, set_tod + 60)]
+    assert _join(aligned) == _pgps_file(4, 240, set_day, set_tod)
+    assert _join(odd) == _pgps_file(4, 240, set_day, set_tod + 60)
+
+
+def test_unusable_sets_fall_back_to_a_direct_fetch(upstream, monkeypatch):
+    async def garbled(count, period, gps_day, gps_time_of_day):
+        upstream.append((count, period))
+        return b"not a pgps file"
+
+    monkeypatch.setattr(agnss_fetch, "request_pgps_from_nrf_cloud", garbled)
+    buffers, source = asyncio.run(agnss_fetch.fetch_pgps_bytes(8, 240))
+    assert _join(buffers) == b"not a pgps file" and source == "nRF Cloud"
+    assert upstream == [(42, 240), (8, 240)]
+
+
+def test_prefetch_warms_the_set_for_the_period(upstream):
+    prefetcher = AssistancePrefetcher(region_loader=None, lead_sec=0)
+    prefetcher.note_pgps_request(8, 120)
+    prefetcher.note_pgps_request(42, 120)
+    assert prefetcher.stats()["pgps_targets"] == 1
+
+    async def run():
+        assert await prefetcher.tick() == {"refreshed": 1, "warm": 0, "failed": 0}
+        return await agnss_fetch.fetch_pgps_bytes(42, 120)
+
+    buffers, source = asyncio.run(run())
+    assert source == "nRF Cloud cache" and len(upstream) == 1
+    assert pgps.parse_header(_join(buffers)).prediction_count == 42
+
+
+def test_buffer_list_response_sends_every_buffer():
+    data = _pgps_file(4, 120, 1, 0)
+    app = FastAPI()
+
+    @app.get("/pgps")
+    async def endpoint():
+        return BufferListResponse([b"head", memoryview(data)[pgps.HEADER.size :]], headers={"X-PGPS-Source": "test"})
+
+    response = TestClient(app).get("/pgps")
+    assert response.content == b"head" + data[pgps.HEADER.size :]
+    assert response.headers["content-length"] == str(len(response.content))
+    assert response.headers["content-type"] == "application/octet-stream"
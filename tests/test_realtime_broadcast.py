@@ -0,0 +1,74 @@
+"""Unit tests for WebSocket room broadcasts (no server or DB)."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+from api.websocket_manager import ConnectionManager, encode_message
+
+
+class _FakeWebSocket:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.frames: list[str] = []
+
+    async def accept(self):
+        return None
+
+    async def send_text(self, data: str):
+        if self.fail:
+            raise RuntimeError("socket closed")
+        self.frames.append(data)
+
+    async def send_json(self, data):
+        raise AssertionError("broadcasts must send a pre-encoded frame")
+
+
+def _room_with(manager: ConnectionManager, room: str, sockets: list[_FakeWebSocket]) -> None:
+    async def _join():
+        for ws in sockets:
+            await manager.connect(room, ws)
+
+    asyncio.run(_join())
+
+
+def test_encode_message_is_compact_json():
+    frame = encode_message({"type": "location_update", "device_id": 67, "data": {"latitude": -33.86}})
+    assert json.loads(frame) == {"type": "location_update", "device_id": 67, "data": {"latitude": -33.86}}
+    assert ", " not in frame and ": " not in frame
+
+
+def test_broadcast_to_room_shares_one_frame():
+    manager = ConnectionManager()
+    sockets = [_FakeWebSocket() for _ in range(10)]
+    _room_with(manager, "user_device_67", sockets)
+
+    count = asyncio.run(manager.broadcast_to_room("user_device_67", {"type": "location_update", "device_id": 67}))
+
+    assert count == 10
+    first = sockets[0].frames[0]
+    assert all(ws.frames[0] is first for ws in sockets)
+
+
+def test_broadcast_to_room_drops_failed_sockets():
+    manager = ConnectionManager()
+    good, bad = _FakeWebSocket(), _FakeWebSocket(fail=True)
+    _room_with(manager, "user_device_67", [good, bad])
+
+    count = asyncio.run(manager.broadcast_to_room("user_device_67", {"type": "ping"}))
+
+    assert count == 1
+    assert manager.active_connections["user_device_67"] == {good}
+
+
+def test_broadcast_except_skips_sender():
+    manager = ConnectionManager()
+    sender, listener = _FakeWebSocket(), _FakeWebSocket()
+    _room_with(manager, "device_67", [sender, listener])
+
+    count = asyncio.run(manager.broadcast_except("device_67", {"type": "ping"}, sender))
+
+    assert count == 1
+    assert sender.frames == []
+    assert len(listener.frames) == 1
@@ -0,0 +1,162 @@
+"""Tests for single-flight coalescing and the upstream paths that use it."""
+
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from api.agnss import fanout_cache
+from api.agnss.fanout_cache import AgnssFanoutCache
+from api.endpoints.cell_location import CellInfo, CellLocationResponse
+from api.services import agnss_fetch, cell_locate_service, cell_location_cache
+from api.services.assistance_prefetch import AssistancePrefetcher
+from api.services.cell_location_cache import CellLocationCache
+from api.services.single_flight import SingleFlight
+
+N = 20
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return b"blob"
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("k", upstream) for _ in range(N)))
+        assert len(flight) == 0
+        # Finished calls are not cached
+        await flight.do("k", upstream)
+        return results
+
+    results = asyncio.run(run())
+    assert len(calls) == 2
+    assert all(data == b"blob" for data, _ in results)
+    assert [shared for _, shared in results].count(False) == 1
+    assert flight.stats() == {"executions": 2, "coalesced": N - 1, "in_flight": 0}
+
+
+def test_failures_are_shared():
+    flight = SingleFlight()
+
+    async def upstream():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        return await asyncio.gather(*(flight.do("k", upstream) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results) and flight.executions == 1
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+    finished = []
+
+    async def upstream():
+        await asyncio.sleep(0.05)
+        finished.append(1)
+        return 42
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("k", upstream))
+        second = asyncio.ensure_future(flight.do("k", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == (42, True)
+        assert first.cancelled()
+
+        # Once every caller has gone the call itself is cancelled
+        only = asyncio.ensure_future(flight.do("j", upstream))
+        await asyncio.sleep(0.01)
+        only.cancel()
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert finished == [1]
+
+
+def test_pgps_downloads_are_coalesced(monkeypatch):
+    calls = []
+
+    async def download(*args):
+        calls.append(args)
+        await asyncio.sleep(0.01)
+        return b"pgps"
+
+    monkeypatch.setattr(agnss_fetch, "_download_pgps", download)
+
+    async def run():
+        return await asyncio.gather(*(agnss_fetch.request_pgps_from_nrf_cloud(42, 240) for _ in range(N)))
+
+    assert asyncio.run(run()) == [b"pgps"] * N
+    assert calls == [(42, 240, None, None)]
+
+
+def test_agnss_fetches_are_coalesced(monkeypatch):
+    monkeypatch.setattr(fanout_cache, "_fanout_cache", AgnssFanoutCache(store=None, ttl_sec=60))
+    monkeypatch.setenv("AGNSS_PROVIDER", "NRF_CLOUD")
+    monkeypatch.setattr(agnss_fetch, "auth_bearer_token", lambda: "key")
+    monkeypatch.setattr("api.services.assistance_prefetch.prefetcher", AssistancePrefetcher(region_loader=None))
+    calls = []
+
+    async def upstream(device_id, api_key, body, sink=None):
+        calls.append(device_id)
+        await asyncio.sleep(0.01)
+        return b"eph"
+
+    monkeypatch.setattr(agnss_fetch, "_fetch_nrf_cloud", upstream)
+
+    async def run():
+        return await asyncio.gather(
+            *(agnss_fetch.fetch_agnss_bytes(d, mcc=505, mnc=1, tac=100, eci=d) for d in range(N))
+        )
+
+    results = asyncio.run(run())
+    assert len(calls) == 1 and all(data == b"eph" for data, _ in results)
+    assert [source for _, source in results].count("nRF Cloud") == 1
+
+
+def test_cell_lookups_are_coalesced(monkeypatch):
+    monkeypatch.delenv("DATABASE_URI", raising=False)
+    monkeypatch.setattr(cell_location_cache, "_cell_location_cache", CellLocationCache(ttl_sec=60))
+    calls = []
+
+    async def providers(cells):
+        calls.append(len(cells))
+        await asyncio.sleep(0.01)
+        return CellLocationResponse(latitude=1.0, longitude=2.0, accuracy=500, source="google")
+
+    monkeypatch.setattr(cell_locate_service, "_query_providers", providers)
+    cells = [CellInfo(cellId=7, mcc=505, mnc=1, lac=100, tac=100, signal=-90)]
+
+    async def run():
+        return await asyncio.gather(*(cell_locate_service.resolve_cell_location(cells) for _ in range(N)))
+
+    results = asyncio.run(run())
+    assert calls == [1] and {r.source for r in results} == {"google"}
+    # One provider answer learned, not one per waiting caller
+    assert cell_location_cache.get_cell_location_cache().stats()["learned_from_provider"] == 1
+
+
+@pytest.mark.parametrize("prefetch", [False, True])
+def test_fanout_counters_with_single_flight(prefetch):
+    cache = AgnssFanoutCache(store=None, ttl_sec=60)
+
+    async def upstream():
+        await asyncio.sleep(0.01)
+        return b"x"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_fetch("k", upstream, prefetch=prefetch) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert [from_cache for _, from_cache in results].count(False) == 1
+    stats = cache.stats()
+    assert stats["in_flight"] == 0
+    assert (stats["prefetched"], stats["upstream_fetches"], stats["coalesced"]) == ((1, 0, 0) if prefetch else (0, 1, 4))
@@ -0,0 +1,168 @@
+"""Tests for the asyncio SUPL client against local fake SUPL servers."""
+
+from __future__ import annotations
+
+import asyncio
+import shutil
+import ssl
+import subprocess
+import time
+
+import pytest
+
+from api.agnss import supl_client
+from api.agnss.supl_client import SUPLClient, SuplServer
+from api.services.provider_health import OPEN, ProviderHealthRegistry
+
+PAYLOAD = bytes([0x60]) + bytes(range(150))
+
+
+async def _serve_supl(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, served: list) -> None:
+    """Minimal SUPL server: read START, answer RESPONSE then one assistance data message."""
+    try:
+        length = (await reader.readexactly(1))[0]
+        start = await reader.readexactly(length)
+        served.append(start[0] >> 4)
+        writer.write(bytes([1, 0x10]) + bytes([0x80 | (len(PAYLOAD) >> 8), len(PAYLOAD) & 0xFF]) + PAYLOAD)
+        await writer.drain()
+        # The client ends the session once it has the data
+        await reader.readexactly(2)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def _silent(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """Accepts the connection and never answers."""
+    await reader.read()
+    writer.close()
+
+
+@pytest.fixture(autouse=True)
+def fresh_state(monkeypatch):
+    monkeypatch.setattr(supl_client, "supl_health", ProviderHealthRegistry("SUPL"))
+    monkeypatch.setattr(supl_client, "_supl_stats", {"raced": 0, "tls_handshakes": 0, "tls_resumed": 0})
+    monkeypatch.setattr(supl_client, "_tls_contexts", {})
+    monkeypatch.setenv("SUPL_RACE_DELAY_MS", "50")
+
+
+async def _start(handler, **kwargs):
+    server = await asyncio.start_server(handler, "127.0.0.1", 0, **kwargs)
+    return server, SuplServer("127.0.0.1", server.sockets[0].getsockname()[1], "ssl" in kwargs)
+
+
+def test_fetches_assistance_data_from_a_fake_server():
+    served = []
+
+    async def run():
+        server, address = await _start(lambda r, w: _serve_supl(r, w, served))
+        async with server:
+            return await SUPLClient(7, servers=[address]).fetch_assistance_data(-27.5, 153.0)
+
+    assert asyncio.run(run()) == PAYLOAD
+    assert served == [supl_client.ULPD_MSG_TYPE_SUPLSTART]
+    stats = supl_client.supl_stats()["servers"]
+    assert list(stats.values())[0]["calls"] == 1 and list(stats.values())[0]["failures"] == 0
+
+
+def test_slow_dial_is_raced_and_the_loser_abandoned(monkeypatch):
+    served = []
+    real_open = supl_client._open_connection
+    slow_port = []
+
+    async def open_connection(server):
+        if server.port in slow_port:
+            await asyncio.sleep(5)
+        return await real_open(server)
+
+    monkeypatch.setattr(supl_client, "_open_connection", open_connection)
+
+    async def run():
+        slow, slow_address = await _start(lambda r, w: _serve_supl(r, w, served))
+        fast, fast_address = await _start(lambda r, w: _serve_supl(r, w, served))
+        slow_port.append(slow_address.port)
+        async with slow, fast:
+            began = time.monotonic()
+            data = await SUPLClient(7, servers=[slow_address, fast_address]).fetch_assistance_data()
+            return data, time.monotonic() - began, slow_address, fast_address
+
+    data, elapsed, slow_address, fast_address = asyncio.run(run())
+    assert data == PAYLOAD and elapsed < 1.0 and served == [0]
+    stats = supl_client.supl_stats()
+    assert stats["raced"] == 1
+    # An abandoned dial is neither a sample nor a failure
+    assert stats["servers"][slow_address.name]["calls"] == 0
+    assert stats["servers"][fast_address.name]["calls"] == 1
+
+
+def test_dead_and_silent_servers_fall_through(monkeypatch):
+    served = []
+
+    async def run():
+        silent, silent_address = await _start(_silent)
+        good, good_address = await _start(lambda r, w: _serve_supl(r, w, served))
+        dead = SuplServer("127.0.0.1", 1)
+        async with silent, good:
+            client = SUPLClient(7, timeout=0.2, servers=[dead, silent_address, good_address])
+            return await client.fetch_assistance_data(), silent_address, good_address
+
+    data, silent_address, good_address = asyncio.run(run())
+    assert data == PAYLOAD
+    stats = supl_client.supl_stats()["servers"]
+    assert stats["127.0.0.1:1"]["failures"] == 1 and stats[silent_address.name]["failures"] == 1
+    assert stats[good_address.name]["failures"] == 0
+
+    # Failed servers now rank behind the one that answered
+    ranked = sorted([SuplServer("127.0.0.1", 1), silent_address, good_address], key=supl_client._rank)
+    assert ranked[0] == good_address
+
+
+def test_open_breaker_is_skipped(monkeypatch):
+    monkeypatch.setenv("SUPL_BREAKER_FAILURES", "1")
+    served = []
+
+    async def run():
+        good, address = await _start(lambda r, w: _serve_supl(r, w, served))
+        async with good:
+            supl_client.supl_health.get(address.name).record(10, ok=False)
+            return await SUPLClient(7, servers=[address]).fetch_assistance_data()
+
+    assert asyncio.run(run()) is None and served == []
+    assert [h["state"] for h in supl_client.supl_stats()["servers"].values()] == [OPEN]
+
+
+def test_configured_servers(monkeypatch):
+    monkeypatch.setenv("SUPL_SERVERS", "supl.google.com:7275:tls, 10.0.0.1:7276, [::1]:7275, junk")
+    assert SUPLClient.configured_servers() == [
+        SuplServer("supl.google.com", 7275, True),
+        SuplServer("10.0.0.1", 7276),
+        SuplServer("::1", 7275),
+    ]
+    monkeypatch.delenv("SUPL_SERVERS")
+    assert SUPLClient.configured_servers()[0] == SuplServer("74.125.68.192", 7276)
+
+
+@pytest.mark.skipif(shutil.which("openssl") is None, reason="openssl CLI needed to make a test certificate")
+def test_tls_sessions_are_resumed(tmp_path, monkeypatch):
+    cert, key = tmp_path / "cert.pem", tmp_path / "key.pem"
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=127.0.0.1",
+         "-addext", "subjectAltName=IP:127.0.0.1", "-keyout", str(key), "-out", str(cert)],
+        check=True,
+        capture_output=True,
+    )
+    monkeypatch.setenv("SUPL_TLS_CA_FILE", str(cert))
+    server_context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    server_context.load_cert_chain(str(cert), str(key))
+    served = []
+
+    async def run():
+        server, address = await _start(lambda r, w: _serve_supl(r, w, served), ssl=server_context)
+        async with server:
+            client = SUPLClient(7, servers=[address])
+            return [await client.fetch_assistance_data() for _ in range(3)]
+
+    assert asyncio.run(run()) == [PAYLOAD] * 3
+    stats = supl_client.supl_stats()
+    assert stats["tls_handshakes"] == 3 and stats["tls_resumed"] == 2
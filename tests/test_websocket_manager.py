@@ -0,0 +1,83 @@
+"""Unit tests for the indexed WebSocket connection registry (no server or DB)."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+
+from api.websocket_manager import ConnectionManager, parse_room
+
+
+class _FakeWebSocket:
+    async def accept(self):
+        return None
+
+    async def send_text(self, data: str):
+        return None
+
+
+def test_parse_room():
+    assert parse_room("user_device_67") == ("user_device", 67)
+    assert parse_room("device_1") == ("device", 1)
+    assert parse_room("geofence_42") == ("geofence", 42)
+    assert parse_room("lobby") == ("lobby", None)
+
+
+def test_indexes_follow_joins_and_disconnects():
+    async def run():
+        manager = ConnectionManager()
+        tracker, viewer = _FakeWebSocket(), _FakeWebSocket()
+        await manager.connect("device_67", tracker, {"device_id": 67, "type": "device"})
+        await manager.connect("user_device_67", viewer, {"device_id": 67, "type": "user", "user_id": 5})
+        manager.join("geofence_67", viewer, {"device_id": 67, "type": "geofence_subscriber", "user_id": 5})
+        manager.join("user_device_68", viewer, {"device_id": 68, "type": "user", "user_id": 5})
+
+        assert manager.rooms_for_device(67) == {"device_67", "user_device_67", "geofence_67"}
+        assert manager.sockets_for_user(5) == {viewer}
+        assert manager.get_connected_users() == {5}
+        stats = manager.stats()
+        assert stats["sockets"] == 2 and stats["rooms"] == 4 and stats["memberships"] == 4
+        assert stats["devices"] == 2 and stats["users"] == 1
+        assert stats["by_room_type"]["user_device"] == {"rooms": 2, "connections": 2}
+
+        # Joining a room twice does not double count
+        manager.join("user_device_68", viewer, {"user_id": 5})
+        assert manager.stats()["memberships"] == 4
+
+        await manager.disconnect_all(viewer)
+        assert manager.rooms_for_device(67) == {"device_67"}
+        assert manager.rooms_for_device(68) == set()
+        assert not manager.has_active_connection(5)
+        assert manager.stats() == {
+            "sockets": 1,
+            "rooms": 1,
+            "memberships": 1,
+            "devices": 1,
+            "users": 0,
+            "by_room_type": {"device": {"rooms": 1, "connections": 1}},
+        }
+
+    asyncio.run(run())
+
+
+def test_registry_consistent_under_concurrent_threads():
+    manager = ConnectionManager()
+    sockets = [_FakeWebSocket() for _ in range(200)]
+
+    def churn(chunk):
+        for i, ws in enumerate(chunk):
+            room = f"user_device_{i % 7}"
+            manager.join(room, ws, {"user_id": i % 3})
+            asyncio.run(manager.disconnect(room, ws))
+            manager.join(room, ws, {"user_id": i % 3})
+
+    threads = [threading.Thread(target=churn, args=(sockets[n::4],)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    stats = manager.stats()
+    assert stats["sockets"] == 200 and stats["memberships"] == 200
+    assert sum(manager.room_size(f"user_device_{i}") for i in range(7)) == 200
+    assert sum(len(manager.sockets_for_user(u)) for u in range(3)) == 200
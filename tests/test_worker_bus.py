@@ -0,0 +1,210 @@
+"""Tests for multi-worker mode: leader lock, cross-worker broadcasts and shared A-GNSS fills."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+from api.agnss.cache_store import BlobStore
+from api.agnss.fanout_cache import AgnssFanoutCache
+from api.services.worker_bus import WorkerBus
+from api.services.worker_leader import LeaderElection
+from api.websocket_manager import ConnectionManager
+
+
+class _FakeWebSocket:
+    def __init__(self):
+        self.frames: list[str] = []
+
+    async def accept(self):
+        return None
+
+    async def send_text(self, data: str):
+        self.frames.append(data)
+
+
+async def _until(predicate, timeout: float = 2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+def test_one_leader_and_takeover(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    first, second = LeaderElection(path, retry_sec=0.01), LeaderElection(path, retry_sec=0.01)
+    assert first.try_acquire() and first.is_leader
+    assert not second.try_acquire()
+
+    async def run():
+        elected = asyncio.Event()
+
+        async def on_elected():
+            elected.set()
+
+        second.start(on_elected)
+        await asyncio.sleep(0.05)
+        assert not elected.is_set()
+        first.release()  # the leader worker exits
+        await asyncio.wait_for(elected.wait(), 1)
+        await second.stop()
+
+    asyncio.run(run())
+    assert second.try_acquire()
+    second.release()
+
+
+def test_broadcasts_reach_sockets_in_every_worker(tmp_path):
+    path = str(tmp_path / "bus.sock")
+    managers = [ConnectionManager() for _ in range(3)]
+    buses = [WorkerBus(manager, path=path, retry_sec=0.01) for manager in managers]
+    for manager, bus in zip(managers, buses):
+        manager.bus = bus
+    viewer, device = _FakeWebSocket(), _FakeWebSocket()
+
+    async def run():
+        hub, sender, other = buses
+        await hub.serve()
+        sender.start()
+        other.start()
+        await _until(lambda: len(hub._peers) == 2)
+        managers[2].join("user_device_67", viewer)
+        managers[0].join("device_67", device)
+
+        counts = await managers[1].publish(["device_67", "user_device_67"], {"type": "control", "device_id": 67})
+        assert counts == [0, 0]  # nothing listening in the sending worker
+        await managers[2].broadcast_to_room("user_device_67", {"type": "location_update", "device_id": 67})
+        await managers[0].broadcast_to_room("user_device_67", {"type": "power", "device_id": 67})
+        await _until(lambda: len(viewer.frames) == 3)
+
+        for bus in buses:
+            await bus.stop()
+
+    asyncio.run(run())
+    assert len(device.frames) == 1
+    seqs = [json.loads(frame)["seq"] for frame in viewer.frames]
+    assert seqs == sorted(seqs) and len(set(seqs)) == 3
+    # Every worker keeps the same history, so a viewer can resume on any of them
+    for manager in managers:
+        frames, _ = manager.replay.since(67, 0, ["user_device_67"])
+        assert frames == viewer.frames
+        assert manager.replay.last_seq(67) == seqs[-1]
+
+
+def test_without_a_hub_broadcasts_stay_local(tmp_path):
+    manager = ConnectionManager()
+    bus = WorkerBus(manager, path=str(tmp_path / "missing.sock"), retry_sec=0.01)
+    manager.bus = bus
+    viewer = _FakeWebSocket()
+    manager.join("user_device_67", viewer)
+
+    async def run():
+        bus.start()
+        await asyncio.sleep(0.03)
+        counts = await manager.publish(["user_device_67"], {"type": "ping", "device_id": 67})
+        await bus.stop()
+        return counts
+
+    assert asyncio.run(run()) == [1]
+    assert bus.stats()["local_only"] == 1 and len(viewer.frames) == 1
+
+
+def test_repeat_after_resends_to_the_first_room():
+    manager = ConnectionManager()
+    device, viewer = _FakeWebSocket(), _FakeWebSocket()
+    manager.join("device_67", device)
+    manager.join("user_device_67", viewer)
+
+    async def run():
+        await manager.publish(["device_67", "user_device_67"], {"type": "control", "device_id": 67}, repeat_after=0.01)
+        await asyncio.sleep(0.05)
+
+    asyncio.run(run())
+    assert len(device.frames) == 2 and device.frames[0] == device.frames[1]
+    assert len(viewer.frames) == 1
+
+
+def test_workers_share_one_upstream_fill(tmp_path):
+    # Separate stores on one directory behave like two worker processes
+    workers = [AgnssFanoutCache(BlobStore(str(tmp_path)), ttl_sec=60) for _ in range(2)]
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return b"eph"
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_fetch("NRF_CLOUD|global|1", upstream) for cache in workers))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert sorted(bytes(data) for data, _ in results) == [b"eph", b"eph"]
+    assert sum(cache.stats()["filled_by_other_worker"] for cache in workers) == 1
+
+
+def test_failed_leader_startup_releases_the_lock(tmp_path):
+    path = str(tmp_path / "leader.lock")
+    election, rival = LeaderElection(path, retry_sec=0.2), LeaderElection(path, retry_sec=0.2)
+    attempts = []
+
+    async def run():
+        elected = asyncio.Event()
+
+        async def on_elected():
+            attempts.append(election.is_leader)
+            if len(attempts) == 1:
+                raise OSError("bus socket unavailable")
+            elected.set()
+
+        election.start(on_elected)
+        # Between the failed attempt and the retry another worker can take over
+        await _until(lambda: attempts and not election.is_leader)
+        assert rival.try_acquire()
+        rival.release()
+        await asyncio.wait_for(elected.wait(), 1)
+        assert election.is_leader
+        await election.stop()
+
+    asyncio.run(run())
+    assert attempts == [True, True]
+
+
+def test_notices_reach_the_other_workers(tmp_path):
+    path = str(tmp_path / "bus.sock")
+    buses = [WorkerBus(ConnectionManager(), path=path, retry_sec=0.01) for _ in range(3)]
+    received: list[list] = [[], [], []]
+    for bus, seen in zip(buses, received):
+        bus.subscribe("device_access", seen.append)
+
+    async def run():
+        hub, sender, other = buses
+        await hub.serve()
+        sender.start()
+        other.start()
+        await _until(lambda: len(hub._peers) == 2 and sender.connected and other.connected)
+        sender.notify("device_access", 42)
+        await _until(lambda: received[0] and received[2])
+        hub.notify("device_access", None)
+        await _until(lambda: len(received[1]) == 1 and len(received[2]) == 2)
+        for bus in buses:
+            await bus.stop()
+
+    asyncio.run(run())
+    assert received == [[42], [None], [42, None]]
+
+
+def test_access_invalidation_is_sent_to_the_other_workers(monkeypatch):
+    from api.services import device_access
+
+    sent = []
+    monkeypatch.setattr(device_access.worker_bus, "notify", lambda topic, payload=None: sent.append((topic, payload)))
+    monkeypatch.setitem(device_access._cache, 7, (float("inf"), frozenset({67})))
+    monkeypatch.setitem(device_access._cache, 8, (float("inf"), frozenset({68})))
+
+    device_access.invalidate_user_devices(7)
+    assert sent == [("device_access", 7)] and 7 not in device_access._cache
+
+    # Another worker's invalidation arrives as a notice
+    device_access.worker_bus._handlers["device_access"](8)
+    assert 8 not in device_access._cache
@@ -0,0 +1,102 @@
+"""Unit tests for per-subscription location delivery policies (no server or DB)."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+import pytest
+
+from api.services.ws_delivery import DEFER, DROP, SEND, DeliveryPolicy, DeliveryState
+from api.websocket_manager import ConnectionManager
+
+
+class _FakeWebSocket:
+    def __init__(self):
+        self.frames: list[str] = []
+
+    async def accept(self):
+        return None
+
+    async def send_text(self, data: str):
+        self.frames.append(data)
+
+
+def _location(lat: float, lon: float = 151.2) -> dict:
+    return {"type": "location_update", "device_id": 67, "data": {"latitude": lat, "longitude": lon}}
+
+
+def test_policy_from_dict():
+    assert DeliveryPolicy.from_dict(None) is None
+    assert DeliveryPolicy.from_dict({"coalesce": False}) is None
+    policy = DeliveryPolicy.from_dict({"max_hz": 2, "min_distance_m": "10", "coalesce": "false"})
+    assert policy == DeliveryPolicy(max_hz=2.0, min_distance_m=10.0, coalesce=False)
+    assert policy.min_interval_sec == 0.5
+    with pytest.raises(ValueError):
+        DeliveryPolicy.from_dict({"max_hz": 0})
+    with pytest.raises(ValueError):
+        DeliveryPolicy.from_dict({"min_distance_m": "far"})
+
+
+def test_state_rate_limit_and_coalesce():
+    state = DeliveryState(DeliveryPolicy(max_hz=1))
+    assert state.offer("a", (0.0, 0.0), now=10.0) == SEND
+    assert state.offer("b", (0.0, 0.0), now=10.2) == DEFER
+    assert state.offer("c", (0.0, 0.0), now=10.4) == DEFER
+    assert state.pending_frame == "c"
+    assert state.next_send_at() == 11.0
+    assert state.offer("d", (0.0, 0.0), now=11.0) == SEND
+
+
+def test_state_rate_limit_without_coalesce_drops():
+    state = DeliveryState(DeliveryPolicy(max_hz=1, coalesce=False))
+    assert state.offer("a", (0.0, 0.0), now=10.0) == SEND
+    assert state.offer("b", (0.0, 0.0), now=10.5) == DROP
+    assert state.pending_frame is None
+
+
+def test_state_min_distance():
+    state = DeliveryState(DeliveryPolicy(min_distance_m=50))
+    assert state.offer("a", (-33.8600, 151.2000), now=0.0) == SEND
+    # ~11 m north: below threshold
+    assert state.offer("b", (-33.8599, 151.2000), now=1.0) == DROP
+    # ~111 m north of the last *sent* point
+    assert state.offer("c", (-33.8590, 151.2000), now=2.0) == SEND
+
+
+def test_manager_coalesces_latest_location():
+    async def _run():
+        manager = ConnectionManager()
+        shaped, unshaped = _FakeWebSocket(), _FakeWebSocket()
+        await manager.connect("user_device_67", shaped, policy=DeliveryPolicy(max_hz=20))
+        await manager.connect("user_device_67", unshaped)
+
+        for i in range(5):
+            await manager.broadcast_to_room("user_device_67", _location(-33.0 - i))
+        # Non-location messages bypass the policy
+        await manager.broadcast_to_room("user_device_67", {"type": "control_applied", "device_id": 67})
+        await asyncio.sleep(0.1)
+        return shaped, unshaped
+
+    shaped, unshaped = asyncio.run(_run())
+
+    assert len(unshaped.frames) == 6
+    types = [json.loads(f)["type"] for f in shaped.frames]
+    assert types == ["location_update", "control_applied", "location_update"]
+    assert json.loads(shaped.frames[-1])["data"]["latitude"] == -37.0
+
+
+def test_disconnect_cancels_pending_flush():
+    async def _run():
+        manager = ConnectionManager()
+        ws = _FakeWebSocket()
+        await manager.connect("user_device_67", ws, policy=DeliveryPolicy(max_hz=20))
+        await manager.broadcast_to_room("user_device_67", _location(-33.0))
+        await manager.broadcast_to_room("user_device_67", _location(-34.0))
+        await manager.disconnect("user_device_67", ws)
+        await asyncio.sleep(0.1)
+        return manager, ws
+
+    manager, ws = asyncio.run(_run())
+    assert len(ws.frames) == 1
+    assert manager.delivery == {}
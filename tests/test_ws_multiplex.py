@@ -0,0 +1,77 @@
+"""Unit tests for the multiplexed user WebSocket /v1/ws/users (DB calls patched out)."""
+
+from __future__ import annotations
+
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.endpoints import realtime_endpoints
+from api.websocket_manager import ConnectionManager
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(realtime_endpoints, "manager", ConnectionManager())
+    app = FastAPI()
+    app.include_router(realtime_endpoints.router, prefix="/v1")
+    with patch("api.endpoints.realtime_endpoints.connect", MagicMock()), patch(
+        "api.endpoints.realtime_endpoints.get_user_by_access_token",
+        return_value=SimpleNamespace(user_id=5),
+    ), patch(
+        "api.endpoints.realtime_endpoints.get_user_device_ids_async",
+        new_callable=AsyncMock,
+        return_value=frozenset({67, 68}),
+    ):
+        yield TestClient(app)
+
+
+def test_subscribe_joins_rooms_and_reports_denied(client):
+    with client.websocket_connect("/v1/ws/users?token=t") as ws:
+        ws.send_json({"type": "subscribe", "device_ids": [67, 99], "events": ["location", "geofence"]})
+        reply = ws.receive_json()
+
+        assert reply == {
+            "type": "subscribed",
+            "device_ids": [67],
+            "events": ["geofence", "location"],
+            "denied": [99],
+        }
+        rooms = realtime_endpoints.manager.active_connections
+        assert "user_device_67" in rooms and "geofence_67" in rooms
+        assert "user_device_99" not in rooms
+
+
+def test_broadcasts_for_all_devices_arrive_on_one_socket(client):
+    with client.websocket_connect("/v1/ws/users?token=t") as ws:
+        ws.send_json({"type": "subscribe", "device_ids": "*", "events": ["location"]})
+        assert ws.receive_json()["device_ids"] == [67, 68]
+
+        ws.portal.call(realtime_endpoints.broadcast_location_update, 67, {"latitude": 1.0, "longitude": 2.0})
+        ws.portal.call(realtime_endpoints.broadcast_location_update, 68, {"latitude": 3.0, "longitude": 4.0})
+
+        assert ws.receive_json()["device_id"] == 67
+        assert ws.receive_json()["device_id"] == 68
+
+
+def test_unsubscribe_leaves_rooms(client):
+    with client.websocket_connect("/v1/ws/users?token=t") as ws:
+        ws.send_json({"type": "subscribe", "device_ids": [67, 68]})
+        ws.receive_json()
+        ws.send_json({"type": "unsubscribe", "device_ids": [67], "events": ["location", "geofence"]})
+
+        assert ws.receive_json() == {"type": "unsubscribed", "device_ids": [67], "events": ["geofence", "location"]}
+        rooms = realtime_endpoints.manager.active_connections
+        assert "user_device_67" not in rooms
+        assert "user_device_68" in rooms
+
+
+def test_invalid_subscription_reports_error(client):
+    with client.websocket_connect("/v1/ws/users?token=t") as ws:
+        ws.send_json({"type": "subscribe", "device_ids": [67], "events": ["telemetry"]})
+        reply = ws.receive_json()
+        assert reply["type"] == "error"
+        assert "telemetry" in reply["detail"]
@@ -0,0 +1,100 @@
+"""Unit tests for the WebSocket replay log and resume-from-seq (no server or DB)."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+
+from api.services.ws_replay import ReplayLog
+from api.websocket_manager import ConnectionManager
+
+
+class _FakeWebSocket:
+    def __init__(self):
+        self.frames: list[str] = []
+
+    async def accept(self):
+        return None
+
+    async def send_text(self, data: str):
+        self.frames.append(data)
+
+    async def send_json(self, data):
+        self.frames.append(json.dumps(data))
+
+
+def test_seq_is_monotonic_per_device():
+    log = ReplayLog(maxlen=10)
+    seqs = [log.next_seq(67) for _ in range(5)]
+    assert seqs == sorted(seqs) and len(set(seqs)) == 5
+    assert log.last_seq(67) == seqs[-1]
+    assert log.last_seq(68) is None
+
+
+def test_since_filters_by_seq_and_room():
+    log = ReplayLog(maxlen=10)
+    s1, s2, s3 = (log.next_seq(67) for _ in range(3))
+    log.record(67, s1, ["user_device_67"], "a")
+    log.record(67, s2, ["geofence_67"], "b")
+    log.record(67, s3, ["device_67", "user_device_67"], "c")
+
+    frames, complete = log.since(67, s1, ["user_device_67"])
+    assert frames == ["c"]
+    assert complete is True
+
+
+def test_since_reports_evicted_history_as_incomplete():
+    log = ReplayLog(maxlen=2)
+    seqs = [log.next_seq(67) for _ in range(3)]
+    for seq, frame in zip(seqs, "abc"):
+        log.record(67, seq, ["user_device_67"], frame)
+
+    frames, complete = log.since(67, seqs[0] - 1, ["user_device_67"])
+    assert frames == ["b", "c"]
+    assert complete is False
+    # A client that already has the evicted message is not missing anything
+    assert log.since(67, seqs[0], ["user_device_67"]) == (["b", "c"], True)
+
+
+def test_since_before_process_start_is_incomplete():
+    log = ReplayLog(maxlen=10)
+    assert log.since(67, 1, ["user_device_67"]) == ([], False)
+
+
+def test_idle_rings_are_dropped():
+    log = ReplayLog(maxlen=10, idle_sec=60)
+    stale = log.next_seq(67) - 120_000  # last frame two minutes ago
+    log.record(67, stale, ["user_device_67"], "old")
+    log._last_sweep = 0  # sweep on the next record
+    log.record(68, log.next_seq(68), ["user_device_68"], "new")
+
+    assert log.stats()["devices"] == 1 and log.stats()["expired_devices"] == 1
+    assert log.since(67, stale - 1, ["user_device_67"]) == ([], False)
+    assert log.since(68, 0, ["user_device_68"])[0] == ["new"]
+
+
+def test_reconnecting_viewer_gets_missed_broadcasts():
+    async def _run():
+        manager = ConnectionManager()
+        first = _FakeWebSocket()
+        await manager.connect("user_device_67", first)
+        await manager.broadcast_to_room("user_device_67", {"type": "location_update", "device_id": 67, "data": {}})
+        last_seen = json.loads(first.frames[-1])["seq"]
+        await manager.disconnect("user_device_67", first)
+
+        # Broadcast while nobody is connected
+        await manager.broadcast_to_room("user_device_67", {"type": "control_applied", "device_id": 67})
+        await manager.broadcast_to_room("geofence_67", {"type": "geofence_breach", "device_id": 67})
+
+        again = _FakeWebSocket()
+        await manager.connect("user_device_67", again)
+        summary = await manager.replay_since(again, 67, ["user_device_67"], last_seen)
+        return again, summary
+
+    again, summary = asyncio.run(_run())
+
+    replayed = [json.loads(f) for f in again.frames]
+    assert [m["type"] for m in replayed] == ["control_applied", "replay_complete"]
+    assert summary["replayed"] == 1
+    assert summary["complete"] is True
+    assert summary["last_seq"] > replayed[0]["seq"]
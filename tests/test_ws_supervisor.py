@@ -0,0 +1,115 @@
+"""Unit tests for the WebSocket heartbeat/reaper supervisor (no server or DB)."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+
+from api.services.ws_supervisor import ConnectionSupervisor
+from api.websocket_manager import ConnectionManager
+
+
+class _FakeWebSocket:
+    def __init__(self, fail_send: bool = False):
+        self.sent: list[dict] = []
+        self.closed: tuple | None = None
+        self.fail_send = fail_send
+
+    async def accept(self):
+        return None
+
+    async def send_json(self, data):
+        if self.fail_send:
+            raise RuntimeError("socket gone")
+        self.sent.append(data)
+
+    async def send_text(self, data: str):
+        if self.fail_send:
+            raise RuntimeError("socket gone")
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed = (code, reason)
+
+
+def test_heartbeat_sent_to_quiet_viewer_but_not_device():
+    async def run():
+        sup = ConnectionSupervisor(idle_timeout=120, heartbeat_interval=30)
+        viewer, device = _FakeWebSocket(), _FakeWebSocket()
+        sup.register(viewer, label="viewer")
+        sup.register(device, label="device", heartbeat=False)
+        now = time.monotonic()
+        await sup.check(now + 31)
+        assert [m["type"] for m in viewer.sent] == ["ping"]
+        assert device.sent == []
+        # Not due again until another interval has passed since the ping
+        await sup.check(now + 40)
+        assert len(viewer.sent) == 1
+        assert viewer.closed is None and device.closed is None
+
+    asyncio.run(run())
+
+
+def test_silent_socket_is_reaped_and_removed_from_rooms():
+    async def run():
+        manager = ConnectionManager()
+        sup = ConnectionSupervisor(idle_timeout=60, heartbeat_interval=0)
+        ws = _FakeWebSocket()
+        await manager.connect("user_device_67", ws)
+        manager.join("geofence_67", ws)
+        sup.register(ws, label="viewer", on_reap=manager.disconnect_all)
+
+        await sup.check(time.monotonic() + 61)
+        assert ws.closed == (1000, "Idle timeout")
+        assert not any(manager.active_connections.values())
+        assert ws not in manager.socket_rooms
+        assert sup.stats()["reaped_total"] == 1 and sup.stats()["watched"] == 0
+
+    asyncio.run(run())
+
+
+def test_touch_defers_reap_and_unregister_stops_watching(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr("api.services.ws_supervisor.time.monotonic", lambda: clock[0])
+
+    async def run():
+        sup = ConnectionSupervisor(idle_timeout=60, heartbeat_interval=0)
+        ws = _FakeWebSocket()
+        sup.register(ws, label="device", heartbeat=False)
+        start = clock[0]
+        clock[0] = start + 30
+        sup.touch(ws)
+        await sup.check(start + 61)
+        assert ws.closed is None
+
+        sup.unregister(ws)
+        await sup.check(start + 1000)
+        assert ws.closed is None
+        assert sup.stats()["heap_entries"] == 0
+
+    asyncio.run(run())
+
+
+def test_failed_heartbeat_reaps_immediately():
+    async def run():
+        sup = ConnectionSupervisor(idle_timeout=120, heartbeat_interval=30)
+        ws = _FakeWebSocket(fail_send=True)
+        sup.register(ws, label="viewer")
+        await sup.check(time.monotonic() + 31)
+        assert ws.closed == (1000, "Idle timeout")
+        assert sup.stats()["watched"] == 0
+
+    asyncio.run(run())
+
+
+def test_viewer_that_never_replies_stays_connected():
+    async def run():
+        sup = ConnectionSupervisor(idle_timeout=120, heartbeat_interval=30)
+        viewer = _FakeWebSocket()
+        sup.register(viewer, label="viewer")
+        now = time.monotonic()
+        for step in range(1, 11):
+            await sup.check(now + step * 31)
+        assert viewer.closed is None
+        assert len(viewer.sent) == 10 and sup.stats()["reaped_total"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Benchmark: bytes on air for A-GNSS delivery, json (base64) vs binary chunk framing.
+
+For typical assistance sizes it reports the MQTT payload bytes, the total PUBLISH packet
+bytes (fixed header, topic, packet id) and the time to build all frames. The blob is
+random, as real ephemeris/almanac data does not compress.
+
+Usage:
+    python tools/bench_agnss_framing.py [--chunk 768] [--sizes 2048,4096,8192,16384]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from api.agnss.framing import iter_binary_frames, iter_json_frames  # noqa: E402
+
+
+def _remaining_length_bytes(n: int) -> int:
+    size = 1
+    while n >= 128:
+        n //= 128
+        size += 1
+    return size
+
+
+def _publish_packet_bytes(topic: str, payload_len: int, qos: int = 1) -> int:
+    """Size of an MQTT 3.1.1 PUBLISH packet carrying payload_len bytes."""
+    variable = 2 + len(topic.encode()) + (2 if qos else 0) + payload_len
+    return 1 + _remaining_length_bytes(variable) + variable
+
+
+def _measure(frames_fn, blob: bytes, chunk: int, topic: str, rounds: int = 200):
+    started = time.perf_counter()
+    for _ in range(rounds):
+        frames = list(frames_fn(blob, chunk))
+    build_us = (time.perf_counter() - started) / rounds * 1e6
+    payload = sum(len(f) for f in frames)
+    on_air = sum(_publish_packet_bytes(topic, len(f)) for f in frames)
+    return len(frames), payload, on_air, build_us
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--chunk", type=int, default=768)
+    parser.add_argument("--sizes", default="2048,4096,8192,16384")
+    args = parser.parse_args()
+
+    topic = "devices/12345/agnss_data"
+    print(f"chunk={args.chunk} bytes, topic={topic}, QoS 1")
+    print(f"{'blob':>7} {'format':<7} {'frames':>6} {'payload':>8} {'on-air':>8} {'overhead':>9} {'build':>9}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        blob = os.urandom(size)
+        for name, fn in (("json", iter_json_frames), ("binary", iter_binary_frames)):
+            frames, payload, on_air, build_us = _measure(fn, blob, args.chunk, topic)
+            overhead = (on_air - size) / size * 100
+            print(
+                f"{size:>7} {name:<7} {frames:>6} {payload:>8} {on_air:>8} {overhead:>8.1f}% {build_us:>7.1f}us"
+            )
+
+
+if __name__ == "__main__":
+    main()
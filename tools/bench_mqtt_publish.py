@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Benchmark: MQTT publishes via asyncio.to_thread + wait_for_publish vs the event-loop publisher.
+
+Sends N concurrent QoS 1 publishes with each approach and reports wall time, per-publish
+latency (p50/p99) and the peak number of threads. By default a minimal in-process broker
+(running on its own thread) is used so the numbers isolate client overhead; pass --host to
+use a real broker (e.g. the compose Mosquitto on 1883).
+
+Usage:
+    python tools/bench_mqtt_publish.py [--count 500] [--host 127.0.0.1 --port 1883]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import paho.mqtt.client as mqtt  # noqa: E402
+
+from api.services.mqtt_async import AsyncMqttPublisher  # noqa: E402
+
+
+async def _serve(reader, writer):
+    """Just enough MQTT 3.1.1 to ack: CONNACK, PUBACK, PINGRESP."""
+    try:
+        while True:
+            header = (await reader.readexactly(1))[0]
+            length, multiplier = 0, 1
+            while True:
+                byte = (await reader.readexactly(1))[0]
+                length += (byte & 0x7F) * multiplier
+                multiplier *= 128
+                if not byte & 0x80:
+                    break
+            body = await reader.readexactly(length)
+            kind = header & 0xF0
+            if kind == 0x10:
+                writer.write(b"\x20\x02\x00\x00")
+            elif kind == 0x30 and (header >> 1) & 0x03:
+                topic_len = int.from_bytes(body[:2], "big")
+                writer.write(b"\x40\x02" + body[2 + topic_len : 4 + topic_len])
+            elif kind == 0xC0:
+                writer.write(b"\xd0\x00")
+            elif kind == 0xE0:
+                break
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def _start_local_broker() -> int:
+    ready = threading.Event()
+    port_box = []
+
+    def run():
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(asyncio.start_server(_serve, "127.0.0.1", 0))
+        port_box.append(server.sockets[0].getsockname()[1])
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait()
+    return port_box[0]
+
+
+class _ThreadPeak:
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = False
+
+    async def watch(self):
+        while not self._stop:
+            self.peak = max(self.peak, threading.active_count())
+            await asyncio.sleep(0.001)
+
+
+def _report(name, wall, latencies, peak):
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    print(
+        f"{name:<22} wall={wall * 1000:8.1f} ms  p50={statistics.median(latencies):7.2f} ms  "
+        f"p99={p99:7.2f} ms  peak_threads={peak}"
+    )
+
+
+async def bench_threaded(host, port, count, payload):
+    client = mqtt.Client(callback_api_version=mqtt.CallbackAPIVersion.VERSION2, client_id="bench-threaded")
+    client.connect(host, port, keepalive=60)
+    client.loop_start()
+    await asyncio.sleep(0.2)
+
+    def publish_blocking(n):
+        info = client.publish(f"devices/{n % 50}/controls", payload, qos=1)
+        info.wait_for_publish(timeout=5)
+        return info.is_published()
+
+    async def one(n):
+        started = time.perf_counter()
+        ok = await asyncio.to_thread(publish_blocking, n)
+        return ok, (time.perf_counter() - started) * 1000.0
+
+    peak = _ThreadPeak()
+    watcher = asyncio.ensure_future(peak.watch())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(n) for n in range(count)))
+    wall = time.perf_counter() - started
+    peak._stop = True
+    await watcher
+    client.loop_stop()
+    client.disconnect()
+    assert all(ok for ok, _ in results)
+    _report("to_thread + wait", wall, [ms for _, ms in results], peak.peak)
+
+
+async def bench_async(host, port, count, payload):
+    publisher = AsyncMqttPublisher(host, port, "bench-async", max_inflight=100)
+    await publisher.start()
+    await publisher.wait_connected(5)
+
+    async def one(n):
+        started = time.perf_counter()
+        ok = await publisher.publish(f"devices/{n % 50}/controls", payload, qos=1)
+        return ok, (time.perf_counter() - started) * 1000.0
+
+    peak = _ThreadPeak()
+    watcher = asyncio.ensure_future(peak.watch())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one(n) for n in range(count)))
+    wall = time.perf_counter() - started
+    peak._stop = True
+    await watcher
+    await publisher.stop()
+    assert all(ok for ok, _ in results)
+    _report("asyncio publisher", wall, [ms for _, ms in results], peak.peak)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--host", default=None, help="real broker host (default: in-process broker)")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+
+    host, port = (args.host, args.port) if args.host else ("127.0.0.1", _start_local_broker())
+    payload = '{"type":"device_control_response","device_id":1,"control_1":true}'
+    print(f"{args.count} concurrent QoS 1 publishes to {host}:{port}")
+    await bench_threaded(host, port, args.count, payload)
+    await bench_async(host, port, args.count, payload)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: WebSocket room broadcast with per-socket send_json vs one pre-encoded frame.
+
+No server needed; sockets are in-process fakes, so the numbers isolate serialization cost.
+
+Usage:
+    python tools/bench_ws_broadcast.py [--rounds 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from api.endpoints.realtime_endpoints import ConnectionManager  # noqa: E402
+
+
+class _FakeWebSocket:
+    """Mimics Starlette: send_json encodes, then hands text to the transport."""
+
+    async def accept(self):
+        return None
+
+    async def send_text(self, data: str):
+        return None
+
+    async def send_json(self, data):
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+
+def _location_message(i: int) -> dict:
+    return {
+        "type": "location_update",
+        "device_id": 67,
+        "data": {
+            "device_id": 67,
+            "latitude": -33.8688 + i * 1e-5,
+            "longitude": 151.2093 + i * 1e-5,
+            "speed": 42.5,
+            "heading": 180.0,
+            "created_at": "2026-06-18T00:00:00+00:00",
+            "trip_active": True,
+        },
+        "timestamp": 1760000000000 + i,
+    }
+
+
+async def _per_socket(sockets, rounds: int) -> float:
+    start = time.perf_counter()
+    for i in range(rounds):
+        message = _location_message(i)
+        for ws in sockets:
+            await ws.send_json(message)
+    return time.perf_counter() - start
+
+
+async def _encode_once(manager: ConnectionManager, rounds: int) -> float:
+    start = time.perf_counter()
+    for i in range(rounds):
+        await manager.broadcast_to_room("user_device_67", _location_message(i))
+    return time.perf_counter() - start
+
+
+async def _run(listeners: int, rounds: int) -> tuple[float, float]:
+    manager = ConnectionManager()
+    sockets = [_FakeWebSocket() for _ in range(listeners)]
+    for ws in sockets:
+        await manager.connect("user_device_67", ws)
+    before = await _per_socket(sockets, rounds)
+    after = await _encode_once(manager, rounds)
+    return before, after
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'listeners':>9} {'send_json us/msg':>17} {'encode-once us/msg':>19} {'speedup':>8}")
+    for listeners in (1, 10, 1000):
+        before, after = asyncio.run(_run(listeners, args.rounds))
+        per_before = before / args.rounds * 1e6
+        per_after = after / args.rounds * 1e6
+        print(f"{listeners:>9} {per_before:>17.1f} {per_after:>19.1f} {per_before / per_after:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
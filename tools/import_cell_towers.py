@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Build the offline cell tower index used by CELL_LOCATION_PROVIDER=local (and the first
+stage of auto) from OpenCellID or Mozilla Location Service CSV exports.
+
+The output replaces the previous index atomically; running servers pick it up within
+CELL_TOWER_DB_CHECK_SEC.
+
+Usage:
+    python tools/import_cell_towers.py cell_towers.csv.gz [more.csv ...] \\
+        [-o cell_towers/cell_towers.idx] [--mcc 505,530] [--radio LTE,UMTS,GSM]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from api.services.local_cell_db import build_tower_index  # noqa: E402
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("csv", nargs="+", help="OpenCellID/MLS CSV files (plain or .gz)")
+    parser.add_argument("-o", "--output", default="cell_towers/cell_towers.idx")
+    parser.add_argument("--mcc", default="", help="Comma-separated MCCs to keep (default: all)")
+    parser.add_argument("--radio", default="LTE", help="Comma-separated radio types to keep (default: LTE)")
+    args = parser.parse_args()
+
+    mccs = {int(m) for m in args.mcc.split(",") if m.strip()} or None
+    radios = {r.strip().upper() for r in args.radio.split(",") if r.strip()} or None
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+
+    started = time.time()
+    counts = build_tower_index(args.csv, args.output, mcc_filter=mccs, radios=radios)
+    size_mb = os.path.getsize(args.output) / (1024 * 1024)
+    print(
+        f"read={counts['read']} imported={counts['imported']} skipped={counts['skipped']} "
+        f"duplicates={counts['duplicates']} -> {args.output} ({size_mb:.1f} MiB) "
+        f"in {time.time() - started:.1f}s"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())